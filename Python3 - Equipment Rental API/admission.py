@@ -0,0 +1,282 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Admission control: token buckets per client and per route, and a concurrency limit with priority lanes
+
+With ADMISSION_ENABLED, every request (but the ADMISSION_EXEMPT routes) is admitted in two steps
+before its handler runs:
+
+- rate: it takes a token from its client's bucket (ADMISSION_CLIENT_RATE requests per second,
+  bursts of ADMISSION_CLIENT_BURST) and from its route's bucket when ADMISSION_ROUTE_LIMITS sets
+  one (e.g. 'GET /Rental=50:100' for all the clients together).  An empty bucket answers 429 with
+  the seconds until the next token in Retry-After.  The buckets are kept in the process, or in
+  Redis (ADMISSION_BACKEND=redis) so every process and node shares them ('fakeredis' runs the
+  same path on the cache's in-process stand-in).
+- concurrency: at most ADMISSION_MAX_CONCURRENT requests run at once in the process (by default
+  as many as the pool has connections).  The listings and exports (GETs without an id or ids) are
+  the low lane: they may only take ADMISSION_LOW_SHARE of the slots, and only when no write or
+  entity lookup is waiting for one.  A request waits at most ADMISSION_MAX_WAIT_MS for a slot,
+  behind at most ADMISSION_MAX_WAITING others, then it's answered 503 with a Retry-After, so the
+  latency stays bounded instead of requests queueing in front of the pool.
+
+A request holds its slot until its handler returned: a streamed body is sent after the slot is
+freed.  Only the sync app is admitted (the limit waits with a thread lock).
+'''
+
+
+import contextvars
+import math
+import threading
+import time
+from collections import OrderedDict
+from cache import FakeRedis
+
+
+# the lane of the admitted request of this thread, to free its slot
+_admitted = contextvars.ContextVar( 'admitted_lane', default = None )
+
+
+# the client of a request: the value of the 'header' (set by a trusted proxy) or the address
+def client_of( request, header = '' ):
+  return ( header and request.headers.get( header ) ) or request.remote_addr or 'unknown'
+
+
+'''
+token buckets
+'''
+
+
+# buckets of the process, the least recently used dropped past 'max_entries' (a dropped bucket is full again)
+class MemoryBuckets:
+  def __init__( self, max_entries = 100000 ) -> None:
+    self.max_entries = max_entries
+    self.buckets     = OrderedDict()
+    self.lock        = threading.Lock()
+
+  # take 'cost' tokens from the bucket refilled with 'rate' tokens per second up to 'burst': the
+  # seconds to wait until they're available (0 when they were taken)
+  def take( self, key, rate, burst, cost = 1 ):
+    now = time.monotonic()
+    with self.lock:
+      tokens, updated = self.buckets.get( key, ( burst, now ) )
+      tokens = min( burst, tokens + ( now - updated ) * rate )
+      wait = 0.0
+      if tokens >= cost:
+        tokens -= cost
+      else:
+        wait = ( cost - tokens ) / rate
+      self.buckets[key] = ( tokens, now )
+      self.buckets.move_to_end( key )
+      while len( self.buckets ) > self.max_entries:
+        self.buckets.popitem( last = False )
+      return wait
+
+  def stats( self ):
+    return {"backend": "memory", "buckets": len( self.buckets )}
+
+
+# the same buckets refilled and taken in one script run by Redis (atomic, on the server's clock)
+TAKE_SCRIPT = '''
+local rate, burst, cost = tonumber( ARGV[1] ), tonumber( ARGV[2] ), tonumber( ARGV[3] )
+local clock = redis.call( 'TIME' )
+local now = tonumber( clock[1] ) + tonumber( clock[2] ) / 1000000
+local state = redis.call( 'HMGET', KEYS[1], 'tokens', 'updated' )
+local tokens = tonumber( state[1] ) or burst
+local updated = tonumber( state[2] ) or now
+tokens = math.min( burst, tokens + math.max( 0, now - updated ) * rate )
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+else
+  wait = ( cost - tokens ) / rate
+end
+redis.call( 'HSET', KEYS[1], 'tokens', tostring( tokens ), 'updated', tostring( now ) )
+redis.call( 'EXPIRE', KEYS[1], math.ceil( burst / rate ) + 1 )
+return tostring( wait )
+'''
+
+
+# the script for the FakeRedis stand-in: the same steps, with the bucket as one ( tokens, updated ) value
+def _take_locally( client, keys, args ):
+  rate, burst, cost = ( float( value ) for value in args )
+  now = time.time()
+  tokens, updated = client.get( keys[0] ) or ( burst, now )
+  tokens = min( burst, tokens + max( 0, now - updated ) * rate )
+  wait = 0.0
+  if tokens >= cost:
+    tokens -= cost
+  else:
+    wait = ( cost - tokens ) / rate
+  client.set( keys[0], ( tokens, now ), ex = math.ceil( burst / rate ) + 1 )
+  return str( wait )
+
+FakeRedis.scripts[TAKE_SCRIPT] = _take_locally
+
+
+# buckets shared by every process in a Redis server (anything with register_script, e.g. FakeRedis)
+class RedisBuckets:
+  def __init__( self, client, prefix = 'equipmentrental:bucket:', backend = 'redis' ) -> None:
+    self.prefix  = prefix
+    self.script  = client.register_script( TAKE_SCRIPT )
+    self.backend = backend
+    self.takes   = 0
+
+  def take( self, key, rate, burst, cost = 1 ):
+    self.takes += 1
+    return float( self.script( keys = [self.prefix + key], args = [rate, burst, cost] ) )
+
+  def stats( self ):
+    return {"backend": self.backend, "takes": self.takes}
+
+
+# the buckets selected by ADMISSION_BACKEND
+def bucket_store( config ):
+  backend = config.get( 'ADMISSION_BACKEND', 'memory' )
+  if backend == 'redis':
+    # only needed when the redis backend is selected
+    import redis
+    return RedisBuckets( redis.Redis.from_url( config['ADMISSION_REDIS_URL'] ) )
+  if backend == 'fakeredis':
+    return RedisBuckets( FakeRedis(), backend = backend )
+  return MemoryBuckets()
+
+
+# 'GET /Rental=50:100, ...' as {'GET /Rental': ( 50.0, 100.0 ), ...}
+def route_limits( value ):
+  limits = {}
+  for item in filter( None, ( part.strip() for part in value.split( ',' ) ) ):
+    route, _, limit = item.rpartition( '=' )
+    rate, _, burst = limit.partition( ':' )
+    limits[' '.join( route.split() )] = ( float( rate ), float( burst or rate ) )
+  return limits
+
+
+'''
+concurrency limit
+'''
+
+
+class ConcurrencyLimit:
+  def __init__( self, limit, low_share = 0.5, max_waiting = 64, max_wait = 0.05 ) -> None:
+    self.limit       = limit
+    # slots the low lane may hold (at least one)
+    self.low_limit   = max( 1, int( limit * low_share ) )
+    self.max_waiting = max_waiting
+    self.max_wait    = max_wait
+    self.condition   = threading.Condition()
+    self.active      = {"high": 0, "low": 0}
+    self.waiting     = {"high": 0, "low": 0}
+    self.peak        = 0
+
+  # take a slot for a request of the lane, waiting up to max_wait for one; False when none was free
+  def acquire( self, lane ):
+    with self.condition:
+      if not self._free( lane ):
+        if sum( self.waiting.values() ) >= self.max_waiting:
+          return False
+        self.waiting[lane] += 1
+        try:
+          if not self.condition.wait_for( lambda: self._free( lane ), self.max_wait ):
+            return False
+        finally:
+          self.waiting[lane] -= 1
+      self.active[lane] += 1
+      self.peak = max( self.peak, sum( self.active.values() ) )
+      return True
+
+  def release( self, lane ):
+    with self.condition:
+      self.active[lane] -= 1
+      self.condition.notify_all()
+
+  def _free( self, lane ):
+    if sum( self.active.values() ) >= self.limit:
+      return False
+    # the low lane leaves the slots to the high lane's waiting requests
+    return lane == 'high' or ( self.active['low'] < self.low_limit and not self.waiting['high'] )
+
+  def stats( self ):
+    with self.condition:
+      return {"limit": self.limit, "low_limit": self.low_limit, "active_high": self.active['high'], "active_low": self.active['low'], "waiting_high": self.waiting['high'], "waiting_low": self.waiting['low'], "peak": self.peak}
+
+
+'''
+the admission of the app's requests
+'''
+
+
+class Admission:
+  def __init__( self, config, buckets, limit ) -> None:
+    self.enabled       = config['ADMISSION_ENABLED']
+    self.buckets       = buckets
+    self.limit         = limit
+    self.client_rate   = config['ADMISSION_CLIENT_RATE']
+    self.client_burst  = config['ADMISSION_CLIENT_BURST']
+    self.client_header = config['ADMISSION_CLIENT_HEADER']
+    self.routes        = route_limits( config['ADMISSION_ROUTE_LIMITS'] )
+    self.exempt        = frozenset( filter( None, ( route.strip() for route in config['ADMISSION_EXEMPT'].split( ',' ) ) ) )
+    self.lock          = threading.Lock()
+    self.admitted      = 0
+    self.rejected      = {"client_rate": 0, "route_rate": 0, "concurrency": 0}
+
+  # None when the request is admitted, or ( status, reason, retry after seconds )
+  def admit( self, request ):
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    if rule is None or rule in self.exempt:
+      return None
+    route = f"{request.method} {rule}"
+    client = client_of( request, self.client_header )
+    if self.client_rate > 0:
+      wait = self.buckets.take( 'client:' + client, self.client_rate, self.client_burst )
+      if wait > 0:
+        return self._reject( 'client_rate', 429, wait )
+    if route in self.routes:
+      wait = self.buckets.take( 'route:' + route, *self.routes[route] )
+      if wait > 0:
+        return self._reject( 'route_rate', 429, wait )
+    # the listings wait behind the writes and the entity lookups (by id or by ids)
+    lane = 'low' if request.method in ( 'GET', 'HEAD' ) and 'id' not in ( request.view_args or {} ) and 'ids' not in request.args else 'high'
+    if not self.limit.acquire( lane ):
+      return self._reject( 'concurrency', 503, 1 )
+    _admitted.set( lane )
+    with self.lock:
+      self.admitted += 1
+    return None
+
+  # free the slot of this thread's admitted request
+  def done( self ):
+    lane = _admitted.get()
+    if lane is not None:
+      _admitted.set( None )
+      self.limit.release( lane )
+
+  def _reject( self, reason, status, wait ):
+    with self.lock:
+      self.rejected[reason] += 1
+    return status, reason, max( 1, math.ceil( wait ) )
+
+  def stats( self ):
+    with self.lock:
+      stats = {"enabled": self.enabled, "admitted": self.admitted, **{f"rejected_{reason}": count for reason, count in self.rejected.items()}}
+    return dict( stats, **self.limit.stats(), **self.buckets.stats() )
+
+
+# admit the requests of the (sync) app with the ADMISSION_* settings; 'pool_size' is the default
+# concurrency limit, 'reject( status, reason, retry_after )' builds the answer of a rejected request
+def init_admission( app, request, pool_size, reject ):
+  config = app.config
+  limit = ConcurrencyLimit( config['ADMISSION_MAX_CONCURRENT'] or pool_size, config['ADMISSION_LOW_SHARE'], config['ADMISSION_MAX_WAITING'], config['ADMISSION_MAX_WAIT_MS'] / 1000 )
+  admission = app.extensions['admission'] = Admission( config, bucket_store( config ) if config['ADMISSION_ENABLED'] else MemoryBuckets(), limit )
+  if not admission.enabled:
+    return admission
+
+  def start():
+    rejected = admission.admit( request )
+    if rejected is not None:
+      return reject( *rejected )
+
+  def end( exception = None ):
+    admission.done()
+
+  app.before_request( start )
+  app.teardown_request( end )
+  return admission
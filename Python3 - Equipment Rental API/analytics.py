@@ -0,0 +1,212 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Rental cost and the revenue/utilization rollups behind the /Analytics routes
+
+Every rental stores its cost (days * price * quantity, as quoted when it's booked) and its
+equipment's category at that time, and the rental writes add their deltas to a rollup table
+holding, per day (of the rental's start), equipment, category and customer, the number of rentals, units, unit-days and revenue.  The
+totals and top lists are read from the rollups; the ad-hoc date range queries are single
+GROUP BY statements over the rentals, so no rental is ever looped over in Python.
+'''
+
+
+import datetime
+from sqlalchemy import Date, Integer, String, cast, delete, desc, func, literal, select, union_all, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+
+# dimensions of the rollups, and the group names accepted by the routes
+DIMENSIONS = ( 'day', 'equipment', 'category', 'customer' )
+
+
+'''
+portable SQL for the date arithmetic
+'''
+
+
+# number of days from 'start' to 'end'
+class days_between( FunctionElement ):
+  type = Integer()
+  inherit_cache = True
+
+@compiles( days_between )
+def _days_between( element, compiler, **kw ):
+  end, start = list( element.clauses )
+  return f"({compiler.process( end, **kw )} - {compiler.process( start, **kw )})"
+
+@compiles( days_between, 'mysql' )
+def _days_between_mysql( element, compiler, **kw ):
+  end, start = list( element.clauses )
+  return f"DATEDIFF({compiler.process( end, **kw )}, {compiler.process( start, **kw )})"
+
+@compiles( days_between, 'sqlite' )
+def _days_between_sqlite( element, compiler, **kw ):
+  end, start = list( element.clauses )
+  return f"CAST(julianday({compiler.process( end, **kw )}) - julianday({compiler.process( start, **kw )}) AS INTEGER)"
+
+
+# smallest / largest of the values (LEAST/GREATEST, MIN/MAX in SQLite)
+class least( FunctionElement ):
+  inherit_cache = True
+
+class greatest( FunctionElement ):
+  inherit_cache = True
+
+@compiles( least )
+def _least( element, compiler, **kw ):
+  return f"LEAST({compiler.process( element.clauses, **kw )})"
+
+@compiles( least, 'sqlite' )
+def _least_sqlite( element, compiler, **kw ):
+  return f"MIN({compiler.process( element.clauses, **kw )})"
+
+@compiles( greatest )
+def _greatest( element, compiler, **kw ):
+  return f"GREATEST({compiler.process( element.clauses, **kw )})"
+
+@compiles( greatest, 'sqlite' )
+def _greatest_sqlite( element, compiler, **kw ):
+  return f"MAX({compiler.process( element.clauses, **kw )})"
+
+
+# what a rental costs: the price per unit and day, for every unit and day
+def rental_cost( start, end, price, quantity ):
+  return ( end - start ).days * price * quantity
+
+
+'''
+rollups
+'''
+
+
+class Analytics:
+  def __init__( self, rental, equipment, inventory, rollup ) -> None:
+    self.rental    = rental
+    self.equipment = equipment
+    self.inventory = inventory
+    # model of the rollup table ( dimension, key, rentals, units, unit_days, revenue )
+    self.rollup    = rollup
+
+  # add ( sign = 1 ) or take back ( sign = -1 ) the rentals to the rollups, in the caller's transaction
+  # (each rental is a ( customer_id, equipment_id, category, quantity, start, end, cost ) tuple)
+  def record( self, session, rentals, sign = 1 ):
+    deltas = {}
+    for customer_id, equipment_id, category, quantity, start, end, cost in rentals:
+      change = ( sign, sign * quantity, sign * quantity * ( end - start ).days, sign * ( cost or 0 ) )
+      for key in ( ( 'day', start.isoformat() ), ( 'equipment', str( equipment_id ) ), ( 'category', category ), ( 'customer', str( customer_id ) ) ):
+        total = deltas.get( key, ( 0, 0, 0, 0 ) )
+        deltas[key] = tuple( a + b for a, b in zip( total, change ) )
+    if deltas:
+      # always in the same order, so concurrent writers lock the rows in the same order
+      rows = [{"dimension": dimension, "key": key, "rentals": r, "units": u, "unit_days": d, "revenue": v} for ( dimension, key ), ( r, u, d, v ) in sorted( deltas.items() )]
+      self._upsert( session, rows )
+
+  # add the rows' values to the rollups, creating the missing ones, with one statement where the database can
+  def _upsert( self, session, rows ):
+    table   = self.rollup.__table__
+    dialect = session.get_bind().dialect.name
+    measures = ( 'rentals', 'units', 'unit_days', 'revenue' )
+    if dialect == 'mysql':
+      statement = mysql.insert( table )
+      statement = statement.on_duplicate_key_update( {name: table.c[name] + statement.inserted[name] for name in measures} )
+    elif dialect in ( 'sqlite', 'postgresql' ):
+      statement = ( sqlite if dialect == 'sqlite' else postgresql ).insert( table )
+      statement = statement.on_conflict_do_update( index_elements = ['dimension', 'key'], set_ = {name: table.c[name] + statement.excluded[name] for name in measures} )
+    else:
+      # one UPDATE per row, and an INSERT for the rows that don't exist yet
+      for row in rows:
+        changed = session.execute( update( table ).where( table.c.dimension == row['dimension'], table.c.key == row['key'] ).values( {name: table.c[name] + row[name] for name in measures} ) )
+        if changed.rowcount == 0:
+          try:
+            with session.begin_nested():
+              session.execute( table.insert(), row )
+          except IntegrityError:
+            session.execute( update( table ).where( table.c.dimension == row['dimension'], table.c.key == row['key'] ).values( {name: table.c[name] + row[name] for name in measures} ) )
+      return
+    session.execute( statement, rows )
+
+  # the ( customer_id, equipment_id, category, quantity, start, end, cost ) of the rentals with these ids
+  # (the category they were booked under, the equipment's current one for the rentals that didn't store it)
+  def rentals( self, session, ids ):
+    rental, equipment = self.rental, self.equipment
+    query = select( rental.customer_id, rental.equipment_id, self._columns()['category'], rental.quantity, rental.start, rental.end, rental.cost )
+    return session.execute( query.join( equipment, equipment.id == rental.equipment_id ).where( rental.id.in_( ids ) ) ).all()
+
+  # the ( price, category ) of each equipment
+  def prices( self, session, equipment_ids ):
+    equipment = self.equipment
+    rows = session.execute( select( equipment.id, equipment.price, equipment.category ).where( equipment.id.in_( set( equipment_ids ) ) ) )
+    return {id: ( price, category ) for id, price, category in rows}
+
+  # price and categorize the rentals without a cost or category (booked before they were stored) and recompute every rollup with GROUP BY
+  def rebuild( self, session ):
+    rental, equipment, table = self.rental, self.equipment, self.rollup.__table__
+    price = select( equipment.price ).where( equipment.id == rental.equipment_id ).scalar_subquery()
+    priced = session.execute( update( rental ).where( rental.cost.is_( None ) ).values( cost = days_between( rental.end, rental.start ) * price * rental.quantity ).execution_options( synchronize_session = False ) ).rowcount
+    category = select( equipment.category ).where( equipment.id == rental.equipment_id ).scalar_subquery()
+    session.execute( update( rental ).where( rental.category.is_( None ) ).values( category = category ).execution_options( synchronize_session = False ) )
+    session.execute( delete( table ) )
+    measures = ( func.count(), func.sum( rental.quantity ), func.sum( rental.quantity * days_between( rental.end, rental.start ) ), func.sum( rental.cost ) )
+    groups = []
+    for dimension, column in self._columns().items():
+      query = select( literal( dimension, String ), cast( column, String ), *measures )
+      if dimension == 'category':
+        query = query.join( equipment, equipment.id == rental.equipment_id )
+      groups.append( query.group_by( column ) )
+    session.execute( table.insert().from_select( ['dimension', 'key', 'rentals', 'units', 'unit_days', 'revenue'], union_all( *groups ) ) )
+    session.commit()
+    return {"priced": priced, "rollups": session.scalar( select( func.count() ).select_from( table ) )}
+
+  # the column of each dimension (the rentals without a stored category count under their equipment's)
+  def _columns( self ):
+    return {"day": self.rental.start, "equipment": self.rental.equipment_id, "category": func.coalesce( self.rental.category, self.equipment.category ), "customer": self.rental.customer_id}
+
+  # totals per key of a dimension, by revenue (by day for 'day'), read from the rollups or, for a date range of the rentals' start, grouped from the rentals
+  def revenue( self, session, dimension, start = None, end = None, limit = 10 ):
+    rollup, rental = self.rollup, self.rental
+    if ( start is None and end is None ) or dimension == 'day':
+      # the day rollups are keyed by the rentals' start, so they answer the ranges too
+      query = select( rollup.key, rollup.rentals, rollup.units, rollup.unit_days, rollup.revenue ).where( rollup.dimension == dimension, rollup.rentals != 0 )
+      if start is not None:
+        query = query.where( rollup.key >= start.isoformat() )
+      if end is not None:
+        query = query.where( rollup.key <= end.isoformat() )
+      query = query.order_by( rollup.key if dimension == 'day' else desc( rollup.revenue ) )
+    else:
+      column = self._columns()[dimension]
+      revenue = func.sum( rental.cost )
+      query = select( cast( column, String ), func.count(), func.sum( rental.quantity ), func.sum( rental.quantity * days_between( rental.end, rental.start ) ), revenue )
+      if dimension == 'category':
+        query = query.join( self.equipment, self.equipment.id == rental.equipment_id )
+      if start is not None:
+        query = query.where( rental.start >= start )
+      if end is not None:
+        query = query.where( rental.start <= end )
+      query = query.group_by( column ).order_by( desc( revenue ) )
+    rows = session.execute( query.limit( limit ) ).all()
+    return [{"key": key, "rentals": rentals, "units": units or 0, "unit_days": unit_days or 0, "revenue": round( revenue or 0, 2 )} for key, rentals, units, unit_days, revenue in rows]
+
+  # share of the units rented on the days of [start, end] (both included), per equipment or category
+  def utilization( self, session, dimension, start, end ):
+    rental, equipment, inventory = self.rental, self.equipment, self.inventory
+    first, after = literal( start, Date ), literal( end + datetime.timedelta( days = 1 ), Date )
+    days = ( end - start ).days + 1
+    column = equipment.category if dimension == 'category' else equipment.id
+    # unit-days of the rentals overlapping the range, counting only the days inside it
+    overlap = days_between( least( rental.end, after ), greatest( rental.start, first ) )
+    rented = select( column, func.sum( rental.quantity * overlap ) ).join( equipment, equipment.id == rental.equipment_id )
+    rented = dict( session.execute( rented.where( rental.start < after, rental.end > first ).group_by( column ) ).all() )
+    capacity = session.execute( select( column, func.sum( inventory.total ) ).join( equipment, equipment.id == inventory.equipment_id ).group_by( column ) ).all()
+    return sorted( [{"key": str( key ), "unit_days": rented.get( key ) or 0, "capacity": total * days, "utilization": round( ( rented.get( key ) or 0 ) / ( total * days ), 4 ) if total else 0.0} for key, total in capacity], key = lambda row: -row['utilization'] )
+
+  # all time totals and the top equipment, categories and customers by revenue
+  def summary( self, session, limit = 5 ):
+    rollup = self.rollup
+    totals = session.execute( select( func.sum( rollup.rentals ), func.sum( rollup.units ), func.sum( rollup.unit_days ), func.sum( rollup.revenue ) ).where( rollup.dimension == 'day' ) ).one()
+    data = {"rentals": totals[0] or 0, "units": totals[1] or 0, "unit_days": totals[2] or 0, "revenue": round( totals[3] or 0, 2 )}
+    for dimension in ( 'equipment', 'category', 'customer' ):
+      data[f"top_{dimension}"] = self.revenue( session, dimension, limit = limit )
+    return data
@@ -0,0 +1,596 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Async (ASGI) serving mode backed by SQLAlchemy's asyncio engine
+
+The same routes as main.py, written as async handlers with Quart (Flask's async twin), so a
+process can keep thousands of requests in flight while they wait on the database instead of
+holding a thread per connection.  The models, schemas, cache, booking, bulk and availability
+code are shared with the sync app, which stays available with 'python main.py'.
+
+The async app is kept at the sync app's features up to the analytics: the entity routes (lists
+with paging, streaming, filters, search and ?ids=, batch-get and bulk writes), the bookings,
+/Availability, /Analytics, /Cache, /Pool and /metrics.  The features added since run in the sync
+app only, as they're built on its thread-bound sessions and locks: the conditional GETs (ETag,
+304) and the compression, Idempotency-Key (its POSTs are answered 501), the admission control, the group commit, /Changes,
+/Export, the read replicas and the in-process replica, and the rental returns scheduler (the
+async routes follow its rules, see booking.py).  The writes of both apps go to the change log
+and bump the table versions alike, so a sync process serves them too.  Its documentation page
+leaves out the requests it doesn't serve.
+
+Requirements:  pip install quart uvicorn aiomysql   (or aiosqlite for local testing)
+Running:       uvicorn asgi:app --workers 4
+'''
+
+
+import datetime
+import functools
+import json
+import re
+from quart import Quart, Response, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import HTTPException
+
+import main
+from main import Customer, Equipment, Inventory, Rental
+from main import CustomerSchema, EquipmentSchema, InventorySchema, RentalSchema
+from main import customer_rows, equipment_rows, inventory_rows, rental_rows, rental_detail_schema
+from main import CUSTOMER_FIELDS, EQUIPMENT_FIELDS, INVENTORY_FIELDS, RENTAL_FIELDS
+from main import CUSTOMER_FILTERS, CUSTOMER_SORTS, EQUIPMENT_FILTERS, EQUIPMENT_SORTS
+from main import analytics, prepare_rentals
+from analytics import DIMENSIONS, rental_cost
+from availability import AvailabilityIndex
+from booking import holds, rebook, release, reserve
+from bulk import DEFAULT_CHUNK_SIZE, bulk_create, bulk_delete, bulk_update, positive
+from cache import cache_key, create_cache
+from database import engine_options, pool_stats
+from metrics import init_metrics
+from multiget import in_order, load_many, parse_ids
+from filtering import filter_message, list_filters
+from pagination import STREAM_CHUNK_SIZE, argument_message, cursor_of, ordering, page_arguments, seek, wants_page, wants_stream
+from search import SearchIndex
+from serializer import RowSerializer, json_provider
+
+
+# initialize the app in quart, with the settings of the sync app
+app = Quart( __name__ )
+app.config.update( main.app.config )
+app.json = json_provider( app )
+# the database is set with ASYNC_DATABASE_URI (aiomysql by default), the pool with the same DB_* settings
+engine  = create_async_engine( app.config["ASYNC_DATABASE_URI"], **engine_options( app.config, app.config["ASYNC_DATABASE_URI"], timed = False ) )
+Session = async_sessionmaker( engine, expire_on_commit = False )
+cache   = create_cache( app.config )
+# the same request metrics as the sync app (the profiler is only available there)
+metrics = init_metrics( app, engine.sync_engine, request, asynchronous = True )
+
+
+# the rentals of one equipment, read with the sync session that run_sync provides
+def rental_periods( session, equipment_id ):
+  return session.execute( select( Rental.start, Rental.end, Rental.quantity ).where( Rental.equipment_id == equipment_id ) ).all()
+
+availability = AvailabilityIndex( None, app.config["AVAILABILITY_MAX_AGE"] )
+
+
+# the documents of the equipment search index, read with the sync session that run_sync provides
+def catalogue_documents( session ):
+  return session.execute( select( Equipment.id, Equipment.name, Equipment.description ) ).all()
+
+catalogue = SearchIndex( None, app.config["SEARCH_MAX_AGE"] )
+
+
+'''
+helpers
+'''
+
+
+# build a json response with a status code
+def respond( body, status_code = 200 ):
+  response = jsonify( body )
+  response.status_code = status_code
+  return response
+
+
+# refuse a POST sent with an Idempotency-Key (only the sync app stores the answers of the keys), rather
+# than running it without the protection the client asked for, so a retry can't write it twice
+def refuse_idempotency( view ):
+  @functools.wraps( view )
+  async def wrapper( *args, **kwargs ):
+    if 'Idempotency-Key' in request.headers:
+      return respond( {"message": "Idempotency-Key is only supported by the sync app, send the request there or without the header"}, 501 )
+    return await view( *args, **kwargs )
+  return wrapper
+
+
+# every row of the query as one JSON document per line, reading the rows in chunks with a server side cursor
+def stream_rows( query, schema ):
+  dumps = app.json.dumps
+  async def generate():
+    async with Session() as session:
+      chunked = query.execution_options( yield_per = STREAM_CHUNK_SIZE )
+      # column tuples for the row serializers, ORM objects for the schemas
+      rows = await ( session.stream( chunked ) if isinstance( schema, RowSerializer ) else session.stream_scalars( chunked ) )
+      async for row in rows:
+        yield dumps( schema.dump( row, many = False ) ) + '\n'
+  return Response( generate(), mimetype = 'application/x-ndjson' )
+
+
+# same list responses as pagination.list_response: a stream, a keyset page or the whole table
+async def list_response( query, key_column, schema, message, order = None ):
+  if wants_stream( request ):
+    return stream_rows( query.order_by( *ordering( key_column, order ) ), schema )
+  async with Session() as session:
+    fetch = session.execute if isinstance( schema, RowSerializer ) else session.scalars
+    if not wants_page( request ):
+      rows = ( await fetch( query.order_by( *ordering( key_column, order ) ) ) ).all()
+      return jsonify( {"message": message, "data": schema.dump( rows, many = True )} )
+    try:
+      limit, after = page_arguments( request.args, order )
+    except ValueError as error:
+      return respond( {"message": argument_message( str( error ) )}, 400 )
+    if after is not None:
+      query = query.where( seek( key_column, order, after ) )
+    rows = ( await fetch( query.order_by( *ordering( key_column, order ) ).limit( limit + 1 ) ) ).all()
+  has_more = len( rows ) > limit
+  rows = rows[:limit]
+  next_cursor = cursor_of( rows[-1], key_column, order ) if has_more else None
+  return jsonify( {"message": message, "data": schema.dump( rows, many = True ), "next_cursor": next_cursor} )
+
+
+# read the rows of a bulk request from a JSON array or NDJSON
+async def read_rows():
+  if request.mimetype == 'application/x-ndjson':
+    lines = ( await request.get_data( as_text = True ) ).splitlines()
+    return [json.loads( line ) for line in lines if line.strip()]
+  rows = await request.get_json()
+  if not isinstance( rows, list ):
+    raise ValueError( "The body must be a JSON array or NDJSON" )
+  return rows
+
+
+'''
+application documentation route
+'''
+
+
+@app.route( '/', methods = ['GET'] )
+async def api_doc():
+  return API_DOCS
+
+# the documentation of the sync app, without the requests this app doesn't serve (by the first
+# example of each row), and with a note on the features it leaves out
+def async_api_docs():
+  adapter = app.url_map.bind( 'localhost' )
+  def served( row ):
+    cells = re.findall( r'<td>(.*?)</td>', row.group( 0 ), re.S )
+    methods = cells[1].split( ' / ' ) if len( cells ) > 1 else []
+    # (the headers and the endpoint list stay)
+    if not methods or not set( methods ) <= { 'GET', 'POST', 'PUT', 'DELETE' }:
+      return row.group( 0 )
+    path = re.sub( r'\{[^}]*\}', '1', cells[0].split( '<br>' )[0].split( '?' )[0] )
+    try:
+      for method in methods:
+        adapter.match( path, method = method )
+    except HTTPException:
+      return ''
+    return row.group( 0 )
+  docs = re.sub( r'\n    <tr>.*?</tr>', served, main.API_DOCS, flags = re.S )
+  note = "<p>Served by the async app (asgi.py): the conditional GETs, the compression, Idempotency-Key, the admission control, the group commit and the read replicas are only available in the sync app (see the README).</p>"
+  return docs.replace( '<hr>', '<hr>\n  ' + note, 1 )
+
+
+'''
+cache statistics route
+'''
+
+
+@app.route( '/Cache', methods = ['GET'] )
+async def get_cache_stats():
+  return jsonify( {"message": "Cache statistics provided", "data": cache.stats()} )
+
+
+@app.route( '/Pool', methods = ['GET'] )
+async def get_pool_stats():
+  return jsonify( {"message": "Pool statistics provided", "data": pool_stats( engine.sync_engine )} )
+
+
+@app.route( '/metrics', methods = ['GET'] )
+async def get_metrics():
+  return Response( metrics.render( {"db_pool": pool_stats( engine.sync_engine ), "cache": cache.stats()} ), mimetype = 'text/plain; version=0.0.4' )
+
+
+'''
+entity routes (equipment, customer and inventory share the same handlers, rentals book inventory)
+'''
+
+
+# name, model, key, schema, row serializer, bulk fields and the wording of the messages for each entity
+ENTITIES = [
+  ( 'Equipment', Equipment, 'id',           EquipmentSchema, equipment_rows, EQUIPMENT_FIELDS, 'equipment', "Equipment",      "Equipment added to the system",      "All equipment provided", "Equipment provided" ),
+  ( 'Customer',  Customer,  'id',           CustomerSchema,  customer_rows,  CUSTOMER_FIELDS,  'customer',  "Customer",       "Customer added to the system",       "All customers provided", "Customer provided" ),
+  ( 'Inventory', Inventory, 'equipment_id', InventorySchema, inventory_rows, INVENTORY_FIELDS, 'inventory', "Inventory item", "Item added to the system inventory", "All inventory provided", "Inventory provided" ),
+  ( 'Rental',    Rental,    'id',           RentalSchema,    rental_rows,    RENTAL_FIELDS,    'rental',    "Rental item",    None,                                 "All rentals provided",   "Rental provided" ),
+]
+
+# filters and sortable columns of the lists that have them
+FILTERS = {
+  'Equipment': ( EQUIPMENT_FILTERS, EQUIPMENT_SORTS ),
+  'Customer':  ( CUSTOMER_FILTERS, CUSTOMER_SORTS ),
+}
+
+
+# add the routes of an entity ('add_handler', 'update_handler' and 'delete_handler' replace the generic ones)
+def register( name, model, key, schema, rows, fields, entity, label, added, listed, provided, add_handler = None, update_handler = None, delete_handler = None ):
+  key_column = getattr( model, key )
+
+  # route to get all the entities
+  async def get_all():
+    # 'ids=3,1,2' returns these entities only, in that order (the other arguments don't apply)
+    if 'ids' in request.args:
+      return await multi_get( request.args['ids'] )
+    if model is Rental and request.args.get( 'expand' ):
+      expand = request.args['expand'].split( ',' )
+      if any( part not in ( 'customer', 'equipment' ) for part in expand ):
+        return respond( {"message": "Query parameter 'expand' only accepts 'customer' and 'equipment'"}, 400 )
+      query = select( Rental ).options( *[selectinload( getattr( Rental, part ) ) for part in expand] )
+      return await list_response( query, key_column, rental_detail_schema( tuple( sorted( set( expand ) ) ) ), listed )
+    conditions, order = [], None
+    if name in FILTERS:
+      filters, sorts = FILTERS[name]
+      search = request.args.get( 'search' )
+      if model is Equipment and search:
+        # search the index on the async connection, then filter on the ids found
+        loader = lambda session: catalogue.search( search, functools.partial( catalogue_documents, session ) )
+        async with Session() as session:
+          ids = await session.run_sync( loader )
+        filters = {**filters, 'search': lambda value: Equipment.id.in_( ids )}
+      try:
+        conditions, order = list_filters( request.args, filters, sorts )
+      except ValueError as error:
+        return respond( {"message": filter_message( str( error ), sorts )}, 400 )
+    return await list_response( select( *rows.columns ).where( *conditions ), key_column, rows, listed, order )
+
+  # route to get one entity
+  async def get_one( id ):
+    async def load():
+      async with Session() as session:
+        return schema().dump( await session.get( model, id ) ) or None
+    data = await cache.fetch_async( cache_key( entity, id ), load )
+    if data:
+      return jsonify( {"message": provided, "data": data} )
+    return respond( {"message": f"{label} with id ({id}) was not found in the system"}, 404 )
+
+  # the entities with the ids ('ids' is the ?ids= string or the batch-get body), in their order, and
+  # the ids not found; the ones not cached are read together on the async connection
+  async def multi_get( ids ):
+    try:
+      ids = parse_ids( ids, app.config["MULTI_GET_MAX_IDS"] )
+    except ValueError as error:
+      return respond( {"message": str( error )}, 400 )
+    async def load( missing ):
+      async with Session() as session:
+        return await session.run_sync( load_many, rows, key_column, missing, app.config["MULTI_GET_CHUNK_SIZE"] )
+    data, missing = in_order( ids, await cache.fetch_many_async( entity, ids, load ) )
+    return jsonify( {"message": provided, "data": data, "missing": missing} )
+
+  # route to get many entities by id in one request (the ids in a JSON body, for long lists)
+  async def batch_get():
+    return await multi_get( await request.get_json( silent = True ) )
+
+  # route to create an entity
+  async def add():
+    request_data = await request.get_json()
+    async with Session() as session:
+      new_entity = model( **{field: request_data[field] for field in fields} )
+      session.add( new_entity )
+      await session.commit()
+      cache.forget( entity, getattr( new_entity, key ) )
+      if model is Equipment:
+        catalogue.add( new_entity.id, new_entity.name, new_entity.description )
+    return jsonify( {"message": added} )
+
+  # route to update an entity
+  async def update_one( id ):
+    async with Session() as session:
+      current = await session.get( model, id )
+      if not current:
+        return respond( {"message": f"{label} with id ({id}) was not found in the system"}, 404 )
+      request_data = await request.get_json()
+      for field in fields:
+        setattr( current, field, request_data[field] )
+      await session.commit()
+      cache.forget( entity, id, getattr( current, key ) )
+      if model is Equipment:
+        catalogue.add( current.id, current.name, current.description )
+    return jsonify( {"message": f"{label} with id ({id}) updated in the system"} )
+
+  # route to delete an entity
+  async def delete_one( id ):
+    async with Session() as session:
+      current = await session.get( model, id )
+      if not current:
+        return respond( {"message": f"{label} with id ({id}) was not found in the system"}, 404 )
+      await session.delete( current )
+      try:
+        await session.commit()
+      except IntegrityError:
+        await session.rollback()
+        return respond( {"message": f"{label} with id ({id}) has rentals and can't be deleted"}, 409 )
+      cache.forget( entity, id )
+      if model is Equipment:
+        catalogue.remove( current.id )
+    return jsonify( {"message": f"{label} with id ({id}) was deleted from the system"} )
+
+  # route to create (POST), update (PUT) or delete (DELETE) many entities in one request
+  async def bulk():
+    try:
+      rows = await read_rows()
+    except ValueError as error:
+      return respond( {"message": f"Could not read the submitted rows: {error}"}, 400 )
+    chunk_size = app.config.get( 'BULK_CHUNK_SIZE', DEFAULT_CHUNK_SIZE )
+    prepare = functools.partial( prepare_rentals, method = request.method ) if model is Rental else None
+    async with Session() as session:
+      # the bulk operations are synchronous code, run them on the async connection
+      if request.method == 'POST':
+        results = await session.run_sync( bulk_create, model, fields, rows, chunk_size, prepare )
+      elif request.method == 'PUT':
+        results = await session.run_sync( bulk_update, model, key, fields, rows, chunk_size, prepare )
+      else:
+        results = await session.run_sync( bulk_delete, model, key, rows, chunk_size, prepare )
+      booked = session.info.pop( 'booked', () )
+    cache.forget( entity, *[result[key] for result in results if result['status'] in ( 'updated', 'deleted' )] )
+    cache.forget( 'inventory', *booked )
+    availability.forget( *booked )
+    if model is Equipment:
+      catalogue.forget()
+    summary = {}
+    for result in results:
+      summary[result['status']] = summary.get( result['status'], 0 ) + 1
+    return jsonify( {"message": f"Processed {len( rows )} rows", "summary": summary, "results": results} )
+
+  app.add_url_rule( f'/{name}', f'add_{entity}', refuse_idempotency( add_handler or add ), methods = ['POST'] )
+  app.add_url_rule( f'/{name}', f'get_all_{entity}', get_all, methods = ['GET'] )
+  app.add_url_rule( f'/{name}/<id>', f'get_{entity}', get_one, methods = ['GET'] )
+  app.add_url_rule( f'/{name}/<id>', f'delete_{entity}', delete_handler or delete_one, methods = ['DELETE'] )
+  app.add_url_rule( f'/{name}/<id>', f'update_{entity}', update_handler or update_one, methods = ['PUT'] )
+  app.add_url_rule( f'/{name}/batch-get', f'batch_get_{entity}', batch_get, methods = ['POST'] )
+  app.add_url_rule( f'/{name}/bulk', f'bulk_{entity}', bulk, methods = ['POST', 'PUT', 'DELETE'] )
+
+
+'''
+rentals application routes (they reserve and give back inventory)
+'''
+
+
+# route to create a new rental entry
+async def add_rental():
+  request_data = await request.get_json()
+  customer_id  = request_data['customer_id']
+  equipment_id = request_data['equipment_id']
+  quantity     = request_data['quantity']
+  if isinstance( quantity, bool ) or not isinstance( quantity, int ) or quantity < 1:
+    return respond( {"message": "The quantity must be a positive integer"}, 400 )
+  try:
+    start = datetime.date.fromisoformat( request_data['start'] )
+    end   = datetime.date.fromisoformat( request_data['end'] )
+  except ( TypeError, ValueError ):
+    return respond( {"message": "The 'start' and 'end' dates must be formatted as YYYY-MM-DD"}, 400 )
+  if end < start:
+    return respond( {"message": "The 'end' date must be on or after the 'start' date"}, 400 )
+  since = availability.begin()
+  async with Session() as session:
+    details = ( await session.execute( select( Customer.f_name, Equipment.price, Equipment.category ).join( Equipment, Equipment.id == equipment_id ).where( Customer.id == customer_id ) ) ).first()
+    if details is None:
+      return respond( {"message": f"Customer with id ({customer_id}) or equipment with id ({equipment_id}) was not found in the system"}, 404 )
+    # reserve the units in the same transaction as the rental
+    if not await session.run_sync( reserve, Inventory, equipment_id, quantity ):
+      await session.rollback()
+      return respond( {"message": f"There are not enough units of equipment with id ({equipment_id}) available to rent {quantity}"}, 409 )
+    days  = ( end - start ).days
+    total = rental_cost( start, end, details.price, quantity )
+    new_rental = Rental( customer_id=customer_id, equipment_id=equipment_id, quantity=quantity, start=start, end=end, cost=total, category=details.category )
+    session.add( new_rental )
+    await session.run_sync( analytics.record, [( customer_id, equipment_id, details.category, quantity, start, end, total )] )
+    await session.commit()
+  cache.forget( 'rental', new_rental.id )
+  cache.forget( 'inventory', equipment_id )
+  availability.add( equipment_id, start, end, quantity, since )
+  return jsonify( {"message": f"Entry added to the system rentals.  {details.f_name} owes ${total} for {days} days of use."} )
+
+
+# route to update a specific rental
+async def update_rental( id ):
+  request_data = await request.get_json()
+  try:
+    positive( request_data['quantity'] )
+  except ValueError:
+    return respond( {"message": "The quantity must be a positive integer"}, 400 )
+  try:
+    start = datetime.date.fromisoformat( request_data['start'] )
+    end   = datetime.date.fromisoformat( request_data['end'] )
+  except ( TypeError, ValueError ):
+    return respond( {"message": "The 'start' and 'end' dates must be formatted as YYYY-MM-DD"}, 400 )
+  if end < start:
+    return respond( {"message": "The 'end' date must be on or after the 'start' date"}, 400 )
+  since = availability.begin()
+  async with Session() as session:
+    # (a locking read, so a return of the rental waits for the update, or the update for the return)
+    rental = await session.get( Rental, id, with_for_update = True )
+    if not rental:
+      return respond( {"message": f"Rental item with id ({id}) was not found in the system"}, 404 )
+    # the price and category of the old and new equipment (for the new cost and the rollups)
+    prices = await session.run_sync( analytics.prices, [rental.equipment_id, request_data['equipment_id']] )
+    if request_data['equipment_id'] not in prices:
+      return respond( {"message": f"Equipment with id ({request_data['equipment_id']}) was not found in the system"}, 404 )
+    if ( await session.execute( select( Customer.id ).where( Customer.id == request_data['customer_id'] ) ) ).first() is None:
+      return respond( {"message": f"Customer with id ({request_data['customer_id']}) was not found in the system"}, 404 )
+    old_period = ( rental.equipment_id, rental.start, rental.end, rental.quantity )
+    old_rental = ( rental.customer_id, rental.equipment_id, rental.category or prices[rental.equipment_id][1], rental.quantity, rental.start, rental.end, rental.cost )
+    # (a returned rental holds no units, it's booked again when its end moves past today)
+    holding = holds( rental.returned, end )
+    if not await session.run_sync( rebook, Inventory, rental.equipment_id, rental.quantity, request_data['equipment_id'], request_data['quantity'], rental.returned is None, holding ):
+      await session.rollback()
+      return respond( {"message": f"There are not enough units of equipment with id ({request_data['equipment_id']}) available to rent {request_data['quantity']}"}, 409 )
+    rental.customer_id  = request_data['customer_id']
+    rental.equipment_id = request_data['equipment_id']
+    rental.quantity     = request_data['quantity']
+    rental.start        = start
+    rental.end          = end
+    rental.cost         = rental_cost( start, end, prices[rental.equipment_id][0], rental.quantity )
+    rental.category     = prices[rental.equipment_id][1]
+    if holding:
+      rental.returned   = None
+    new_rental = ( rental.customer_id, rental.equipment_id, rental.category, rental.quantity, start, end, rental.cost )
+    await session.run_sync( analytics.record, [old_rental], -1 )
+    await session.run_sync( analytics.record, [new_rental] )
+    await session.commit()
+  cache.forget( 'rental', id )
+  cache.forget( 'inventory', old_period[0], request_data['equipment_id'] )
+  availability.remove( *old_period, since )
+  availability.add( request_data['equipment_id'], start, end, request_data['quantity'], since )
+  return jsonify( {"message": f"Rental item with id ({id}) updated in the system"} )
+
+
+# route to delete a specific rental
+async def delete_rental( id ):
+  since = availability.begin()
+  async with Session() as session:
+    rental = await session.get( Rental, id, with_for_update = True )
+    if not rental:
+      return respond( {"message": f"Rental item with id ({id}) was not found in the system"}, 404 )
+    period = ( rental.equipment_id, rental.start, rental.end, rental.quantity )
+    # (the units of a returned rental are back in the inventory already)
+    if rental.returned is None:
+      await session.run_sync( release, Inventory, rental.equipment_id, rental.quantity )
+    await session.run_sync( lambda sync_session: analytics.record( sync_session, analytics.rentals( sync_session, [rental.id] ), -1 ) )
+    await session.delete( rental )
+    await session.commit()
+  cache.forget( 'rental', id )
+  cache.forget( 'inventory', period[0] )
+  availability.remove( *period, since )
+  return jsonify( {"message": f"Rental item with id ({id}) was deleted from the system"} )
+
+
+for entity in ENTITIES[:-1]:
+  register( *entity )
+register( *ENTITIES[-1], add_handler = add_rental, update_handler = update_rental, delete_handler = delete_rental )
+
+
+'''
+availability application routes
+'''
+
+
+# read the 'start' and 'end' dates of an availability query (returns the dates or an error response)
+def availability_range():
+  try:
+    start = datetime.date.fromisoformat( request.args.get( 'start', '' ) )
+    end   = datetime.date.fromisoformat( request.args.get( 'end', '' ) )
+  except ValueError:
+    return None, None, respond( {"message": "Query parameters 'start' and 'end' must be dates formatted as YYYY-MM-DD"}, 400 )
+  if end < start or ( end - start ).days >= app.config["AVAILABILITY_MAX_DAYS"]:
+    return None, None, respond( {"message": f"The range must end on or after its start and cover at most {app.config['AVAILABILITY_MAX_DAYS']} days"}, 400 )
+  return start, end, None
+
+
+# free units of several equipment on each day of the range (the index is loaded on the async connection)
+async def equipment_availability( session, totals, start, end ):
+  def compute( sync_session ):
+    data = []
+    for equipment_id, total in totals:
+      occupancy = availability.occupancy( equipment_id, start, end, functools.partial( rental_periods, sync_session ) )
+      days = [{"date": ( start + datetime.timedelta( days = offset ) ).isoformat(), "rented": rented, "available": max( total - rented, 0 )} for offset, rented in enumerate( occupancy )]
+      data.append( {"equipment_id": equipment_id, "total": total, "min_available": min( day['available'] for day in days ), "days": days} )
+    return data
+  return await session.run_sync( compute )
+
+
+@app.route( '/Availability/<int:equipment_id>', methods = ['GET'] )
+async def get_availability( equipment_id ):
+  start, end, error = availability_range()
+  if error:
+    return error
+  async with Session() as session:
+    inventory = await session.get( Inventory, equipment_id )
+    if not inventory:
+      return respond( {"message": f"Inventory item with id ({equipment_id}) was not found in the system"}, 404 )
+    data = await equipment_availability( session, [( equipment_id, inventory.total )], start, end )
+  return jsonify( {"message": "Availability provided", "data": data[0]} )
+
+
+@app.route( '/Availability', methods = ['GET'] )
+async def get_availabilities():
+  start, end, error = availability_range()
+  if error:
+    return error
+  try:
+    equipment_ids = [int( id ) for id in request.args.get( 'equipment_ids', '' ).split( ',' ) if id]
+  except ValueError:
+    return respond( {"message": "Query parameter 'equipment_ids' must be a comma separated list of ids"}, 400 )
+  async with Session() as session:
+    totals = dict( ( await session.execute( select( Inventory.equipment_id, Inventory.total ).where( Inventory.equipment_id.in_( equipment_ids ) ) ) ).all() )
+    data = await equipment_availability( session, [( equipment_id, totals[equipment_id] ) for equipment_id in equipment_ids if equipment_id in totals], start, end )
+  missing = [equipment_id for equipment_id in equipment_ids if equipment_id not in totals]
+  return jsonify( {"message": "Availability provided", "data": data, "missing": missing} )
+
+
+'''
+analytics application routes
+'''
+
+
+# read the optional 'start'/'end' dates and the 'limit' of an analytics query (returns them or an error response)
+def analytics_arguments( default_limit ):
+  try:
+    start = datetime.date.fromisoformat( request.args['start'] ) if request.args.get( 'start' ) else None
+    end   = datetime.date.fromisoformat( request.args['end'] ) if request.args.get( 'end' ) else None
+  except ValueError:
+    return None, None, None, respond( {"message": "Query parameters 'start' and 'end' must be dates formatted as YYYY-MM-DD"}, 400 )
+  try:
+    limit = int( request.args.get( 'limit', default_limit ) )
+    if limit < 1:
+      raise ValueError
+  except ValueError:
+    return None, None, None, respond( {"message": "Query parameter 'limit' must be a positive integer"}, 400 )
+  return start, end, min( limit, 1000 ), None
+
+
+@app.route( '/Analytics', methods = ['GET'] )
+async def get_analytics():
+  _, _, limit, error = analytics_arguments( 5 )
+  if error:
+    return error
+  async with Session() as session:
+    data = await session.run_sync( analytics.summary, limit )
+  return jsonify( {"message": "Analytics provided", "data": data} )
+
+
+@app.route( '/Analytics/revenue', methods = ['GET'] )
+async def get_revenue():
+  group = request.args.get( 'group', 'day' )
+  if group not in DIMENSIONS:
+    return respond( {"message": f"Query parameter 'group' must be one of {', '.join( DIMENSIONS )}"}, 400 )
+  start, end, limit, error = analytics_arguments( 100 )
+  if error:
+    return error
+  async with Session() as session:
+    data = await session.run_sync( analytics.revenue, group, start, end, limit )
+  return jsonify( {"message": "Revenue provided", "data": data} )
+
+
+@app.route( '/Analytics/utilization', methods = ['GET'] )
+async def get_utilization():
+  group = request.args.get( 'group', 'category' )
+  if group not in ( 'category', 'equipment' ):
+    return respond( {"message": "Query parameter 'group' must be one of category, equipment"}, 400 )
+  start, end, error = availability_range()
+  if error:
+    return error
+  async with Session() as session:
+    data = await session.run_sync( analytics.utilization, group, start, end )
+  return jsonify( {"message": "Utilization provided", "data": data} )
+
+
+# (once every route is registered)
+API_DOCS = async_api_docs()
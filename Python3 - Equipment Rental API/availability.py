@@ -0,0 +1,170 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Per-day occupancy index answering "how many units are free on each day of a range"
+
+Every rental occupies its units from its 'start' day up to (not including) its 'end' day,
+the same days it is charged for.  For each equipment the index keeps a difference array
+over the days (+quantity on 'start', -quantity on 'end') and a Fenwick tree over it, so
+the occupancy of the first day of a range is a O(log n) prefix sum and every following
+day is one more addition: a k day query costs O(log n + k), whatever the number of rentals.
+'''
+
+
+import datetime
+import threading
+import time
+from array import array
+
+
+# smallest number of days allocated for an equipment
+MIN_DAYS = 64
+
+
+# day number of a date (or of an ISO formatted date)
+def ordinal( value ):
+  if isinstance( value, str ):
+    value = datetime.date.fromisoformat( value )
+  return value.toordinal()
+
+
+'''
+occupancy of one equipment
+'''
+
+
+class DayIndex:
+  def __init__( self, first_day, last_day ) -> None:
+    # leave room on both sides so the usual bookings don't need a rebuild
+    self.origin = first_day - MIN_DAYS
+    self.deltas = array( 'q', bytes( 8 * max( MIN_DAYS, last_day - self.origin + MIN_DAYS ) ) )
+    self.tree   = array( 'q', self.deltas )
+
+  # occupy (or free, with a negative quantity) the units on the days [start, end)
+  def add( self, start, end, quantity ):
+    if end <= start or quantity == 0:
+      return
+    self._cover( start, end )
+    self._update( start - self.origin, quantity )
+    self._update( end - self.origin, -quantity )
+
+  # number of occupied units on each day of [start, end)
+  def occupancy( self, start, end ):
+    days = []
+    position = start - self.origin
+    # before the first known day nothing is rented
+    running = self._prefix( min( position, len( self.deltas ) - 1 ) ) if position >= 0 else 0
+    for day in range( start, end ):
+      days.append( running )
+      position = day + 1 - self.origin
+      if 0 <= position < len( self.deltas ):
+        running += self.deltas[position]
+    return days
+
+  # Fenwick tree point update
+  def _update( self, position, value ):
+    self.deltas[position] += value
+    position += 1
+    while position <= len( self.tree ):
+      self.tree[position - 1] += value
+      position += position & -position
+
+  # Fenwick tree prefix sum of the deltas up to (and including) position
+  def _prefix( self, position ):
+    total = 0
+    position += 1
+    while position > 0:
+      total += self.tree[position - 1]
+      position -= position & -position
+    return total
+
+  # grow the arrays (rebuilding the tree in O(n)) when a booking falls outside them
+  def _cover( self, start, end ):
+    if start >= self.origin and end < self.origin + len( self.deltas ):
+      return
+    origin = min( self.origin, start - MIN_DAYS )
+    size   = max( 2 * len( self.deltas ), max( end, self.origin + len( self.deltas ) ) - origin + MIN_DAYS )
+    deltas = array( 'q', bytes( 8 * size ) )
+    deltas[self.origin - origin:self.origin - origin + len( self.deltas )] = self.deltas
+    tree = array( 'q', deltas )
+    for position in range( 1, size + 1 ):
+      parent = position + ( position & -position )
+      if parent <= size:
+        tree[parent - 1] += tree[position - 1]
+    self.origin, self.deltas, self.tree = origin, deltas, tree
+
+
+'''
+indexes of all the equipment, built on first use and then kept in step by the rental writes
+'''
+
+
+class AvailabilityIndex:
+  def __init__( self, loader, max_age = 300 ) -> None:
+    # loader( equipment_id ) returns the ( start, end, quantity ) of the equipment's rentals
+    self.loader   = loader
+    # rebuild an index after this many seconds, to pick up writes made by other processes
+    self.max_age  = max_age
+    # table_version() returns the version of the rentals table: an index loaded at an older version
+    # is reloaded, as another process may have booked since
+    self.table_version = lambda: 0
+    self.indexes  = {}
+    # number of writes seen per equipment, to detect the ones racing with a load
+    self.versions = {}
+    # counts the writes begun and the indexes stored, to tell which indexes were stored after a write began
+    self.clock    = 0
+    self.lock     = threading.Lock()
+
+  # occupied units for each day of [start, end] (both dates included), 'loader' replaces the default one for this call
+  def occupancy( self, equipment_id, start, end, loader = None ):
+    index = self._index( equipment_id, loader or self.loader )
+    with self.lock:
+      return index.occupancy( ordinal( start ), ordinal( end ) + 1 )
+
+  # call before writing a rental, and pass what it returns to add/remove once the write is committed
+  def begin( self ):
+    with self.lock:
+      self.clock += 1
+      return self.clock
+
+  # record a committed rental ('since' is what begin() returned before the write)
+  def add( self, equipment_id, start, end, quantity, since ):
+    with self.lock:
+      self.versions[equipment_id] = self.versions.get( equipment_id, 0 ) + 1
+      entry = self.indexes.get( equipment_id )
+      # equipment that isn't indexed yet will read the rental when it's loaded
+      if entry is None:
+        return
+      # an index stored after the write began may have read the rental already, so load it again
+      if entry[3] > since:
+        del self.indexes[equipment_id]
+      else:
+        entry[1].add( ordinal( start ), ordinal( end ), quantity )
+
+  # record a committed rental deletion
+  def remove( self, equipment_id, start, end, quantity, since ):
+    self.add( equipment_id, start, end, -quantity, since )
+
+  # drop the indexes of equipment whose rentals changed in ways that weren't recorded
+  def forget( self, *equipment_ids ):
+    with self.lock:
+      for equipment_id in equipment_ids:
+        self.versions[equipment_id] = self.versions.get( equipment_id, 0 ) + 1
+        self.indexes.pop( equipment_id, None )
+
+  def _index( self, equipment_id, loader ):
+    table_version = self.table_version()
+    with self.lock:
+      entry   = self.indexes.get( equipment_id )
+      version = self.versions.get( equipment_id, 0 )
+    if entry is not None and time.monotonic() - entry[0] < self.max_age and entry[2] >= table_version:
+      return entry[1]
+    today = datetime.date.today().toordinal()
+    index = DayIndex( today, today )
+    for start, end, quantity in loader( equipment_id ):
+      index.add( ordinal( start ), ordinal( end ), quantity )
+    with self.lock:
+      # keep the index only if no write for this equipment happened while it was loading
+      if self.versions.get( equipment_id, 0 ) == version:
+        self.clock += 1
+        self.indexes[equipment_id] = ( time.monotonic(), index, table_version, self.clock )
+    return index
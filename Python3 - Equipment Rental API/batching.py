@@ -0,0 +1,213 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Group commit: a background writer that commits many small writes in one transaction
+
+With GROUP_COMMIT_ENABLED, the hot write routes (POST /Rental, PUT /Inventory/{id}) hand their
+write to a queue instead of committing it themselves.  A writer thread collects the queued
+writes for up to GROUP_COMMIT_MAX_DELAY_MS milliseconds or GROUP_COMMIT_MAX_BATCH writes,
+applies them in one transaction and commits once; the waiting requests are answered only after
+that commit, so an acknowledged write is durable.  Writes to the same key in a batch (e.g. two
+updates of one inventory row) are merged into the last one.  When GROUP_COMMIT_MAX_PENDING
+writes are already waiting, new ones are turned away (503) instead of queueing without bound, and
+a request waits GROUP_COMMIT_TIMEOUT seconds at most for its batch's commit.
+'''
+
+
+import queue
+import threading
+import time
+
+
+# raised when the queue is full (the route answers 503 with a Retry-After)
+class Overloaded( Exception ):
+  pass
+
+
+# raised when a write the writer had started wasn't committed in time: it may still be (the route answers 504)
+class TimedOut( Exception ):
+  pass
+
+
+# one queued write, and the outcome its request waits for
+class Write:
+  def __init__( self, apply, key ) -> None:
+    # apply( session ) runs the write in the batch's transaction and returns its result
+    self.apply  = apply
+    # writes with the same key (not None) in a batch are merged into the last one
+    self.key    = key
+    # 'queued', 'taken' by the writer, or 'abandoned' by its request (then it isn't applied)
+    self.state  = 'queued'
+    self.done   = threading.Event()
+    self.result = None
+    self.error  = None
+
+  def finish( self, result = None, error = None ):
+    self.result, self.error = result, error
+    self.done.set()
+
+
+class GroupCommitter:
+  def __init__( self, db, max_delay_ms = 2, max_batch = 200, max_pending = 10000, timeout = 30.0 ) -> None:
+    # the app the writer runs in, set by init_app()
+    self.app       = None
+    self.db        = db
+    self.max_delay = max_delay_ms / 1000
+    self.max_batch = max_batch
+    # seconds a request waits for the commit of its write
+    self.timeout   = timeout
+    self.queue     = queue.Queue( max_pending )
+    self.lock      = threading.Lock()
+    self.thread    = None
+    # flush statistics
+    self.batches   = 0
+    self.writes    = 0
+    self.merged    = 0
+    self.retried   = 0
+    self.failed    = 0
+    self.rejected  = 0
+    self.timed_out = 0
+    self.largest   = 0
+    self.flush_total = 0.0
+    self.flush_max   = 0.0
+
+  # run the writer in the app, with its GROUP_COMMIT_* settings (before the first write)
+  def init_app( self, app ):
+    self.app       = app
+    self.max_delay = app.config['GROUP_COMMIT_MAX_DELAY_MS'] / 1000
+    self.max_batch = app.config['GROUP_COMMIT_MAX_BATCH']
+    self.queue     = queue.Queue( app.config['GROUP_COMMIT_MAX_PENDING'] )
+    self.timeout   = app.config['GROUP_COMMIT_TIMEOUT']
+
+  # in a forked process: the writer thread (and the writes it was given) stayed in the parent
+  def after_fork( self ):
+    self.lock   = threading.Lock()
+    self.queue  = queue.Queue( self.queue.maxsize )
+    self.thread = None
+
+  # queue the write and wait for the commit of its batch; returns what apply( session ) returned
+  def submit( self, apply, key = None ):
+    self._start()
+    write = Write( apply, key )
+    try:
+      self.queue.put_nowait( write )
+    except queue.Full:
+      with self.lock:
+        self.rejected += 1
+      raise Overloaded( f"{self.queue.maxsize} writes are already waiting to be committed" )
+    if not write.done.wait( self.timeout ):
+      with self.lock:
+        self.timed_out += 1
+        # not taken by the writer yet: it never will be, the write is turned away
+        if write.state == 'queued':
+          write.state = 'abandoned'
+          raise Overloaded( f"the write wasn't committed within {self.timeout:g}s" )
+      # the writer is applying it: its outcome is unknown until that batch ends
+      if not write.done.wait( self.timeout ):
+        raise TimedOut( f"the write wasn't committed within {2 * self.timeout:g}s, it may still be" )
+    if write.error is not None:
+      raise write.error
+    return write.result
+
+  def stats( self ):
+    with self.lock:
+      return {
+        "pending": self.queue.qsize(),
+        "max_pending": self.queue.maxsize,
+        "batches": self.batches,
+        "writes": self.writes,
+        "merged": self.merged,
+        "retried_batches": self.retried,
+        "failed_writes": self.failed,
+        "rejected": self.rejected,
+        "timed_out": self.timed_out,
+        "largest_batch": self.largest,
+        "average_batch": round( self.writes / self.batches, 2 ) if self.batches else 0,
+        "flush_seconds_total": round( self.flush_total, 6 ),
+        "flush_seconds_max": round( self.flush_max, 6 ),
+      }
+
+  # start the writer on the first write (so a forked worker starts its own)
+  def _start( self ):
+    if self.thread is not None:
+      return
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread( target = self._run, name = 'group-commit', daemon = True )
+        self.thread.start()
+
+  def _run( self ):
+    while True:
+      batch = [self.queue.get()]
+      deadline = time.monotonic() + self.max_delay
+      while len( batch ) < self.max_batch:
+        try:
+          # take what's already waiting, then wait for more until the deadline
+          batch.append( self.queue.get_nowait() )
+        except queue.Empty:
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            break
+          try:
+            batch.append( self.queue.get( timeout = remaining ) )
+          except queue.Empty:
+            break
+      self._flush( batch )
+
+  def _flush( self, batch ):
+    started = time.perf_counter()
+    with self.lock:
+      # the writes their requests stopped waiting for are left out
+      batch = [write for write in batch if write.state == 'queued']
+      for write in batch:
+        write.state = 'taken'
+    if not batch:
+      return
+    # the last write of each key stands for the earlier ones
+    last = {write.key: index for index, write in enumerate( batch ) if write.key is not None}
+    applied = [write for index, write in enumerate( batch ) if write.key is None or last[write.key] == index]
+    retried = False
+    try:
+      with self.app.app_context():
+        session = self.db.session
+        try:
+          results = [( write.apply( session ), None ) for write in applied]
+          session.commit()
+        except Exception:
+          session.rollback()
+          results, retried = None, True
+        if results is None:
+          # one write made the batch fail: commit each write on its own so only that one fails
+          results = []
+          for write in applied:
+            try:
+              result = write.apply( session )
+              session.commit()
+            except Exception as error:
+              session.rollback()
+              results.append( ( None, error ) )
+            else:
+              results.append( ( result, None ) )
+      outcome = {write.key: result for write, result in zip( applied, results ) if write.key is not None}
+      for write, ( result, error ) in zip( applied, results ):
+        write.finish( result, error )
+      for write in batch:
+        if not write.done.is_set():
+          write.finish( *outcome[write.key] )
+      failed = sum( 1 for _, error in results if error is not None )
+    except Exception as error:
+      # anything else (e.g. no app context, a rollback failing): the writes still waiting fail with it
+      failed = 0
+      for write in batch:
+        if not write.done.is_set():
+          write.finish( error = error )
+          failed += 1
+    elapsed = time.perf_counter() - started
+    with self.lock:
+      self.batches     += 1
+      self.writes      += len( batch )
+      self.merged      += len( batch ) - len( applied )
+      self.retried     += retried
+      self.failed      += failed
+      self.largest      = max( self.largest, len( batch ) )
+      self.flush_total += elapsed
+      self.flush_max    = max( self.flush_max, elapsed )
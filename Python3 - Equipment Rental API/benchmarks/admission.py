@@ -0,0 +1,117 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Admission control benchmark: the counter staff's requests while an integration floods the listings
+
+An integration requests the whole rental list from many threads while the counter staff looks up
+customers and books rentals, a few requests per second.  The run is done on a threaded server
+without the admission control, then with it (a bucket on GET /Rental, the per-client buckets and a
+concurrency limit) with the buckets in the process, then with the buckets behind the Redis script
+(on the in-process stand-in, ADMISSION_BACKEND=fakeredis), and reports the latencies of the staff
+and the statuses of both.
+
+Usage: python benchmarks/admission.py [flood threads] [seconds] [rentals]
+(on a new SQLite file unless DATABASE_URI is set to a scratch database)
+'''
+
+
+import collections
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# run against the app in the parent folder
+APP_FOLDER = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' )
+sys.path.insert( 0, APP_FOLDER )
+
+# the admission settings of the runs with the admission control
+LIMITS = {
+  "ADMISSION_ENABLED": True,
+  "ADMISSION_CLIENT_HEADER": 'X-Client-Id',
+  "ADMISSION_CLIENT_RATE": 50.0,
+  "ADMISSION_CLIENT_BURST": 100.0,
+  "ADMISSION_ROUTE_LIMITS": 'GET /Rental=5:10',
+  "ADMISSION_MAX_CONCURRENT": 4,
+}
+
+
+# send requests until 'stop' is set, recording their latency and status
+def client( port, name, requests, stop, latencies, statuses, pause = 0 ):
+  connection = http.client.HTTPConnection( '127.0.0.1', port, timeout = 60 )
+  headers = {"X-Client-Id": name, "Content-Type": "application/json"}
+  try:
+    for method, url, body in requests:
+      if stop.is_set():
+        break
+      sent = time.perf_counter()
+      try:
+        connection.request( method, url, body = body, headers = headers )
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+      except ( OSError, http.client.HTTPException ):
+        connection.close()
+        status = 0
+      latencies.append( time.perf_counter() - sent )
+      statuses[status] += 1
+      time.sleep( pause )
+  finally:
+    connection.close()
+
+
+def run( app, data, threads, seconds ):
+  from benchmarks.suite.drivers import Server
+  server = Server( app )
+  stop = threading.Event()
+  staff_latencies, staff_statuses = [], collections.Counter()
+  flood_latencies, flood_statuses = [], collections.Counter()
+
+  def staff_requests():
+    while True:
+      yield 'GET', f"/Customer/{data.customer()}", None
+      yield 'POST', '/Rental', f'{{"customer_id": {data.customer()}, "equipment_id": {data.equipment_id()}, "quantity": 1, "start": "2024-07-01", "end": "2024-07-03"}}'
+
+  def flood_requests():
+    while True:
+      yield 'GET', '/Rental', None
+
+  workers = [threading.Thread( target = client, args = ( server.port, 'counter', staff_requests(), stop, staff_latencies, staff_statuses, 0.05 ) )]
+  workers += [threading.Thread( target = client, args = ( server.port, 'integration', flood_requests(), stop, flood_latencies, flood_statuses ) ) for _ in range( threads )]
+  for thread in workers:
+    thread.start()
+  time.sleep( seconds )
+  stop.set()
+  for thread in workers:
+    thread.join()
+  server.stop()
+  return sorted( staff_latencies ), staff_statuses, flood_statuses
+
+
+def main( threads = 16, seconds = 10, rentals = 5000 ):
+  # a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+  if not os.environ.get( 'DATABASE_URI' ):
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-admission-' ), 'admission.db' )
+  import main as api
+  from benchmarks.suite.report import percentile
+  from benchmarks.suite.seed import seed
+  data = seed( api, 200, 50, rentals )
+
+  runs = (
+    ( 'without admission control', {"ADMISSION_ENABLED": False} ),
+    ( 'with admission control', LIMITS ),
+    ( 'with admission control, buckets in (fake) Redis', {**LIMITS, "ADMISSION_BACKEND": 'fakeredis'} ),
+  )
+  for label, settings in runs:
+    app = api.create_app( type( 'BenchmarkConfig', ( api.Config, ), settings ) )
+    latencies, staff, flood = run( app, data, threads, seconds )
+    milliseconds = lambda fraction: percentile( latencies, fraction ) * 1000
+    print( f"{label}:" )
+    print( f"  counter staff: {len( latencies )} requests, p50 {milliseconds( 0.50 ):.1f} ms  p95 {milliseconds( 0.95 ):.1f} ms  p99 {milliseconds( 0.99 ):.1f} ms  max {latencies[-1] * 1000:.1f} ms, statuses {dict( sorted( staff.items() ) )}" )
+    print( f"  integration:   {sum( flood.values() )} requests ({sum( flood.values() ) / seconds:.1f}/s), statuses {dict( sorted( flood.items() ) )}" )
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main( *[int( argument ) for argument in sys.argv[1:]] ) )
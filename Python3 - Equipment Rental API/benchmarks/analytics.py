@@ -0,0 +1,81 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Benchmark for the /Analytics queries over a large rental history
+
+Seeds the rentals with bulk inserts (without a cost, as the rentals booked before it was
+stored), rebuilds the rollups, and times the analytics routes: the all time summary and the
+day ranges read the rollups, the equipment ranges and the utilization group the rentals.
+
+Usage: python benchmarks/analytics.py [rentals] [equipment] [customers]
+(on a new SQLite file unless DATABASE_URI is set to a scratch database)
+'''
+
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+# a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+if not os.environ.get( 'DATABASE_URI' ):
+  os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-analytics-' ), 'analytics.db' )
+from main import analytics, app, db, init_db, Customer, Equipment, Inventory, Rental
+
+
+CATEGORIES = ( 'Tools', 'Garden', 'Party', 'Lifting', 'Cleaning', 'Power' )
+
+
+# time a request, best of 'repeat' runs, in ms
+def timed( client, method, url, repeat = 3 ):
+  best = None
+  for _ in range( repeat ):
+    started  = time.perf_counter()
+    response = client.open( url, method = method )
+    elapsed  = ( time.perf_counter() - started ) * 1000
+    assert response.status_code == 200, ( url, response.status_code, response.get_data( as_text = True ) )
+    best = elapsed if best is None else min( best, elapsed )
+  return best
+
+
+def main( rentals = 1000000, equipment = 1000, customers = 10000, chunk = 50000 ):
+  random.seed( 12 )
+  first = datetime.date( 2020, 1, 1 )
+  started = time.perf_counter()
+  with app.app_context():
+    init_db()
+    db.session.execute( Equipment.__table__.insert(), [{"name": f"Item {index}", "price": round( random.uniform( 5, 200 ), 2 ), "category": CATEGORIES[index % len( CATEGORIES )], "description": "Analytics benchmark"} for index in range( equipment )] )
+    db.session.execute( Customer.__table__.insert(), [{"f_name": "Bench", "l_name": f"Mark {index}", "address": "1 Load St.", "city": "Somewhere", "state": "MI", "phone": f"{index:010d}"} for index in range( customers )] )
+    equipment_ids = db.session.scalars( db.select( Equipment.id ) ).all()
+    customer_ids  = db.session.scalars( db.select( Customer.id ) ).all()
+    db.session.execute( Inventory.__table__.insert(), [{"equipment_id": id, "total": 50, "rented": 0} for id in equipment_ids] )
+    for offset in range( 0, rentals, chunk ):
+      rows = []
+      for _ in range( min( chunk, rentals - offset ) ):
+        start = first + datetime.timedelta( days = random.randrange( 1800 ) )
+        rows.append( {"customer_id": random.choice( customer_ids ), "equipment_id": random.choice( equipment_ids ), "quantity": random.randint( 1, 5 ), "start": start, "end": start + datetime.timedelta( days = random.randint( 1, 14 ) )} )
+      db.session.execute( Rental.__table__.insert(), rows )
+    db.session.commit()
+    print( f"seeded {rentals} rentals, {equipment} equipment and {customers} customers in {time.perf_counter() - started:.1f}s" )
+    # what 'flask --app main rebuild-analytics' runs
+    started = time.perf_counter()
+    analytics.rebuild( db.session )
+    print( f"rebuild-analytics: {( time.perf_counter() - started ) * 1000:.0f} ms" )
+
+  client = app.test_client()
+  for url in ( '/Analytics',
+               '/Analytics/revenue?group=day&start=2022-01-01&end=2022-12-31&limit=1000',
+               '/Analytics/revenue?group=customer&limit=10',
+               '/Analytics/revenue?group=equipment&start=2022-01-01&end=2022-03-31&limit=10',
+               '/Analytics/utilization?group=category&start=2022-07-01&end=2022-07-31',
+               '/Analytics/utilization?group=equipment&start=2022-01-01&end=2022-12-31' ):
+    # (the test client sends no If-None-Match, so every request is computed)
+    print( f"GET {url}: {timed( client, 'GET', url ):.1f} ms" )
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main( *[int( argument ) for argument in sys.argv[1:]] ) )
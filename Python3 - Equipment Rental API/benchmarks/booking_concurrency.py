@@ -0,0 +1,79 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Concurrency benchmark for the rental bookings
+
+Many threads try to rent the same equipment at once.  The benchmark checks that the
+inventory is never overbooked and reports the booking throughput.
+
+Usage: python benchmarks/booking_concurrency.py [threads] [requests per thread] [units in stock]
+(with GROUP_COMMIT_ENABLED=1 the bookings go through the group commit writer)
+(on a new SQLite file unless DATABASE_URI is set to a scratch database)
+'''
+
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+# a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+if not os.environ.get( 'DATABASE_URI' ):
+  os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-booking-concurrency-' ), 'booking_concurrency.db' )
+# the scheduled returns would give units back while the benchmark counts them
+os.environ['RETURNS_ENABLED'] = '0'
+from main import app, db, group_commit, init_db, Customer, Equipment, Inventory, Rental
+
+
+def main( threads = 16, requests_per_thread = 50, stock = 200 ):
+  # one customer and one hot equipment, with fewer units than the total number of booking attempts
+  with app.app_context():
+    init_db()
+    customer = Customer( f_name = "Bench", l_name = "Mark", address = "1 Load St.", city = "Somewhere", state = "MI", phone = "000-000-0000" )
+    db.session.add( customer )
+    equipment = Equipment( name = "Benchmark Drill", price = 10.0, category = "Benchmark", description = "Hot equipment for the booking benchmark" )
+    db.session.add( equipment )
+    db.session.commit()
+    equipment_id = equipment.id
+    customer_id  = customer.id
+    db.session.add( Inventory( equipment_id = equipment_id, total = stock, rented = 0 ) )
+    db.session.commit()
+
+  outcomes = {}
+  lock     = threading.Lock()
+
+  def worker():
+    client = app.test_client()
+    for _ in range( requests_per_thread ):
+      response = client.post( '/Rental', json = {"customer_id": customer_id, "equipment_id": equipment_id, "quantity": 1, "start": "2024-07-01", "end": "2024-07-03"} )
+      with lock:
+        outcomes[response.status_code] = outcomes.get( response.status_code, 0 ) + 1
+
+  workers = [threading.Thread( target = worker ) for _ in range( threads )]
+  started = time.perf_counter()
+  for thread in workers:
+    thread.start()
+  for thread in workers:
+    thread.join()
+  elapsed = time.perf_counter() - started
+
+  # compare what the clients were told with what the database holds
+  with app.app_context():
+    inventory = db.session.get( Inventory, equipment_id )
+    booked    = db.session.query( db.func.coalesce( db.func.sum( Rental.quantity ), 0 ) ).filter( Rental.equipment_id == equipment_id ).scalar()
+  attempts = threads * requests_per_thread
+  print( f"attempts: {attempts}  accepted (200): {outcomes.get( 200, 0 )}  rejected (409): {outcomes.get( 409, 0 )}  other: {attempts - outcomes.get( 200, 0 ) - outcomes.get( 409, 0 )}" )
+  print( f"stock: {inventory.total}  rented: {inventory.rented}  booked in rentals: {booked}" )
+  print( f"throughput: {attempts / elapsed:.1f} requests/s over {elapsed:.2f}s with {threads} threads" )
+  if app.config['GROUP_COMMIT_ENABLED']:
+    stats = group_commit.stats()
+    print( f"group commit: {stats['batches']} batches, {stats['average_batch']} writes per batch (largest {stats['largest_batch']}), {stats['flush_seconds_max'] * 1000:.1f} ms longest flush" )
+  overbooked = inventory.rented > inventory.total or booked != inventory.rented or outcomes.get( 200, 0 ) != booked
+  print( "FAIL: the inventory was overbooked" if overbooked else "OK: no overbooking" )
+  return 1 if overbooked else 0
+
+
+if __name__ == '__main__':
+  sys.exit( main( *[int( argument ) for argument in sys.argv[1:]] ) )
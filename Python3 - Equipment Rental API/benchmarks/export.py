@@ -0,0 +1,63 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Export benchmark: the whole rental table through the JSON list and through /Export
+
+Seeds the rentals, then reads the whole table as JSON (marshmallow's dump of the ORM objects, the
+previous list path, and GET /Rental, the current one) and through /Export in each format,
+reporting the time (best of 'repeats'), the size and the peak of the memory allocated by Python
+while the body is produced (measured in a separate run, tracemalloc slows everything down).
+
+Usage: python benchmarks/export.py [rentals] [repeats]
+(on a new SQLite file unless DATABASE_URI is set to a scratch database)
+'''
+
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+
+def main( rentals = 100000, repeats = 3 ):
+  # a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+  if not os.environ.get( 'DATABASE_URI' ):
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-export-' ), 'export.db' )
+  import main as api
+  from benchmarks.suite.seed import seed
+  from export import available_formats
+  seed( api, 1000, 500, rentals )
+  client = api.app.test_client()
+
+  def marshmallow():
+    with api.app.app_context():
+      body = api.app.json.dumps( api.RentalSchema().dump( api.Rental.query.order_by( api.Rental.id ).all(), many = True ) ).encode()
+      api.db.session.remove()
+      return body
+
+  # label -> function producing the whole body
+  paths = {"JSON, marshmallow dump": marshmallow, "GET /Rental (JSON)": lambda: client.get( '/Rental' ).get_data()}
+  for format in available_formats():
+    paths[f"GET /Export/rental?format={format}"] = lambda format = format: client.get( f'/Export/rental?format={format}' ).get_data()
+
+  print( f"{rentals} rentals" )
+  print( f"  {'path':40}{'seconds':>10}{'MB':>10}{'peak MB':>10}" )
+  for label, produce in paths.items():
+    best = float( 'inf' )
+    for _ in range( repeats ):
+      started = time.perf_counter()
+      size = len( produce() )
+      best = min( best, time.perf_counter() - started )
+    tracemalloc.start()
+    produce()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print( f"  {label:40}{best:>10.3f}{size / 1e6:>10.1f}{peak / 1e6:>10.1f}" )
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main( *[int( argument ) for argument in sys.argv[1:]] ) )
@@ -0,0 +1,81 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Load test comparing the sync (WSGI) and async (ASGI) serving modes
+
+Start both servers on the same database first, e.g.:
+  python main.py                                  (sync, http://127.0.0.1:5000)
+  uvicorn asgi:app --port 8000                    (async, http://127.0.0.1:8000)
+
+Then run:
+  python benchmarks/load_compare.py http://127.0.0.1:5000 http://127.0.0.1:8000 [concurrency] [requests] [path]
+
+The client is a small asyncio HTTP/1.1 client with keep-alive connections, so it can hold
+thousands of requests in flight from one thread without adding its own bottleneck.
+'''
+
+
+import asyncio
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+# send GET requests over a keep-alive connection (reconnecting when the server closes it), recording each latency
+async def connection( host, port, path, count, latencies, errors ):
+  request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode()
+  reader, writer = await asyncio.open_connection( host, port )
+  try:
+    for _ in range( count ):
+      started = time.perf_counter()
+      writer.write( request )
+      await writer.drain()
+      status = await reader.readline()
+      length, close = 0, False
+      while True:
+        line = await reader.readline()
+        if line in ( b'\r\n', b'' ):
+          break
+        name, _, value = line.decode( 'latin-1' ).partition( ':' )
+        if name.lower() == 'content-length':
+          length = int( value )
+        elif name.lower() == 'connection' and value.strip().lower() == 'close':
+          close = True
+      await reader.readexactly( length )
+      latencies.append( time.perf_counter() - started )
+      if status.split()[1:2] != [b'200']:
+        errors.append( status )
+      # servers without keep-alive (like the Flask development server) close after every response
+      if close:
+        writer.close()
+        reader, writer = await asyncio.open_connection( host, port )
+  finally:
+    writer.close()
+
+
+# run 'requests' GETs of the path with 'concurrency' connections and summarize them
+async def load( base_url, path, concurrency, requests ):
+  url = urlsplit( base_url )
+  latencies, errors = [], []
+  per_connection = max( 1, requests // concurrency )
+  started = time.perf_counter()
+  outcomes = await asyncio.gather( *[connection( url.hostname, url.port or 80, path, per_connection, latencies, errors ) for _ in range( concurrency )], return_exceptions = True )
+  elapsed = time.perf_counter() - started
+  failures = [outcome for outcome in outcomes if isinstance( outcome, Exception )]
+  latencies.sort()
+  pick = lambda fraction: latencies[min( len( latencies ) - 1, int( fraction * len( latencies ) ) )] * 1000 if latencies else float( 'nan' )
+  return {"completed": len( latencies ), "errors": len( errors ), "failed connections": len( failures ), "requests/s": len( latencies ) / elapsed, "p50 ms": pick( 0.50 ), "p95 ms": pick( 0.95 ), "p99 ms": pick( 0.99 )}
+
+
+def main( sync_url, async_url, concurrency = 200, requests = 10000, path = '/Equipment?limit=50' ):
+  concurrency, requests = int( concurrency ), int( requests )
+  results = {}
+  for name, url in ( ( 'sync', sync_url ), ( 'async', async_url ) ):
+    results[name] = asyncio.run( load( url, path, concurrency, requests ) )
+  print( f"GET {path} with {concurrency} concurrent connections, {requests} requests" )
+  print( f"{'':20}{'sync':>12}{'async':>12}" )
+  for metric in results['sync']:
+    print( f"{metric:20}{results['sync'][metric]:>12.1f}{results['async'][metric]:>12.1f}" )
+
+
+if __name__ == '__main__':
+  main( *sys.argv[1:] )
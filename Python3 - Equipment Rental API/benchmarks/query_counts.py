@@ -0,0 +1,72 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Query count regression check for the rental routes
+
+Counts the SQL statements sent by the rental routes and fails when a route needs more
+than its budget, e.g. when an expanded rental list goes back to a query per rental.
+
+Usage: python benchmarks/query_counts.py
+(on a new SQLite file unless DATABASE_URI is set to a scratch database)
+'''
+
+
+import os
+import sys
+import tempfile
+from sqlalchemy import event
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+# a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+if not os.environ.get( 'DATABASE_URI' ):
+  os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-query-counts-' ), 'query_counts.db' )
+from main import app, db, init_db, Customer, Equipment, Inventory
+
+
+# number of statements sent to the database while calling the route
+def count_queries( client, method, url, **kwargs ):
+  statements = []
+  listener   = lambda *args: statements.append( args[2] )
+  with app.app_context():
+    engine = db.engine
+  event.listen( engine, 'before_cursor_execute', listener )
+  try:
+    response = getattr( client, method )( url, **kwargs )
+  finally:
+    event.remove( engine, 'before_cursor_execute', listener )
+  assert response.status_code == 200, ( url, response.status_code, response.json )
+  return len( statements )
+
+
+def main():
+  client = app.test_client()
+  with app.app_context():
+    init_db()
+    customer  = Customer( f_name = "Query", l_name = "Count", address = "1 Index St.", city = "Somewhere", state = "MI", phone = "000-000-0000" )
+    equipment = Equipment( name = "Query Counter", price = 2.5, category = "Benchmark", description = "Equipment for the query count check" )
+    db.session.add_all( [customer, equipment] )
+    db.session.commit()
+    customer_id, equipment_id = customer.id, equipment.id
+    db.session.add( Inventory( equipment_id = equipment_id, total = 1000, rented = 0 ) )
+    db.session.commit()
+  rental = {"customer_id": customer_id, "equipment_id": equipment_id, "quantity": 1, "start": "2024-07-01", "end": "2024-07-03"}
+
+  # route, budget of statements (SAVEPOINT/BEGIN issued by the driver are not counted)
+  # the writes include the bump of the table versions and the change log insert (and, for the rentals, the rollups upsert), the reads may include reading them
+  checks = [( 'add_rental', 'post', '/Rental', {"json": rental}, 6 )]
+  for _ in range( 200 ):
+    client.post( '/Rental', json = rental )
+  for limit in ( 1, 10, 100 ):
+    checks.append( ( f'expanded page of {limit}', 'get', f'/Rental?limit={limit}&expand=customer,equipment', {}, 4 ) )
+
+  failed = False
+  for name, method, url, kwargs, budget in checks:
+    queries = count_queries( client, method, url, **kwargs )
+    status  = "OK" if queries <= budget else "FAIL"
+    failed  = failed or queries > budget
+    print( f"{status}: {name} sent {queries} queries (budget {budget})" )
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit( main() )
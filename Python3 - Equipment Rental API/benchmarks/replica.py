@@ -0,0 +1,66 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Replica benchmark: the equipment and inventory reads from the database (and cache) and from the replica
+
+Seeds the tables, then sends the same reads (the whole catalogue, the inventory list, single
+equipment and inventory lookups and a multi-get) to the app without and with REPLICA_ENABLED,
+and reports the requests per second and the SQL statements per request of each.  The entity
+cache is on in both runs, so the single lookups compare the replica with a warm cache.
+
+Usage: python benchmarks/replica.py [equipment] [requests]
+(on a new SQLite file unless DATABASE_URI is set to a scratch database)
+'''
+
+
+import os
+import sys
+import tempfile
+import time
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+
+def main( equipment = 500, requests = 2000 ):
+  # a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+  if not os.environ.get( 'DATABASE_URI' ):
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-replica-' ), 'replica.db' )
+  import main as api
+  from sqlalchemy import event
+  from benchmarks.suite.seed import seed
+  data = seed( api, 200, equipment, 1000 )
+
+  # label -> function returning the url of a request
+  reads = {
+    "GET /Equipment": lambda: '/Equipment',
+    "GET /Inventory": lambda: '/Inventory',
+    "GET /Equipment/{id}": lambda: f"/Equipment/{data.equipment_id()}",
+    "GET /Inventory/{id}": lambda: f"/Inventory/{data.equipment_id()}",
+    "GET /Equipment?ids= (20 ids)": lambda: f"/Equipment?ids={','.join( str( data.equipment_id() ) for _ in range( 20 ) )}",
+  }
+  for label, enabled in ( ( 'without the replica', False ), ( 'with the replica', True ) ):
+    app = api.create_app( type( 'BenchmarkConfig', ( api.Config, ), {"REPLICA_ENABLED": enabled} ) )
+    client = app.test_client()
+    statements = []
+    with app.app_context():
+      engine = api.db.engine
+    count = lambda *arguments: statements.append( 1 )
+    event.listen( engine, 'before_cursor_execute', count )
+    print( f"{label}:" )
+    for name, url in reads.items():
+      # the lists are larger, fewer of them
+      total = requests // 10 if '{id}' not in name and 'ids' not in name else requests
+      # warm the cache (or load the replica) first
+      client.get( url() )
+      statements.clear()
+      started = time.perf_counter()
+      for _ in range( total ):
+        client.get( url() )
+      elapsed = time.perf_counter() - started
+      print( f"  {name:32}{total / elapsed:>10.0f} req/s{len( statements ) / total:>8.2f} statements/request" )
+    event.remove( engine, 'before_cursor_execute', count )
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main( *[int( argument ) for argument in sys.argv[1:]] ) )
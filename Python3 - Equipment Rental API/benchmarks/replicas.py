@@ -0,0 +1,117 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Read replicas benchmark: the GET requests spread over SQLite copies standing in for replicas
+
+Seeds a SQLite primary and copies it to two files (with SQLite's backup API, the "replication"),
+then walks through the routing with DB_REPLICA_URIS pointing at the copies: the reads spread
+over the replicas, a client reads its own write from the primary while the others still read
+the replicas, a replica left behind is skipped once it lags more than DB_REPLICA_MAX_LAG, and a
+replica failing its check is taken out.  Each step reports the SQL statements each database ran
+and the router's counters.
+
+Usage: python benchmarks/replicas.py [requests]
+(on new SQLite files in a temporary folder)
+'''
+
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+# seconds a replica may lag, and between two checks of each replica
+MAX_LAG        = 1.0
+CHECK_INTERVAL = 0.2
+
+
+# copy the primary to a replica file, as the replication would
+def replicate( primary, replica ):
+  source, target = sqlite3.connect( primary ), sqlite3.connect( replica )
+  try:
+    source.backup( target )
+  finally:
+    source.close()
+    target.close()
+
+
+def main( requests = 2000 ):
+  folder  = tempfile.mkdtemp( prefix = 'equipmentrental-replicas-' )
+  primary = os.path.join( folder, 'primary.db' )
+  copies  = [os.path.join( folder, f'replica{number}.db' ) for number in ( 1, 2 )]
+  # the primary must be set before the app is imported
+  os.environ['DATABASE_URI'] = 'sqlite:///' + primary
+  import main as api
+  from sqlalchemy import event
+  from benchmarks.suite.seed import seed
+  data = seed( api, 200, 200, 2000 )
+  for copy in copies:
+    replicate( primary, copy )
+
+  # no entity cache, so every read reaches a database
+  settings = {"DB_REPLICA_URIS": ','.join( 'sqlite:///' + copy for copy in copies ), "DB_REPLICA_MAX_LAG": MAX_LAG, "DB_REPLICA_CHECK_INTERVAL": CHECK_INTERVAL, "CACHE_BACKEND": "none"}
+  app     = api.create_app( type( 'BenchmarkConfig', ( api.Config, ), settings ) )
+  router  = app.extensions['routing']
+  # two clients, told apart by their address
+  writer, reader = app.test_client(), app.test_client()
+  writer.environ_base['REMOTE_ADDR'], reader.environ_base['REMOTE_ADDR'] = '10.0.0.1', '10.0.0.2'
+  # statements run by each database
+  statements = {}
+  with app.app_context():
+    engines = {"primary": api.db.engine, **{replica.name: replica.engine for replica in router.replicas}}
+  for name, engine in engines.items():
+    event.listen( engine, 'before_cursor_execute', lambda *arguments, name = name: statements.__setitem__( name, statements.get( name, 0 ) + 1 ) )
+
+  def report( title, *notes ):
+    print( f"{title}:" )
+    for note in notes:
+      print( f"  {note}" )
+    print( '  statements: ' + ', '.join( f"{name} {statements.get( name, 0 )}" for name in engines ) )
+    stats = router.stats()
+    print( f"  primary reads {stats['primary_reads']}, " + ', '.join( f"{replica.name} reads {replica.reads} lag {replica.lag if replica.lag is None else round( replica.lag, 2 )} {'healthy' if replica.healthy else 'down'}" for replica in router.replicas ) )
+    statements.clear()
+
+  # the reads spread over the replicas
+  started = time.perf_counter()
+  for _ in range( requests ):
+    reader.get( f"/Customer/{data.customer()}" )
+  elapsed = time.perf_counter() - started
+  report( f"{requests} GET /Customer/{{id}} ({requests / elapsed:.0f} req/s)" )
+
+  # the writer reads its new customer from the primary, the other client doesn't see it yet
+  writer.post( '/Customer', json = {"f_name": "New", "l_name": "Customer", "address": "1 Main St.", "city": "Somewhere", "state": "MI", "phone": "555-0000000"} )
+  newest = writer.get( '/Customer?sort=-id&limit=1' ).get_json()['data'][0]['id']
+  report( "read your writes (before the replicas copy the write)", f"GET /Customer/{newest} by the writer: {writer.get( f'/Customer/{newest}' ).status_code}, by the other client: {reader.get( f'/Customer/{newest}' ).status_code}" )
+
+  # one replica catches up, the other is left behind past the lag allowed
+  replicate( primary, copies[0] )
+  time.sleep( MAX_LAG + CHECK_INTERVAL )
+  for _ in range( 100 ):
+    reader.get( f"/Customer/{data.customer()}" )
+  report( "replica1 caught up, replica2 left behind for longer than the lag allowed", f"GET /Customer/{newest} by the writer: {writer.get( f'/Customer/{newest}' ).status_code}, by the other client: {reader.get( f'/Customer/{newest}' ).status_code}" )
+
+  # replica1 breaks (its change log goes missing), the reads go to the primary
+  connection = sqlite3.connect( copies[0] )
+  connection.execute( 'ALTER TABLE change_log RENAME TO change_log_lost' )
+  connection.commit()
+  connection.close()
+  time.sleep( CHECK_INTERVAL )
+  for _ in range( 100 ):
+    reader.get( f"/Customer/{data.customer()}" )
+  report( "replica1 failing its check, replica2 still behind" )
+
+  # both copies back and up to date
+  for copy in copies:
+    replicate( primary, copy )
+  time.sleep( CHECK_INTERVAL )
+  for _ in range( 100 ):
+    reader.get( f"/Customer/{data.customer()}" )
+  report( "both replicas back" )
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main( *[int( argument ) for argument in sys.argv[1:]] ) )
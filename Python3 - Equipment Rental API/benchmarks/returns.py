@@ -0,0 +1,76 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Returns benchmark: the cost of a run of the rental returns, by rentals due
+
+Seeds the rentals (all of them ended in the past), returns them all in one run, then makes a
+few of them due again and times a run for each number: with the index on ( returned, end ) a
+run reads the rentals due only, so its time follows the rentals due, not the rentals stored.
+Each run reports its time, its SQL statements and the units given back, and checks that every
+inventory row's rented units match the rentals still holding them.
+
+Usage: python benchmarks/returns.py [rentals] [batch size]
+(on a new SQLite file unless DATABASE_URI is set to a scratch database)
+'''
+
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+
+def main( rentals = 100000, batch_size = 500 ):
+  # a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+  if not os.environ.get( 'DATABASE_URI' ):
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-returns-' ), 'returns.db' )
+  # the runs are started here, not by the requests
+  os.environ['RETURNS_ENABLED'] = '0'
+  import main as api
+  from sqlalchemy import event, func, select, update
+  from benchmarks.suite.seed import seed
+  data = seed( api, 1000, 500, rentals )
+  app = api.create_app( type( 'BenchmarkConfig', ( api.Config, ), {"RETURNS_BATCH_SIZE": batch_size} ) )
+  Rental, Inventory = api.Rental, api.Inventory
+  statements = []
+  with app.app_context():
+    event.listen( api.db.engine, 'before_cursor_execute', lambda *arguments: statements.append( 1 ) )
+
+  # make rentals due again: not returned, with their units held again
+  def due_again( ids ):
+    session = api.db.session
+    held = select( func.sum( Rental.quantity ) ).where( Rental.equipment_id == Inventory.equipment_id, Rental.id.in_( ids ) ).scalar_subquery()
+    session.execute( update( Inventory ).values( rented = Inventory.rented + func.coalesce( held, 0 ) ).execution_options( synchronize_session = False ) )
+    session.execute( update( Rental ).where( Rental.id.in_( ids ) ).values( returned = None ).execution_options( synchronize_session = False ) )
+    session.commit()
+
+  # True when every inventory row's rented units are the ones its rentals hold
+  def consistent():
+    holding = dict( api.db.session.execute( select( Rental.equipment_id, func.sum( Rental.quantity ) ).where( Rental.returned.is_( None ) ).group_by( Rental.equipment_id ) ).all() )
+    return all( rented == holding.get( equipment_id, 0 ) for equipment_id, rented in api.db.session.execute( select( Inventory.equipment_id, Inventory.rented ) ) )
+
+  def run( label ):
+    released = api.returns.stats()['units_released']
+    statements.clear()
+    started  = time.perf_counter()
+    returned = api.returns.run()
+    elapsed  = time.perf_counter() - started
+    print( f"  {label:34}{returned:>10}{elapsed * 1000:>12.1f}{len( statements ):>12}{api.returns.stats()['units_released'] - released:>10}" )
+
+  print( f"{rentals} rentals, {batch_size} per batch" )
+  print( f"  {'run':34}{'returned':>10}{'ms':>12}{'statements':>12}{'units':>10}" )
+  with app.app_context():
+    run( "every rental (all past their end)" )
+    run( "again (nothing due)" )
+    for due in ( 1, 10, 100, 1000 ):
+      due_again( random.Random( due ).sample( data.rentals, due ) )
+      run( f"{due} due among {rentals}" )
+    print( f"  inventory consistent with the rentals: {consistent()}" )
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main( *[int( argument ) for argument in sys.argv[1:]] ) )
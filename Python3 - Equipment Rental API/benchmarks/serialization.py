@@ -0,0 +1,73 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Microbenchmark of the per-row serialization cost of the list routes
+
+Compares, per rental row, marshmallow's dump of ORM objects (the previous list path) with the
+precompiled RowSerializer fed by column tuples, and the stdlib JSON encoder with orjson.  The
+rows are built in memory, so the numbers don't include the database round trips.
+
+Usage: python benchmarks/serialization.py [rows] [repeats]
+(the app is imported on a new SQLite file unless DATABASE_URI is set, no row is written to it)
+'''
+
+
+import datetime
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+# a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+if not os.environ.get( 'DATABASE_URI' ):
+  os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-serialization-' ), 'serialization.db' )
+from main import app, Rental, RentalSchema, rental_rows
+from serializer import FastJSONProvider, orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+# best time of 'repeats' runs of the function, in nanoseconds per row
+def per_row( function, rows, repeats ):
+  return min( timeit.repeat( function, number = 1, repeat = repeats ) ) / rows * 1e9
+
+
+def main( rows = 10000, repeats = 5 ):
+  rows, repeats = int( rows ), int( repeats )
+  start   = datetime.date( 2024, 7, 1 )
+  # the values of every rental column, as objects and as tuples in the order of the schema's fields
+  columns = [{"id": id, "customer_id": id % 100, "equipment_id": id % 50, "quantity": 1 + id % 3, "start": start, "end": start + datetime.timedelta( days = 1 + id % 7 ), "cost": 2.5 * ( 1 + id % 3 ) * ( 1 + id % 7 ), "returned": None if id % 4 else datetime.datetime( 2024, 7, 9, 12, 0 )} for id in range( 1, rows + 1 )]
+  tuples  = [tuple( values[field] for field in RentalSchema.Meta.fields ) for values in columns]
+  objects = []
+  for values in columns:
+    rental = Rental( values['customer_id'], values['equipment_id'], values['quantity'], values['start'], values['end'], values['cost'] )
+    rental.id, rental.returned = values['id'], values['returned']
+    objects.append( rental )
+
+  data = rental_rows.dump( tuples, many = True )
+  assert data == RentalSchema( many = True ).dump( objects ), "the row serializer must dump the same dicts as the schema"
+  body = {"message": "All rentals provided", "data": data}
+
+  results = [
+    ( "marshmallow dump (ORM objects)", per_row( lambda: RentalSchema( many = True ).dump( objects ), rows, repeats ) ),
+    ( "RowSerializer dump (tuples)",    per_row( lambda: rental_rows.dump( tuples, many = True ), rows, repeats ) ),
+    ( "stdlib JSON encode",             per_row( lambda: DefaultJSONProvider( app ).dumps( body ), rows, repeats ) ),
+  ]
+  if orjson is not None:
+    results.append( ( "orjson encode", per_row( lambda: FastJSONProvider( app ).dumps( body ), rows, repeats ) ) )
+  else:
+    print( "orjson is not installed, skipping its encoder (pip install orjson)" )
+
+  print( f"{rows} rental rows, best of {repeats} runs" )
+  for name, nanoseconds in results:
+    print( f"{name:34}{nanoseconds:>10.0f} ns/row" )
+  before = results[0][1] + results[2][1]
+  after  = results[1][1] + results[-1][1]
+  print( f"{'serialize + encode':34}{before:>10.0f} -> {after:.0f} ns/row ({before / after:.1f}x)" )
+  # the output is the same JSON document, whatever the encoder
+  assert json.loads( FastJSONProvider( app ).dumps( body ) ) == json.loads( DefaultJSONProvider( app ).dumps( body ) )
+
+
+if __name__ == '__main__':
+  main( *sys.argv[1:] )
@@ -0,0 +1,73 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Startup benchmark: from a new process to the answer of its first request
+
+Every run starts a new interpreter that imports main.py (building the app) and sends one request
+with the test client, reporting the import time, the first request time, the whole process time
+and the database connections open once the import is done (none: the connection is made by the
+first request).  The database is set up once beforehand with init_db().
+
+Usage: python benchmarks/startup.py [runs] [path of the first request]
+'''
+
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# run against the app in the parent folder
+APP_FOLDER = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' )
+
+# what each new process runs
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+with main.app.app_context():
+  pool = main.db.engine.pool
+opened = pool.checkedin() + pool.checkedout() if hasattr( pool, 'checkedin' ) else None
+response = main.app.test_client().get( sys.argv[1] )
+answered = time.perf_counter()
+print( json.dumps( {"import": imported - started, "first_request": answered - imported, "status": response.status_code, "connections_at_import": opened} ) )
+'''
+
+# what the setup process runs
+SETUP = '''
+import main
+with main.app.app_context():
+  main.init_db()
+'''
+
+
+def main( runs = 10, path = '/Equipment?limit=10' ):
+  runs = int( runs )
+  environment = dict( os.environ )
+  # a new SQLite database unless DATABASE_URI points elsewhere
+  if not environment.get( 'DATABASE_URI' ):
+    environment['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-startup-' ), 'startup.db' )
+  subprocess.run( [sys.executable, '-c', SETUP], cwd = APP_FOLDER, env = environment, check = True )
+
+  samples = []
+  for _ in range( runs ):
+    started = time.perf_counter()
+    output  = subprocess.run( [sys.executable, '-c', PROBE, path], cwd = APP_FOLDER, env = environment, check = True, capture_output = True, text = True ).stdout
+    sample  = json.loads( output.strip().splitlines()[-1] )
+    sample['process'] = time.perf_counter() - started
+    samples.append( sample )
+
+  print( f"{runs} cold starts, first request GET {path} (status {samples[0]['status']})" )
+  for name in ( 'import', 'first_request', 'process' ):
+    values = [sample[name] * 1000 for sample in samples]
+    print( f"  {name:14} median {statistics.median( values ):8.1f} ms   min {min( values ):8.1f} ms   max {max( values ):8.1f} ms" )
+  opened = {sample['connections_at_import'] for sample in samples}
+  print( f"  database connections open after the import: {', '.join( str( value ) for value in sorted( opened, key = str ) )}" )
+  return 0 if opened <= {0, None} and all( sample['status'] == 200 for sample in samples ) else 1
+
+
+if __name__ == '__main__':
+  sys.exit( main( *sys.argv[1:] ) )
@@ -0,0 +1,18 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Benchmark and load test suite covering every route of the sync app
+
+Seeds a synthetic dataset (customers, equipment, inventory and rentals), runs one scenario per
+route and method through the Flask test client and through a multi-threaded HTTP load
+generator against a real server, and reports the throughput, the p50/p95/p99 latencies and
+the SQL statements per request.  The results are written to a JSON file, which a later run
+(e.g. in CI) compares against to flag the regressions.
+
+Usage (from the app folder):
+  python -m benchmarks.suite [--customers N] [--equipment N] [--rentals N] [--requests N]
+                             [--threads N] [--drivers client,http] [--only text]
+                             [--output results.json] [--baseline baseline.json] [--tolerance 0.25]
+
+Without DATABASE_URI it runs on a new SQLite file; set it to a scratch MySQL database to
+measure the real thing (the suite writes to it).
+'''
@@ -0,0 +1,93 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Command line of the benchmark suite (python -m benchmarks.suite --help)
+'''
+
+
+import argparse
+import datetime
+import os
+import platform
+import sys
+import tempfile
+
+# run against the app in the parent folder
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', '..' ) )
+
+
+def arguments():
+  parser = argparse.ArgumentParser( prog = 'python -m benchmarks.suite', description = "Benchmark every route of the app and compare the results with a baseline." )
+  parser.add_argument( '--customers', type = int, default = 1000, help = "customers to seed (default 1000)" )
+  parser.add_argument( '--equipment', type = int, default = 500, help = "equipment (each with an inventory) to seed (default 500)" )
+  parser.add_argument( '--rentals', type = int, default = 10000, help = "rentals to seed (default 10000)" )
+  parser.add_argument( '--requests', type = int, default = 200, help = "requests per scenario and driver (default 200)" )
+  parser.add_argument( '--threads', type = int, default = 8, help = "threads of the HTTP load generator (default 8)" )
+  parser.add_argument( '--drivers', default = 'client,http', help = "'client' (Flask test client), 'http' (threaded load over a real server) or both" )
+  parser.add_argument( '--only', default = '', help = "run only the scenarios whose name contains this text" )
+  parser.add_argument( '--seed', type = int, default = 1, help = "random seed of the dataset and the requests" )
+  parser.add_argument( '--output', default = 'benchmark_results.json', help = "JSON file to write the results to" )
+  parser.add_argument( '--baseline', help = "JSON results of an earlier run to compare with (exits with 1 on a regression)" )
+  parser.add_argument( '--tolerance', type = float, default = 0.25, help = "slowdown (as a fraction) that counts as a regression (default 0.25)" )
+  return parser.parse_args()
+
+
+def main():
+  options = arguments()
+  # a new SQLite database unless DATABASE_URI points elsewhere (it must be set before the app is imported)
+  if not os.environ.get( 'DATABASE_URI' ):
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join( tempfile.mkdtemp( prefix = 'equipmentrental-bench-' ), 'bench.db' )
+  import main as api
+  from .drivers import Server, StatementCounter, run_client, run_http
+  from .report import compare, load, save, summarize, table
+  from .scenarios import prepare, scenarios, uncovered
+  from .seed import seed
+
+  selected = [scenario for scenario in scenarios() if options.only in scenario.name]
+  missing  = uncovered( api.app, scenarios() )
+  if missing:
+    print( "routes without a scenario: " + ', '.join( f"{method} {rule}" for rule, method in missing ), file = sys.stderr )
+
+  print( f"seeding {options.customers} customers, {options.equipment} equipment and {options.rentals} rentals into {os.environ['DATABASE_URI']}" )
+  data = seed( api, options.customers, options.equipment, options.rentals, options.seed )
+  with api.app.app_context():
+    counter = StatementCounter( api.db.engine )
+    dialect = api.db.engine.dialect.name
+
+  results = {
+    "meta": {"date": datetime.datetime.now( datetime.timezone.utc ).isoformat( timespec = 'seconds' ), "python": platform.python_version(), "platform": platform.platform(), "database": dialect,
+             "customers": options.customers, "equipment": options.equipment, "rentals": options.rentals, "requests": options.requests, "threads": options.threads},
+    "results": {},
+  }
+  drivers = [driver.strip() for driver in options.drivers.split( ',' ) if driver.strip()]
+  server  = Server( api.app ) if 'http' in drivers else None
+  try:
+    for driver in drivers:
+      figures = results['results'][driver] = {}
+      for scenario in selected:
+        count = min( options.requests, scenario.limit or options.requests )
+        prepare( api, data, scenario, count )
+        before = counter.count
+        if driver == 'client':
+          run, elapsed = run_client( api.app, data, scenario, count )
+        else:
+          run, elapsed = run_http( server, data, scenario, count, options.threads )
+        figures[scenario.name] = summarize( run, elapsed, counter.count - before )
+        print( f"  {driver:6} {scenario.name:28} {figures[scenario.name]['throughput']:>8} req/s  p95 {figures[scenario.name]['p95_ms']} ms" )
+  finally:
+    if server is not None:
+      server.stop()
+
+  print( table( results ) )
+  save( results, options.output )
+  print( f"results written to {options.output}" )
+  if options.baseline:
+    regressions = compare( results, load( options.baseline ), options.tolerance )
+    for regression in regressions:
+      print( f"REGRESSION {regression}" )
+    print( f"{len( regressions )} regressions against {options.baseline}" )
+    return 1 if regressions else 0
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main() )
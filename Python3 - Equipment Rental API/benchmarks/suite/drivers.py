@@ -0,0 +1,115 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  The two ways the benchmark suite sends its requests
+
+'client' calls the app in-process with the Flask test client, one request at a time, which
+measures the handlers themselves.  'http' serves the app with a threaded WSGI server on a local
+port and sends the requests from several threads over keep-alive connections, which adds the
+HTTP parsing, the server and the contention between requests.
+'''
+
+
+import http.client
+import itertools
+import json
+import threading
+import time
+from sqlalchemy import event
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+# count every SQL statement the app's engine executes
+class StatementCounter:
+  def __init__( self, engine ) -> None:
+    self.count = 0
+    self.lock  = threading.Lock()
+    event.listen( engine, 'after_cursor_execute', self._executed )
+
+  def _executed( self, *args ):
+    with self.lock:
+      self.count += 1
+
+
+# what one scenario run measured
+class Run:
+  def __init__( self ) -> None:
+    self.latencies = []
+    self.statuses  = {}
+    self.lock      = threading.Lock()
+
+  def add( self, latency, status ):
+    with self.lock:
+      self.latencies.append( latency )
+      self.statuses[status] = self.statuses.get( status, 0 ) + 1
+
+
+# send 'count' requests of the scenario with the test client
+def run_client( app, data, scenario, count ):
+  client = app.test_client()
+  run = Run()
+  started = time.perf_counter()
+  for _ in range( count ):
+    url, body = scenario.build( data )
+    sent = time.perf_counter()
+    response = client.open( url, method = scenario.method, json = body )
+    # read the streamed bodies too
+    response.get_data()
+    run.add( time.perf_counter() - sent, response.status_code )
+  return run, time.perf_counter() - started
+
+
+# HTTP/1.1, so the connections are kept alive between requests, and without the request log
+class KeepAliveHandler( WSGIRequestHandler ):
+  protocol_version = 'HTTP/1.1'
+
+  def log_request( self, *args, **kwargs ):
+    pass
+
+
+# the app served by a threaded server on a free local port, until stop() is called
+class Server:
+  def __init__( self, app ) -> None:
+    self.server = make_server( '127.0.0.1', 0, app, threaded = True, request_handler = KeepAliveHandler )
+    self.port   = self.server.server_port
+    self.thread = threading.Thread( target = self.server.serve_forever, daemon = True )
+    self.thread.start()
+
+  def stop( self ):
+    self.server.shutdown()
+    self.server.server_close()
+
+
+# send 'count' requests of the scenario from 'threads' threads, each with its own connection
+def run_http( server, data, scenario, count, threads ):
+  run = Run()
+  sent_count = itertools.count()
+
+  def worker():
+    connection = http.client.HTTPConnection( '127.0.0.1', server.port, timeout = 60 )
+    try:
+      while next( sent_count ) < count:
+        url, body = scenario.build( data )
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        sent = time.perf_counter()
+        try:
+          connection.request( scenario.method, url, body = json.dumps( body ) if body is not None else None, headers = headers )
+          response = connection.getresponse()
+          response.read()
+        except ( OSError, http.client.HTTPException ):
+          # counted as a failed request (status 0), on a new connection
+          run.add( time.perf_counter() - sent, 0 )
+          connection.close()
+          continue
+        run.add( time.perf_counter() - sent, response.status )
+        if response.will_close:
+          connection.close()
+    finally:
+      connection.close()
+
+  workers = [threading.Thread( target = worker ) for _ in range( threads )]
+  started = time.perf_counter()
+  for thread in workers:
+    thread.start()
+  for thread in workers:
+    thread.join()
+  return run, time.perf_counter() - started
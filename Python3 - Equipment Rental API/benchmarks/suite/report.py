@@ -0,0 +1,77 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Results of the benchmark suite: summaries, the JSON file and the baseline comparison
+'''
+
+
+import json
+
+
+# nearest-rank percentile of sorted values
+def percentile( values, fraction ):
+  if not values:
+    return None
+  return values[min( len( values ) - 1, max( 0, int( round( fraction * len( values ) ) ) - 1 ) )]
+
+
+# the figures of a scenario run
+def summarize( run, elapsed, statements ):
+  latencies = sorted( run.latencies )
+  count = len( latencies )
+  errors = sum( number for status, number in run.statuses.items() if not 200 <= status < 400 )
+  milliseconds = lambda fraction: round( percentile( latencies, fraction ) * 1000, 3 ) if count else None
+  return {
+    "requests": count,
+    "errors": errors,
+    "statuses": {str( status ): number for status, number in sorted( run.statuses.items() )},
+    "throughput": round( count / elapsed, 1 ) if elapsed else None,
+    "p50_ms": milliseconds( 0.50 ),
+    "p95_ms": milliseconds( 0.95 ),
+    "p99_ms": milliseconds( 0.99 ),
+    "queries_per_request": round( statements / count, 2 ) if count else None,
+  }
+
+
+def save( results, path ):
+  with open( path, 'w' ) as output:
+    json.dump( results, output, indent = 2, sort_keys = True )
+
+
+def load( path ):
+  with open( path ) as source:
+    return json.load( source )
+
+
+# the regressions of the results against the baseline: slower by more than 'tolerance' (a
+# fraction), more SQL statements per request, or new errors
+def compare( results, baseline, tolerance = 0.25 ):
+  regressions = []
+  for driver, scenarios in results['results'].items():
+    for name, current in scenarios.items():
+      before = baseline.get( 'results', {} ).get( driver, {} ).get( name )
+      if before is None:
+        continue
+      label = f"{driver}/{name}"
+      if before.get( 'throughput' ) and current['throughput'] is not None and current['throughput'] < before['throughput'] * ( 1 - tolerance ):
+        regressions.append( f"{label}: throughput {current['throughput']}/s, was {before['throughput']}/s" )
+      if before.get( 'p95_ms' ) and current['p95_ms'] is not None and current['p95_ms'] > before['p95_ms'] * ( 1 + tolerance ):
+        regressions.append( f"{label}: p95 {current['p95_ms']} ms, was {before['p95_ms']} ms" )
+      # the statements per request don't depend on the machine, only the periodic reloads (table
+      # versions, search index) vary between runs, so an extra statement in half the requests counts
+      if before.get( 'queries_per_request' ) is not None and current['queries_per_request'] is not None and current['queries_per_request'] >= before['queries_per_request'] + 0.5:
+        regressions.append( f"{label}: {current['queries_per_request']} queries per request, was {before['queries_per_request']}" )
+      if current['errors'] > before.get( 'errors', 0 ):
+        regressions.append( f"{label}: {current['errors']} errors, was {before.get( 'errors', 0 )}" )
+  return regressions
+
+
+# the results as a table
+def table( results ):
+  lines = []
+  for driver, scenarios in results['results'].items():
+    lines.append( f"{driver}:" )
+    lines.append( f"  {'scenario':28}{'req':>6}{'err':>5}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}" )
+    for name, figures in scenarios.items():
+      cells = [figures[key] if figures[key] is not None else float( 'nan' ) for key in ( 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request' )]
+      lines.append( f"  {name:28}{figures['requests']:>6}{figures['errors']:>5}{cells[0]:>10.1f}{cells[1]:>10.2f}{cells[2]:>10.2f}{cells[3]:>10.2f}{cells[4]:>9.2f}" )
+  return '\n'.join( lines )
@@ -0,0 +1,168 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  The requests of the benchmark suite, at least one per route and method
+
+A scenario builds one request at a time from the seeded dataset.  The ones that delete (or
+otherwise use up) rows get their own spare rows first, one per request, so every request of a
+run succeeds and the runs stay comparable.
+'''
+
+
+import collections
+from .seed import customer_row, equipment_row, insert, insert_rentals, rental_row
+
+
+# rows sent per bulk request
+BULK_ROWS = 20
+# ids asked per multi-get (a page of rentals references about as many customers and equipment)
+MULTI_GET_IDS = 50
+# the range asked to the availability and utilization routes
+RANGE = "start=2024-03-01&end=2024-03-31"
+
+
+class Scenario:
+  def __init__( self, name, method, rule, build, prepare = None, limit = None ) -> None:
+    self.name    = name
+    self.method  = method
+    # the route's rule, to check that every route is covered
+    self.rule    = rule
+    # build( data ) returns the ( url, json body or None ) of the next request
+    self.build   = build
+    # prepare( api, session, data, count ) returns the spare ids of 'count' requests
+    self.prepare = prepare
+    # most requests worth sending (for the slow maintenance routes)
+    self.limit   = limit
+
+
+'''
+spare rows for the scenarios that use them up
+'''
+
+
+def spare_equipment( api, session, data, count ):
+  ids = insert( session, api.Equipment, [equipment_row( data.random ) for _ in range( count )] )
+  api.catalogue.forget()
+  return ids
+
+def spare_customers( api, session, data, count ):
+  return insert( session, api.Customer, [customer_row( data.random, index ) for index in range( count )] )
+
+# equipment with an inventory row of their own (nothing rented)
+def spare_inventory( api, session, data, count ):
+  ids = spare_equipment( api, session, data, count )
+  session.execute( api.Inventory.__table__.insert(), [{"equipment_id": id, "total": 10, "rented": 0} for id in ids] )
+  return ids
+
+def spare_rentals( api, session, data, count ):
+  return insert_rentals( api, session, [rental_row( data.random, data.customer(), data.equipment_id() ) for _ in range( count )] )
+
+# spare rows for the bulk requests, BULK_ROWS per request
+def bulk( spare ):
+  return lambda api, session, data, count: spare( api, session, data, count * BULK_ROWS )
+
+def taken( data, name, count = BULK_ROWS ):
+  return [data.take( name ) for _ in range( count )]
+
+
+'''
+the scenarios
+'''
+
+
+def scenarios():
+  def get( name, rule, url ):
+    return Scenario( name, 'GET', rule, lambda data: ( url( data ) if callable( url ) else url, None ) )
+
+  return [
+    # documentation and statistics
+    get( 'doc', '/', '/' ),
+    get( 'cache_stats', '/Cache', '/Cache' ),
+    get( 'pool_stats', '/Pool', '/Pool' ),
+    get( 'metrics', '/metrics', '/metrics' ),
+    get( 'group_commit_stats', '/GroupCommit', '/GroupCommit' ),
+    get( 'admission_stats', '/Admission', '/Admission' ),
+    get( 'replica_stats', '/Replica', '/Replica' ),
+    get( 'returns_stats', '/Returns', '/Returns' ),
+
+    # equipment
+    get( 'equipment_list', '/Equipment', '/Equipment' ),
+    get( 'equipment_page', '/Equipment', '/Equipment?limit=100' ),
+    get( 'equipment_stream', '/Equipment', '/Equipment?format=ndjson' ),
+    get( 'equipment_filter', '/Equipment', lambda data: f"/Equipment?category={data.random.choice( ( 'Tools', 'Garden', 'Party' ) )}&price_max=100&sort=-price&limit=50" ),
+    get( 'equipment_search', '/Equipment', lambda data: f"/Equipment?search={data.random.choice( ( 'cord+dri', 'pressure+wash', 'heavy', 'gen' ) )}" ),
+    get( 'equipment_get', '/Equipment/<id>', lambda data: f"/Equipment/{data.equipment_id()}" ),
+    get( 'equipment_multi_get', '/Equipment', lambda data: f"/Equipment?ids={','.join( str( data.equipment_id() ) for _ in range( MULTI_GET_IDS ) )}" ),
+    Scenario( 'equipment_batch_get', 'POST', '/Equipment/batch-get', lambda data: ( '/Equipment/batch-get', {"ids": [data.equipment_id() for _ in range( MULTI_GET_IDS )]} ) ),
+    Scenario( 'equipment_create', 'POST', '/Equipment', lambda data: ( '/Equipment', equipment_row( data.random ) ) ),
+    Scenario( 'equipment_update', 'PUT', '/Equipment/<id>', lambda data: ( f"/Equipment/{data.equipment_id()}", equipment_row( data.random ) ) ),
+    Scenario( 'equipment_delete', 'DELETE', '/Equipment/<id>', lambda data: ( f"/Equipment/{data.take( 'equipment_delete' )}", None ), spare_equipment ),
+    Scenario( 'equipment_bulk_create', 'POST', '/Equipment/bulk', lambda data: ( '/Equipment/bulk', [equipment_row( data.random ) for _ in range( BULK_ROWS )] ) ),
+    Scenario( 'equipment_bulk_update', 'PUT', '/Equipment/bulk', lambda data: ( '/Equipment/bulk', [{"id": data.equipment_id(), **equipment_row( data.random )} for _ in range( BULK_ROWS )] ) ),
+    Scenario( 'equipment_bulk_delete', 'DELETE', '/Equipment/bulk', lambda data: ( '/Equipment/bulk', taken( data, 'equipment_bulk_delete' ) ), bulk( spare_equipment ) ),
+
+    # customers
+    get( 'customer_list', '/Customer', '/Customer' ),
+    get( 'customer_page', '/Customer', '/Customer?limit=100' ),
+    get( 'customer_filter', '/Customer', lambda data: f"/Customer?state={data.random.choice( ( 'MI', 'NY', 'CA' ) )}&sort=l_name&limit=50" ),
+    get( 'customer_get', '/Customer/<id>', lambda data: f"/Customer/{data.customer()}" ),
+    get( 'customer_multi_get', '/Customer', lambda data: f"/Customer?ids={','.join( str( data.customer() ) for _ in range( MULTI_GET_IDS ) )}" ),
+    Scenario( 'customer_batch_get', 'POST', '/Customer/batch-get', lambda data: ( '/Customer/batch-get', {"ids": [data.customer() for _ in range( MULTI_GET_IDS )]} ) ),
+    Scenario( 'customer_create', 'POST', '/Customer', lambda data: ( '/Customer', customer_row( data.random, data.random.randrange( 10 ** 6 ) ) ) ),
+    Scenario( 'customer_update', 'PUT', '/Customer/<id>', lambda data: ( f"/Customer/{data.customer()}", customer_row( data.random, data.random.randrange( 10 ** 6 ) ) ) ),
+    Scenario( 'customer_delete', 'DELETE', '/Customer/<id>', lambda data: ( f"/Customer/{data.take( 'customer_delete' )}", None ), spare_customers ),
+    Scenario( 'customer_bulk_create', 'POST', '/Customer/bulk', lambda data: ( '/Customer/bulk', [customer_row( data.random, data.random.randrange( 10 ** 6 ) ) for _ in range( BULK_ROWS )] ) ),
+    Scenario( 'customer_bulk_update', 'PUT', '/Customer/bulk', lambda data: ( '/Customer/bulk', [{"id": data.customer(), **customer_row( data.random, data.random.randrange( 10 ** 6 ) )} for _ in range( BULK_ROWS )] ) ),
+    Scenario( 'customer_bulk_delete', 'DELETE', '/Customer/bulk', lambda data: ( '/Customer/bulk', taken( data, 'customer_bulk_delete' ) ), bulk( spare_customers ) ),
+
+    # inventory (on spare equipment, so the seeded stock stays in step with the rentals)
+    get( 'inventory_list', '/Inventory', '/Inventory' ),
+    get( 'inventory_get', '/Inventory/<id>', lambda data: f"/Inventory/{data.equipment_id()}" ),
+    Scenario( 'inventory_batch_get', 'POST', '/Inventory/batch-get', lambda data: ( '/Inventory/batch-get', {"ids": [data.equipment_id() for _ in range( MULTI_GET_IDS )]} ) ),
+    Scenario( 'inventory_create', 'POST', '/Inventory', lambda data: ( '/Inventory', {"equipment_id": data.take( 'inventory_create' ), "total": 10, "rented": 0} ), spare_equipment ),
+    Scenario( 'inventory_update', 'PUT', '/Inventory/<id>', lambda data: ( lambda id: ( f"/Inventory/{id}", {"equipment_id": id, "total": 20, "rented": 0} ) )( data.take( 'inventory_update' ) ), spare_inventory ),
+    Scenario( 'inventory_delete', 'DELETE', '/Inventory/<id>', lambda data: ( f"/Inventory/{data.take( 'inventory_delete' )}", None ), spare_inventory ),
+    Scenario( 'inventory_bulk_create', 'POST', '/Inventory/bulk', lambda data: ( '/Inventory/bulk', [{"equipment_id": id, "total": 10, "rented": 0} for id in taken( data, 'inventory_bulk_create' )] ), bulk( spare_equipment ) ),
+    Scenario( 'inventory_bulk_update', 'PUT', '/Inventory/bulk', lambda data: ( '/Inventory/bulk', [{"equipment_id": id, "total": 20, "rented": 0} for id in taken( data, 'inventory_bulk_update' )] ), bulk( spare_inventory ) ),
+    Scenario( 'inventory_bulk_delete', 'DELETE', '/Inventory/bulk', lambda data: ( '/Inventory/bulk', taken( data, 'inventory_bulk_delete' ) ), bulk( spare_inventory ) ),
+
+    # rentals
+    get( 'rental_page', '/Rental', '/Rental?limit=100' ),
+    get( 'rental_page_expanded', '/Rental', '/Rental?limit=100&expand=customer,equipment' ),
+    get( 'rental_stream', '/Rental', '/Rental?format=ndjson' ),
+    get( 'rental_export', '/Export/<entity>', '/Export/rental?format=csv' ),
+    get( 'rental_get', '/Rental/<id>', lambda data: f"/Rental/{data.rental()}" ),
+    Scenario( 'rental_batch_get', 'POST', '/Rental/batch-get', lambda data: ( '/Rental/batch-get', {"ids": [data.rental() for _ in range( MULTI_GET_IDS )]} ) ),
+    Scenario( 'rental_create', 'POST', '/Rental', lambda data: ( '/Rental', rental_row( data.random, data.customer(), data.equipment_id() ) ) ),
+    Scenario( 'rental_update', 'PUT', '/Rental/<id>', lambda data: ( f"/Rental/{data.take( 'rental_update' )}", rental_row( data.random, data.customer(), data.equipment_id() ) ), spare_rentals ),
+    Scenario( 'rental_delete', 'DELETE', '/Rental/<id>', lambda data: ( f"/Rental/{data.take( 'rental_delete' )}", None ), spare_rentals ),
+    Scenario( 'rental_bulk_create', 'POST', '/Rental/bulk', lambda data: ( '/Rental/bulk', [rental_row( data.random, data.customer(), data.equipment_id() ) for _ in range( BULK_ROWS )] ) ),
+    Scenario( 'rental_bulk_update', 'PUT', '/Rental/bulk', lambda data: ( '/Rental/bulk', [{"id": id, **rental_row( data.random, data.customer(), data.equipment_id() )} for id in taken( data, 'rental_bulk_update' )] ), bulk( spare_rentals ) ),
+    Scenario( 'rental_bulk_delete', 'DELETE', '/Rental/bulk', lambda data: ( '/Rental/bulk', taken( data, 'rental_bulk_delete' ) ), bulk( spare_rentals ) ),
+
+    # availability and analytics
+    get( 'availability_one', '/Availability/<int:equipment_id>', lambda data: f"/Availability/{data.equipment_id()}?{RANGE}" ),
+    get( 'availability_many', '/Availability', lambda data: f"/Availability?equipment_ids={','.join( str( data.equipment_id() ) for _ in range( 10 ) )}&{RANGE}" ),
+    get( 'analytics_summary', '/Analytics', '/Analytics' ),
+    get( 'analytics_revenue', '/Analytics/revenue', lambda data: f"/Analytics/revenue?group={data.random.choice( ( 'day', 'equipment', 'category', 'customer' ) )}&{RANGE}" ),
+    get( 'analytics_utilization', '/Analytics/utilization', f"/Analytics/utilization?group=category&{RANGE}" ),
+
+    # change feed (a page of 100 changes from a random point of the log written by the seeding)
+    get( 'changes_page', '/Changes', lambda data: f"/Changes?since={data.random.randrange( 1000 )}&limit=100" ),
+  ]
+
+
+# set aside the spare rows of the scenario for 'count' requests
+def prepare( api, data, scenario, count ):
+  if scenario.prepare is None:
+    return
+  with api.app.app_context():
+    ids = scenario.prepare( api, api.db.session, data, count )
+    api.db.session.commit()
+  data.spare[scenario.name] = collections.deque( ids )
+
+
+# the ( rule, method ) of the app's routes that no scenario requests
+def uncovered( app, scenarios ):
+  covered = {( scenario.rule, scenario.method ) for scenario in scenarios}
+  routes  = {( rule.rule, method ) for rule in app.url_map.iter_rules() if rule.endpoint != 'static' for method in rule.methods - {'HEAD', 'OPTIONS'}}
+  return sorted( routes - covered )
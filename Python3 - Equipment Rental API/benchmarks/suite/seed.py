@@ -0,0 +1,107 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Synthetic datasets for the benchmark suite
+
+The rows are written with executemany inserts, keeping the invariants the routes rely on: the
+inventory's rented units match the rentals, the rentals carry their cost, and the analytics
+rollups are rebuilt at the end.
+'''
+
+
+import collections
+import datetime
+import random
+from sqlalchemy import func, select, update
+
+
+CATEGORIES = ( 'Tools', 'Garden', 'Party', 'Lifting', 'Cleaning', 'Power', 'Camping', 'Audio' )
+WORDS      = ( 'cordless', 'drill', 'ladder', 'mower', 'tent', 'speaker', 'pressure', 'washer', 'saw', 'generator', 'heavy', 'duty', 'compact', 'electric' )
+STATES     = ( 'MI', 'NY', 'CA', 'TX', 'FL', 'OH', 'WA', 'IL' )
+# first day of the rentals, and how many days they spread over
+FIRST_DAY  = datetime.date( 2024, 1, 1 )
+DAYS       = 365
+# units in stock of every equipment, so the bookings of a run never run out
+STOCK      = 100000
+
+
+# ids of the seeded rows, and the spare rows set aside for the delete scenarios
+class Dataset:
+  def __init__( self, random_generator ) -> None:
+    self.random     = random_generator
+    self.customers  = []
+    self.equipment  = []
+    self.rentals    = []
+    # scenario name -> ids it may consume (one per request)
+    self.spare      = {}
+
+  def customer( self ):
+    return self.random.choice( self.customers )
+
+  def equipment_id( self ):
+    return self.random.choice( self.equipment )
+
+  def rental( self ):
+    return self.random.choice( self.rentals )
+
+  # a free id for a scenario that consumes them
+  def take( self, name ):
+    return self.spare[name].popleft()
+
+
+# a new row for each entity
+def equipment_row( rng ):
+  name = ' '.join( rng.sample( WORDS, 2 ) ).title()
+  return {"name": name, "price": round( rng.uniform( 5, 250 ), 2 ), "category": rng.choice( CATEGORIES ), "description": ' '.join( rng.sample( WORDS, 4 ) )}
+
+def customer_row( rng, index ):
+  return {"f_name": f"First{index}", "l_name": f"Last{index % 997}", "address": f"{index} Main St.", "city": "Somewhere", "state": rng.choice( STATES ), "phone": f"555-{index:07d}"}
+
+def rental_row( rng, customer_id, equipment_id ):
+  start = FIRST_DAY + datetime.timedelta( days = rng.randrange( DAYS ) )
+  return {"customer_id": customer_id, "equipment_id": equipment_id, "quantity": rng.randint( 1, 3 ), "start": start.isoformat(), "end": ( start + datetime.timedelta( days = rng.randint( 1, 14 ) ) ).isoformat()}
+
+
+# insert the rows of a model, returning their new ids (in order)
+def insert( session, model, rows ):
+  if not rows:
+    return []
+  first = session.scalar( select( func.max( model.id ) ) ) or 0
+  session.execute( model.__table__.insert(), rows )
+  return list( session.scalars( select( model.id ).where( model.id > first ).order_by( model.id ) ) )
+
+
+# insert rentals, reserving their units and adding them to the rollups as the routes do
+def insert_rentals( api, session, rows ):
+  prices = api.analytics.prices( session, [row['equipment_id'] for row in rows] )
+  values = []
+  for row in rows:
+    start, end = datetime.date.fromisoformat( row['start'] ), datetime.date.fromisoformat( row['end'] )
+    values.append( {**row, "start": start, "end": end, "cost": api.rental_cost( start, end, prices[row['equipment_id']][0], row['quantity'] )} )
+  ids = insert( session, api.Rental, values )
+  units = collections.Counter()
+  for row in values:
+    units[row['equipment_id']] += row['quantity']
+  for equipment_id, quantity in units.items():
+    session.execute( update( api.Inventory ).where( api.Inventory.equipment_id == equipment_id ).values( rented = api.Inventory.rented + quantity ) )
+  api.analytics.record( session, [( row['customer_id'], row['equipment_id'], prices[row['equipment_id']][1], row['quantity'], row['start'], row['end'], row['cost'] ) for row in values] )
+  # the availability indexes of the equipment are reloaded with the new rentals
+  api.availability.forget( *units )
+  return ids
+
+
+# seed the database of the app module 'api' and return the dataset
+def seed( api, customers = 1000, equipment = 500, rentals = 10000, seed = 1, chunk = 5000 ):
+  data = Dataset( random.Random( seed ) )
+  rng  = data.random
+  with api.app.app_context():
+    api.init_db()
+    session = api.db.session
+    data.customers = insert( session, api.Customer, [customer_row( rng, index ) for index in range( customers )] )
+    data.equipment = insert( session, api.Equipment, [equipment_row( rng ) for _ in range( equipment )] )
+    session.execute( api.Inventory.__table__.insert(), [{"equipment_id": id, "total": STOCK, "rented": 0} for id in data.equipment] )
+    for offset in range( 0, rentals, chunk ):
+      rows = [rental_row( rng, data.customer(), data.equipment_id() ) for _ in range( min( chunk, rentals - offset ) )]
+      data.rentals += insert_rentals( api, session, rows )
+    session.commit()
+    api.analytics.rebuild( session )
+  return data
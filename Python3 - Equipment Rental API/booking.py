@@ -0,0 +1,111 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Race-free inventory reservations for the rentals
+
+A rental holds its units from its booking until it's returned (see returns.py): the routes
+that update or delete a rental give its units back only while it holds them, reading it with a
+locking read so a return running at the same time waits for them (or they for it).
+'''
+
+
+import datetime
+from sqlalchemy import case, literal, select, update
+from changefeed import changed
+
+
+# the day (in UTC) the rentals ending on it or before are due back
+def today():
+  return datetime.datetime.now( datetime.timezone.utc ).date()
+
+
+'''
+single reservations (run them in the same transaction as the rental write)
+'''
+
+
+# remember which inventory rows the session touched, so their cache entries can be dropped after the commit
+def _touch( session, equipment_id ):
+  session.info.setdefault( 'booked', set() ).add( equipment_id )
+
+
+# reserve units with one conditional UPDATE: no row changes (and False is returned) when not enough units
+# are free, or when the quantity isn't positive (which would give units back instead)
+def reserve( session, inventory, equipment_id, quantity ):
+  _touch( session, equipment_id )
+  result = session.execute(
+    update( inventory )
+    .where( inventory.equipment_id == equipment_id, literal( quantity ) > 0, inventory.total - inventory.rented >= quantity )
+    .values( rented = inventory.rented + quantity )
+    .execution_options( synchronize_session = False )
+  )
+  if result.rowcount != 1:
+    return False
+  changed( session, inventory.__table__.name, 'update', equipment_id )
+  return True
+
+
+# give units back to the inventory (never going below zero)
+def release( session, inventory, equipment_id, quantity ):
+  _touch( session, equipment_id )
+  session.execute(
+    update( inventory )
+    .where( inventory.equipment_id == equipment_id )
+    .values( rented = case( ( inventory.rented > quantity, inventory.rented - quantity ), else_ = 0 ) )
+    .execution_options( synchronize_session = False )
+  )
+  changed( session, inventory.__table__.name, 'update', equipment_id )
+
+
+# move a rental's reservation to a new equipment/quantity, keeping the old one if the new one doesn't fit
+# ('held': the rental still holds its old units, 'holds': the updated rental holds units, see holds())
+def rebook( session, inventory, old_equipment_id, old_quantity, equipment_id, quantity, held = True, holds = True ):
+  if held:
+    release( session, inventory, old_equipment_id, old_quantity )
+  if not holds or reserve( session, inventory, equipment_id, quantity ):
+    return True
+  if held:
+    reserve( session, inventory, old_equipment_id, old_quantity )
+  return False
+
+
+# whether a rental holds units once updated to end on 'end': a returned rental is booked again
+# only when its end moves past today, the others hold theirs until they're returned
+def holds( returned, end ):
+  return returned is None or end > today()
+
+
+'''
+reservations for a chunk of bulk rental writes (returns the rejected rows)
+'''
+
+
+# keep the inventory in step with a chunk of bulk rental creates (POST), updates (PUT) or deletes (DELETE)
+def book_chunk( session, chunk, method, inventory, rental ):
+  rejected = {}
+  if method == 'POST':
+    # one conditional UPDATE per equipment in the chunk, for the sum of its rows
+    wanted = {}
+    for index, values in chunk:
+      indexes, quantity = wanted.get( values['equipment_id'], ( [], 0 ) )
+      wanted[values['equipment_id']] = ( indexes + [index], quantity + values['quantity'] )
+    for equipment_id, ( indexes, quantity ) in wanted.items():
+      if not reserve( session, inventory, equipment_id, quantity ):
+        for index in indexes:
+          rejected[index] = {"quantity": f"not enough units of equipment ({equipment_id}) available"}
+  elif method == 'PUT':
+    # (a locking read, so the returns wait for the chunk)
+    current = dict( ( row.id, row ) for row in session.execute( select( rental.id, rental.equipment_id, rental.quantity, rental.returned ).where( rental.id.in_( [values['id'] for _, values in chunk] ) ).with_for_update() ) )
+    for index, values in chunk:
+      old = current[values['id']]
+      held, holding = old.returned is None, holds( old.returned, values['end'] )
+      if not rebook( session, inventory, old.equipment_id, old.quantity, values['equipment_id'], values['quantity'], held, holding ):
+        rejected[index] = {"quantity": f"not enough units of equipment ({values['equipment_id']}) available"}
+      values['returned'] = None if holding else old.returned
+  else:
+    # give back the units the deleted rentals still hold, one UPDATE per equipment
+    totals = {}
+    for equipment_id, quantity in session.execute( select( rental.equipment_id, rental.quantity ).where( rental.id.in_( [value for _, value in chunk] ), rental.returned.is_( None ) ).with_for_update() ):
+      totals[equipment_id] = totals.get( equipment_id, 0 ) + quantity
+    for equipment_id, quantity in totals.items():
+      release( session, inventory, equipment_id, quantity )
+  return rejected
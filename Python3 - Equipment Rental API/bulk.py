@@ -0,0 +1,261 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Bulk create/update/delete with one transaction per chunk of rows
+'''
+
+
+import collections
+import datetime
+import functools
+import json
+from flask import current_app, jsonify, request
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from changefeed import changed
+
+
+# number of rows written per transaction when BULK_CHUNK_SIZE is not configured
+DEFAULT_CHUNK_SIZE = 1000
+
+
+'''
+field converters (raise ValueError when the value can't be stored in the column)
+'''
+
+
+# accept text values
+def string( value ):
+  if not isinstance( value, str ):
+    raise ValueError( "must be a string" )
+  return value
+
+
+# accept integer or decimal values (but not booleans)
+def number( value ):
+  if isinstance( value, bool ) or not isinstance( value, ( int, float ) ):
+    raise ValueError( "must be a number" )
+  return float( value )
+
+
+# accept whole numbers (but not booleans)
+def integer( value ):
+  if isinstance( value, bool ) or not isinstance( value, int ):
+    raise ValueError( "must be an integer" )
+  return value
+
+
+# accept whole numbers of 1 or more (e.g. a quantity)
+def positive( value ):
+  if isinstance( value, bool ) or not isinstance( value, int ) or value < 1:
+    raise ValueError( "must be a positive integer" )
+  return value
+
+
+# accept ISO dates and convert them for the Date columns
+def date( value ):
+  try:
+    return datetime.date.fromisoformat( value )
+  except ( TypeError, ValueError ):
+    raise ValueError( "must be a date formatted as YYYY-MM-DD" )
+
+
+'''
+request parsing and validation
+'''
+
+
+# read the submitted rows from a JSON array or from NDJSON (one JSON document per line)
+def read_rows():
+  if request.mimetype == 'application/x-ndjson':
+    lines = request.get_data( as_text = True ).splitlines()
+    return [json.loads( line ) for line in lines if line.strip()]
+  rows = request.get_json()
+  if not isinstance( rows, list ):
+    raise ValueError( "The body must be a JSON array or NDJSON" )
+  return rows
+
+
+# convert every field of a row, collecting the problems instead of stopping at the first one
+def validate( row, fields ):
+  if not isinstance( row, dict ):
+    return None, {"row": "must be a JSON object"}
+  values = {}
+  errors = {}
+  for name, convert in fields.items():
+    if name not in row:
+      errors[name] = "is required"
+      continue
+    try:
+      values[name] = convert( row[name] )
+    except ValueError as error:
+      errors[name] = str( error )
+  return values, errors
+
+
+# split a list in pieces of at most 'size' items
+def chunks( items, size ):
+  for start in range( 0, len( items ), size ):
+    yield items[start:start + size]
+
+
+'''
+bulk operations (each returns one result per submitted row, in the submitted order)
+'''
+
+
+# mark the rows whose key is given by another row too as invalid (which of them should win isn't known,
+# and a chunk writing both would apply their side effects, e.g. a booking, twice); returns the other rows
+def _reject_repeated( valid, key, key_of, results ):
+  counts = collections.Counter( key_of( values ) for _, values in valid )
+  unique = []
+  for index, values in valid:
+    if counts[key_of( values )] > 1:
+      results[index] = {"row": index, "status": "invalid", "errors": {key: "is given by more than one row"}}
+    else:
+      unique.append( ( index, values ) )
+  return unique
+
+
+# write a chunk in its own transaction, marking its rows as failed if the database rejects it
+# ('prepare' runs first in the same transaction and returns the rows it rejects, with their errors)
+def _write_chunk( session, chunk, write, results, status, prepare = None ):
+  try:
+    rejected = prepare( session, chunk ) if prepare is not None else {}
+    accepted = [item for item in chunk if item[0] not in rejected]
+    if accepted:
+      write( accepted )
+    session.commit()
+  except SQLAlchemyError as error:
+    session.rollback()
+    for index, _ in chunk:
+      results[index] = {"row": index, "status": "failed", "errors": {"database": str( getattr( error, 'orig', error ) )}}
+    return
+  for index, errors in rejected.items():
+    results[index] = {"row": index, "status": "conflict", "errors": errors}
+  for index, _ in accepted:
+    results[index] = {"row": index, "status": status}
+
+
+# insert the rows and return their primary keys (for the change log): the keys given in the rows,
+# or the ones returned by one INSERT ... RETURNING where the database can, or one INSERT per row
+def insert_rows( session, model, rows ):
+  key_column = model.__mapper__.primary_key[0]
+  if key_column.name in rows[0]:
+    session.execute( insert( model ), rows )
+    return [row[key_column.name] for row in rows]
+  if session.get_bind().dialect.insert_executemany_returning:
+    # (in no particular order, which keeps the rows batched in one statement)
+    return list( session.scalars( insert( model ).returning( key_column ), rows ) )
+  return [session.execute( insert( model ), row ).inserted_primary_key[0] for row in rows]
+
+
+# insert every valid row with executemany, committing once per chunk
+def bulk_create( session, model, fields, rows, chunk_size, prepare = None ):
+  results = [None] * len( rows )
+  valid = []
+  for index, row in enumerate( rows ):
+    values, errors = validate( row, fields )
+    if errors:
+      results[index] = {"row": index, "status": "invalid", "errors": errors}
+    else:
+      valid.append( ( index, values ) )
+  for chunk in chunks( valid, chunk_size ):
+    write = lambda accepted: changed( session, model.__table__.name, 'create', *insert_rows( session, model, [values for _, values in accepted] ) )
+    _write_chunk( session, chunk, write, results, "created", prepare )
+  return results
+
+
+# update every valid row by primary key, committing once per chunk
+def bulk_update( session, model, key, fields, rows, chunk_size, prepare = None ):
+  key_column = getattr( model, key )
+  results = [None] * len( rows )
+  valid = []
+  for index, row in enumerate( rows ):
+    values, errors = validate( row, {key: integer, **fields} )
+    if errors:
+      results[index] = {"row": index, "status": "invalid", "errors": errors}
+    else:
+      valid.append( ( index, values ) )
+  valid = _reject_repeated( valid, key, lambda values: values[key], results )
+  for chunk in chunks( valid, chunk_size ):
+    # one query to find which of the keys exist, so missing rows can be reported
+    existing = set( session.scalars( select( key_column ).where( key_column.in_( [values[key] for _, values in chunk] ) ) ) )
+    found = []
+    for index, values in chunk:
+      if values[key] in existing:
+        found.append( ( index, values ) )
+      else:
+        results[index] = {"row": index, "status": "not_found", key: values[key]}
+
+    def write( accepted ):
+      session.execute( update( model ), [values for _, values in accepted] )
+      changed( session, model.__table__.name, 'update', *[values[key] for _, values in accepted] )
+
+    _write_chunk( session, found, write, results, "updated", prepare )
+    for index, values in found:
+      results[index][key] = values[key]
+  return results
+
+
+# delete the given keys with one DELETE ... WHERE key IN (...) per chunk
+def bulk_delete( session, model, key, rows, chunk_size, prepare = None ):
+  key_column = getattr( model, key )
+  results = [None] * len( rows )
+  valid = []
+  for index, row in enumerate( rows ):
+    # accept plain ids or objects holding the key
+    value = row.get( key ) if isinstance( row, dict ) else row
+    try:
+      valid.append( ( index, integer( value ) ) )
+    except ValueError as error:
+      results[index] = {"row": index, "status": "invalid", "errors": {key: str( error )}}
+  valid = _reject_repeated( valid, key, lambda value: value, results )
+  for chunk in chunks( valid, chunk_size ):
+    existing = set( session.scalars( select( key_column ).where( key_column.in_( [value for _, value in chunk] ) ) ) )
+    found = []
+    for index, value in chunk:
+      if value in existing:
+        found.append( ( index, value ) )
+      else:
+        results[index] = {"row": index, "status": "not_found", key: value}
+
+    def write( accepted ):
+      session.execute( delete( model ).where( key_column.in_( [value for _, value in accepted] ) ).execution_options( synchronize_session = False ) )
+      changed( session, model.__table__.name, 'delete', *[value for _, value in accepted] )
+
+    _write_chunk( session, found, write, results, "deleted", prepare )
+    for index, value in found:
+      results[index][key] = value
+  return results
+
+
+'''
+route handler
+'''
+
+
+# handle a POST (create), PUT (update) or DELETE on a '/<Entity>/bulk' route, calling 'invalidate' with the changed keys
+# ('prepare' is called with the session, the method and each chunk before it's written, see _write_chunk)
+def bulk_request( session, model, key, fields, invalidate = None, prepare = None ):
+  try:
+    rows = read_rows()
+  except ValueError as error:
+    response = jsonify( {"message": f"Could not read the submitted rows: {error}"} )
+    response.status_code = 400
+    return response
+  chunk_size = current_app.config.get( 'BULK_CHUNK_SIZE', DEFAULT_CHUNK_SIZE )
+  if prepare is not None:
+    prepare = functools.partial( prepare, method = request.method )
+  if request.method == 'POST':
+    results = bulk_create( session, model, fields, rows, chunk_size, prepare )
+  elif request.method == 'PUT':
+    results = bulk_update( session, model, key, fields, rows, chunk_size, prepare )
+  else:
+    results = bulk_delete( session, model, key, rows, chunk_size, prepare )
+  if invalidate is not None:
+    invalidate( *[result[key] for result in results if result['status'] in ( 'updated', 'deleted' )] )
+  # count the rows by outcome so callers don't have to walk the whole report
+  summary = {}
+  for result in results:
+    summary[result['status']] = summary.get( result['status'], 0 ) + 1
+  return jsonify( {"message": f"Processed {len( rows )} rows", "summary": summary, "results": results} )
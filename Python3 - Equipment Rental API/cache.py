@@ -0,0 +1,335 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Read-through cache for the serialized single-entity GET responses
+'''
+
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# returned by the backends when a key is not cached (None is a valid cached value)
+MISSING = object()
+
+
+'''
+cache backends
+'''
+
+
+# in-process least recently used cache with a time to live and a size bound
+class LRUCache:
+  def __init__( self, max_entries = 10000, ttl = 60 ) -> None:
+    self.max_entries = max_entries
+    self.ttl         = ttl
+    self.entries     = OrderedDict()
+    self.lock        = threading.Lock()
+    self.evictions   = 0
+    self.expirations = 0
+
+  def get( self, key ):
+    with self.lock:
+      entry = self.entries.get( key )
+      if entry is None:
+        return MISSING
+      expires_at, value = entry
+      if expires_at < time.monotonic():
+        del self.entries[key]
+        self.expirations += 1
+        return MISSING
+      # mark as most recently used
+      self.entries.move_to_end( key )
+      return value
+
+  # the values of the keys (MISSING for the ones not cached)
+  def get_many( self, keys ):
+    return [self.get( key ) for key in keys]
+
+  def set( self, key, value ):
+    with self.lock:
+      self.entries[key] = ( time.monotonic() + self.ttl, value )
+      self.entries.move_to_end( key )
+      # drop the least recently used entries once over the bound
+      while len( self.entries ) > self.max_entries:
+        self.entries.popitem( last = False )
+        self.evictions += 1
+
+  def delete( self, key ):
+    with self.lock:
+      self.entries.pop( key, None )
+
+  def stats( self ):
+    return {"backend": "memory", "entries": len( self.entries ), "max_entries": self.max_entries, "evictions": self.evictions, "expirations": self.expirations}
+
+
+# cache shared between processes in a Redis compatible server (anything with get/set/delete)
+class RedisCache:
+  def __init__( self, client, ttl = 60, prefix = 'equipmentrental:' ) -> None:
+    self.client = client
+    self.ttl    = ttl
+    self.prefix = prefix
+
+  def get( self, key ):
+    value = self.client.get( self.prefix + key )
+    if value is None:
+      return MISSING
+    return json.loads( value )
+
+  # the values of the keys in one round trip (MISSING for the ones not cached)
+  def get_many( self, keys ):
+    return [MISSING if value is None else json.loads( value ) for value in self.client.mget( [self.prefix + key for key in keys] )]
+
+  def set( self, key, value ):
+    self.client.set( self.prefix + key, json.dumps( value ), ex = self.ttl )
+
+  def delete( self, key ):
+    self.client.delete( self.prefix + key )
+
+  def stats( self ):
+    # evictions happen in the server, see its INFO stats
+    return {"backend": "redis", "ttl": self.ttl}
+
+
+# minimal in-process stand-in for a Redis client, for local runs and tests
+class FakeRedis:
+  # Lua script -> the same steps in Python, twin( client, keys, args ), for register_script()
+  scripts = {}
+
+  def __init__( self ) -> None:
+    self.values = {}
+    # (reentrant: a script's twin runs the commands while holding it)
+    self.lock   = threading.RLock()
+
+  def get( self, name ):
+    with self.lock:
+      value, expires_at = self.values.get( name, ( None, None ) )
+      if expires_at is not None and expires_at < time.monotonic():
+        del self.values[name]
+        return None
+      return value
+
+  def mget( self, names ):
+    return [self.get( name ) for name in names]
+
+  def set( self, name, value, ex = None ):
+    with self.lock:
+      self.values[name] = ( value, time.monotonic() + ex if ex else None )
+    return True
+
+  def delete( self, *names ):
+    with self.lock:
+      return sum( 1 for name in names if self.values.pop( name, None ) is not None )
+
+  # a script run by its Python twin (registered in 'scripts'), alone like Redis runs a script
+  def register_script( self, script ):
+    twin = self.scripts[script]
+    def run( keys = (), args = () ):
+      with self.lock:
+        return twin( self, list( keys ), list( args ) )
+    return run
+
+
+'''
+read-through cache used by the routes
+'''
+
+
+class EntityCache:
+  def __init__( self, backend ) -> None:
+    self.backend       = backend
+    self.hits          = 0
+    self.misses        = 0
+    self.coalesced     = 0
+    self.invalidations = 0
+    # current( entity ) tells whether the rows of the entity just read may be cached (not when they
+    # were read from a replica behind the last write, see routing.py)
+    self.current       = lambda entity: True
+    # table_version( entity ) returns the version of the entity's table: the values are cached with
+    # the version read before loading them, and the ones older than the current version are misses
+    # (another process changed the table since, and its invalidations don't reach this cache)
+    self.table_version = lambda entity: 0
+    self.stale         = 0
+    self.mutex         = threading.Lock()
+    # one lock per key being loaded, with the number of threads (or tasks) waiting on it
+    self.loading       = {}
+    self.async_loading = {}
+
+  # return the cached value for the key, or load it once (even with concurrent misses) and cache it
+  def fetch( self, key, loader ):
+    if self.backend is None:
+      return loader()
+    entity  = key.partition( ':' )[0]
+    version = self.table_version( entity )
+    value   = self._get( key, version )
+    if value is not MISSING:
+      self.hits += 1
+      return value
+    lock = self._acquire( key )
+    try:
+      with lock:
+        # another thread may have loaded it while this one waited
+        value = self._get( key, version )
+        if value is not MISSING:
+          self.coalesced += 1
+          return value
+        self.misses += 1
+        invalidations = self.invalidations
+        value = loader()
+        # don't cache missing rows, or a value that a write invalidated while it was loading
+        if value is not None and invalidations == self.invalidations and self.current( entity ):
+          self.backend.set( key, [version, value] )
+        return value
+    finally:
+      self._release( key )
+
+  # same as fetch, for an async loader (concurrent misses in the event loop share one load)
+  async def fetch_async( self, key, loader ):
+    if self.backend is None:
+      return await loader()
+    version = self.table_version( key.partition( ':' )[0] )
+    value   = self._get( key, version )
+    if value is not MISSING:
+      self.hits += 1
+      return value
+    # the event loop runs one task at a time, so the lock table needs no mutex
+    entry = self.async_loading.setdefault( key, [asyncio.Lock(), 0] )
+    entry[1] += 1
+    try:
+      async with entry[0]:
+        value = self._get( key, version )
+        if value is not MISSING:
+          self.coalesced += 1
+          return value
+        self.misses += 1
+        invalidations = self.invalidations
+        value = await loader()
+        if value is not None and invalidations == self.invalidations:
+          self.backend.set( key, [version, value] )
+        return value
+    finally:
+      entry[1] -= 1
+      if entry[1] == 0:
+        del self.async_loading[key]
+
+  # the values of an entity's ids, {id: value}: the cached ones, and the others loaded together with
+  # one call of 'loader( ids )' (returning {id: value} for the rows found) and cached; the ids without
+  # a row are left out (the concurrent misses of a batch aren't collapsed, unlike fetch's)
+  def fetch_many( self, entity, ids, loader ):
+    if self.backend is None:
+      return loader( ids )
+    version = self.table_version( entity )
+    values, missing = self._cached( entity, ids, version )
+    if missing:
+      invalidations = self.invalidations
+      loaded = loader( missing )
+      self._store( entity, loaded, invalidations, version )
+      values.update( loaded )
+    return values
+
+  # same as fetch_many, for an async loader
+  async def fetch_many_async( self, entity, ids, loader ):
+    if self.backend is None:
+      return await loader( ids )
+    version = self.table_version( entity )
+    values, missing = self._cached( entity, ids, version )
+    if missing:
+      invalidations = self.invalidations
+      loaded = await loader( missing )
+      self._store( entity, loaded, invalidations, version )
+      values.update( loaded )
+    return values
+
+  # remove the keys after a write (call it once the write is committed)
+  def invalidate( self, *keys ):
+    if self.backend is None:
+      return
+    with self.mutex:
+      self.invalidations += 1
+    for key in keys:
+      self.backend.delete( key )
+
+  # same as invalidate, for entity ids
+  def forget( self, entity, *ids ):
+    self.invalidate( *[cache_key( entity, id ) for id in ids] )
+
+  def stats( self ):
+    backend = self.backend.stats() if self.backend is not None else {"backend": "none"}
+    return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "invalidations": self.invalidations, "stale": self.stale, **backend}
+
+  # the cached value of the key, MISSING when it isn't cached or was cached before the table's version
+  def _get( self, key, version ):
+    return self._current( self.backend.get( key ), version )
+
+  # the value of a cached [version, value] entry, MISSING when it was cached before the table's version
+  def _current( self, entry, version ):
+    if entry is MISSING:
+      return MISSING
+    cached_version, value = entry
+    if cached_version < version:
+      self.stale += 1
+      return MISSING
+    return value
+
+  # the cached values of the ids, {id: value}, and the ids not cached (or cached before the table's version)
+  def _cached( self, entity, ids, version ):
+    values, missing = {}, []
+    for id, entry in zip( ids, self.backend.get_many( [cache_key( entity, id ) for id in ids] ) ):
+      value = self._current( entry, version )
+      if value is MISSING:
+        missing.append( id )
+      else:
+        values[id] = value
+    self.hits   += len( values )
+    self.misses += len( missing )
+    return values, missing
+
+  # cache the loaded values, unless a write invalidated entries while they were loading
+  def _store( self, entity, loaded, invalidations, version ):
+    if invalidations != self.invalidations or not self.current( entity ):
+      return
+    for id, value in loaded.items():
+      self.backend.set( cache_key( entity, id ), [version, value] )
+
+  def _acquire( self, key ):
+    with self.mutex:
+      entry = self.loading.setdefault( key, [threading.Lock(), 0] )
+      entry[1] += 1
+      return entry[0]
+
+  def _release( self, key ):
+    with self.mutex:
+      entry = self.loading[key]
+      entry[1] -= 1
+      if entry[1] == 0:
+        del self.loading[key]
+
+
+# key for the cached serialization of one entity (ids from the URL are strings)
+def cache_key( entity, id ):
+  try:
+    return f"{entity}:{int( id )}"
+  except ( TypeError, ValueError ):
+    return f"{entity}:{id}"
+
+
+# build the cache described by the CACHE_* settings
+def create_cache( config ):
+  return EntityCache( cache_backend( config ) )
+
+
+# the storage selected by CACHE_BACKEND (None when caching is off)
+def cache_backend( config ):
+  backend = config.get( 'CACHE_BACKEND', 'memory' )
+  ttl     = config.get( 'CACHE_TTL', 60 )
+  if backend == 'memory':
+    return LRUCache( config.get( 'CACHE_MAX_ENTRIES', 10000 ), ttl )
+  if backend == 'redis':
+    # only needed when the redis backend is selected
+    import redis
+    return RedisCache( redis.Redis.from_url( config['CACHE_REDIS_URL'] ), ttl )
+  if backend == 'fakeredis':
+    return RedisCache( FakeRedis(), ttl )
+  return None
@@ -0,0 +1,179 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Append-only change log of the entities, and the /Changes feed read from it
+
+Every commit that creates, updates or deletes a tracked row (equipment, customer, inventory or
+rental) appends one entry per row to the change log, in the same transaction, whichever route,
+bulk import, booking or group commit batch did the write: the ORM writes are picked up from the
+session's flushes, the bulk statements and the inventory bookings report theirs with changed().
+GET /Changes?since=<seq> returns the entries after 'since' with the current state of their rows,
+so a consumer mirroring the tables only reads what changed.  With 'wait' the request is held
+until there is something new (long-poll), and with 'Accept: text/event-stream' the entries are
+pushed as Server-Sent Events.
+
+The sequence numbers come from an auto-increment column, so a transaction that commits late can
+leave a gap that is filled after a later entry was served.  The feed stops before a gap until
+CHANGES_GAP_WAIT seconds have passed (a gap left by a rollback is then skipped).
+'''
+
+
+import datetime
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, insert, inspect, select
+from sqlalchemy.orm import Session
+
+
+# current time in UTC, without a timezone (as the DATETIME columns store it)
+def _utcnow():
+  return datetime.datetime.now( datetime.timezone.utc ).replace( tzinfo = None )
+
+
+# log the creation, update or deletion ('create', 'update', 'delete') of rows of a table with
+# the session's next commit (for the writes the ORM doesn't see: bulk statements, bookings, ...)
+def changed( session, table, op, *keys ):
+  session.info.setdefault( 'changes', [] ).extend( ( table, op, key ) for key in keys )
+
+
+'''
+change log
+'''
+
+
+class ChangeFeed:
+  def __init__( self, model, sources, session, poll_interval = 1.0, gap_wait = 1.0 ) -> None:
+    # model of the change log ( seq, entity, op, entity_id, changed )
+    self.model   = model
+    # table name -> ( key field, row serializer ) of every tracked table, to read the rows' current state
+    self.sources = sources
+    self.tables  = frozenset( sources )
+    # the (scoped) session the feed is read with
+    self.session = session
+    # seconds between two reads of a waiting request (picks up the entries of other processes)
+    self.poll_interval = poll_interval
+    self.gap_wait      = gap_wait
+    # number of local commits that logged changes, to wake the waiting requests
+    self.condition  = threading.Condition()
+    self.generation = 0
+
+  # watch the writes of every session (sync, async, bulk and group commit) to log the rows they changed
+  def install( self, session_class = Session ):
+    event.listen( session_class, 'before_flush', self._before_flush )
+    event.listen( session_class, 'after_flush', self._after_flush )
+    event.listen( session_class, 'before_commit', self._before_commit )
+    event.listen( session_class, 'after_commit', self._after_commit )
+    event.listen( session_class, 'after_rollback', self._after_rollback )
+
+  # the entries after 'since' (at most 'limit', of the given tables or all), with the current
+  # state of their rows in 'data' (None once the row is deleted)
+  def read( self, since, limit, tables = None ):
+    model = self.model
+    query = select( model.seq, model.entity, model.op, model.entity_id, model.changed ).where( model.seq > since ).order_by( model.seq ).limit( limit )
+    rows  = self.session.execute( query ).all()
+    # stop before a gap a transaction in flight may still fill
+    now = _utcnow()
+    previous = since
+    for position, row in enumerate( rows ):
+      if previous and row.seq != previous + 1 and ( now - row.changed ).total_seconds() < self.gap_wait:
+        rows = rows[:position]
+        break
+      previous = row.seq
+    last = rows[-1].seq if rows else since
+    if tables:
+      rows = [row for row in rows if row.entity in tables]
+    # one query per table for the current state of the rows
+    states = {}
+    for table in {row.entity for row in rows}:
+      key, serializer = self.sources[table]
+      position = serializer.fields.index( key )
+      ids = {row.entity_id for row in rows if row.entity == table}
+      states[table] = {row[position]: serializer.dump_row( row ) for row in self.session.execute( select( *serializer.columns ).where( serializer.columns[position].in_( ids ) ) )}
+    entries = [{
+      "seq": row.seq,
+      "table": row.entity,
+      "op": row.op,
+      "id": row.entity_id,
+      "at": row.changed.isoformat(),
+      "data": states[row.entity].get( row.entity_id ),
+    } for row in rows]
+    return entries, last
+
+  # the entries after 'since', waiting up to 'wait' seconds for some when there are none yet
+  def poll( self, since, limit, tables = None, wait = 0 ):
+    deadline = time.monotonic() + wait
+    while True:
+      generation = self.generation
+      entries, last = self.read( since, limit, tables )
+      remaining = deadline - time.monotonic()
+      if entries or remaining <= 0:
+        return entries, last
+      # entries of other tables moved the position
+      since = last
+      # don't hold a connection while waiting
+      self.session.close()
+      self.wait( generation, min( remaining, self.poll_interval ) )
+
+  # the entries after 'since' as Server-Sent Events, until the client goes away
+  def stream( self, since, limit, tables = None, heartbeat = 15.0 ):
+    # the request (and its session) is torn down before the body is streamed
+    app = current_app._get_current_object()
+
+    def events( since ):
+      yield f"retry: {int( self.poll_interval * 1000 )}\n\n"
+      quiet = time.monotonic()
+      while True:
+        generation = self.generation
+        with app.app_context():
+          entries, since = self.read( since, limit, tables )
+        for entry in entries:
+          yield f"id: {entry['seq']}\nevent: change\ndata: {app.json.dumps( entry )}\n\n"
+        if entries:
+          quiet = time.monotonic()
+          continue
+        if time.monotonic() - quiet >= heartbeat:
+          # a comment, so proxies keep the connection and a client that went away is noticed
+          yield ": keep-alive\n\n"
+          quiet = time.monotonic()
+        self.wait( generation, self.poll_interval )
+
+    return events( since )
+
+  # wait until a local commit logs changes after 'generation', or for 'timeout' seconds
+  def wait( self, generation, timeout ):
+    with self.condition:
+      self.condition.wait_for( lambda: self.generation != generation, timeout )
+
+  def _before_flush( self, session, flush_context, instances ):
+    # the new rows get their keys in the flush
+    objects = [( item, 'create' ) for item in session.new] + [( item, 'update' ) for item in session.dirty if session.is_modified( item )] + [( item, 'delete' ) for item in session.deleted]
+    flushing = [( item, op ) for item, op in objects if item.__table__.name in self.tables]
+    if flushing:
+      session.info.setdefault( 'flushing', [] ).extend( flushing )
+
+  def _after_flush( self, session, flush_context ):
+    for item, op in session.info.pop( 'flushing', () ):
+      changed( session, item.__table__.name, op, inspect( item ).mapper.primary_key_from_instance( item )[0] )
+
+  def _before_commit( self, session ):
+    # write the pending changes first, so the rows they touch are known
+    session.flush()
+    changes = session.info.pop( 'changes', None )
+    if changes:
+      now = _utcnow()
+      # in order, once per row and operation
+      rows = [{"entity": table, "op": op, "entity_id": key, "changed": now} for table, op, key in dict.fromkeys( changes ) if table in self.tables]
+      if rows:
+        session.execute( insert( self.model ), rows )
+        session.info['logged_changes'] = True
+
+  def _after_commit( self, session ):
+    if session.info.pop( 'logged_changes', None ):
+      with self.condition:
+        self.generation += 1
+        self.condition.notify_all()
+
+  def _after_rollback( self, session ):
+    session.info.pop( 'changes', None )
+    session.info.pop( 'flushing', None )
+    session.info.pop( 'logged_changes', None )
@@ -0,0 +1,89 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  gzip/brotli compression of the large response bodies
+
+Bodies of at least COMPRESS_MIN_SIZE bytes are compressed with brotli (pip install brotli) or
+gzip, whichever the client accepts, brotli first.  Streamed bodies (NDJSON lists) are
+compressed as they're produced.  COMPRESS_ENABLED turns it off, e.g. behind a proxy that
+already compresses.
+'''
+
+
+import gzip
+import zlib
+from flask import request
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+
+# types worth compressing
+COMPRESSIBLE = ( 'application/json', 'application/x-ndjson', 'text/html', 'text/csv', 'text/plain' )
+
+
+# the encoding to use for the request, or None
+def choose_encoding( accept_encodings ):
+  if brotli is not None and accept_encodings['br']:
+    return 'br'
+  if accept_encodings['gzip']:
+    return 'gzip'
+  return None
+
+
+# compress a whole body
+def compress( data, encoding, level ):
+  if encoding == 'br':
+    return brotli.compress( data, quality = min( level, 11 ) )
+  return gzip.compress( data, compresslevel = level, mtime = 0 )
+
+
+# compress a streamed body chunk by chunk
+def compress_stream( chunks, encoding, level ):
+  if encoding == 'br':
+    compressor = brotli.Compressor( quality = min( level, 11 ) )
+    finish     = compressor.finish
+  else:
+    # gzip container (wbits 16 + 15)
+    compressor = zlib.compressobj( level, zlib.DEFLATED, 31 )
+    finish     = compressor.flush
+  try:
+    for chunk in chunks:
+      if isinstance( chunk, str ):
+        chunk = chunk.encode()
+      data = compressor.process( chunk ) if encoding == 'br' else compressor.compress( chunk )
+      if data:
+        yield data
+    yield finish()
+  finally:
+    # let the wrapped stream release its app context and database cursor
+    if hasattr( chunks, 'close' ):
+      chunks.close()
+
+
+# compress the response when it's large enough and the client accepts it
+def compress_response( response, config ):
+  if not config['COMPRESS_ENABLED'] or response.status_code != 200 or 'Content-Encoding' in response.headers:
+    return response
+  if response.mimetype not in COMPRESSIBLE:
+    return response
+  response.vary.add( 'Accept-Encoding' )
+  encoding = choose_encoding( request.accept_encodings )
+  if encoding is None:
+    return response
+  level = config['COMPRESS_LEVEL']
+  if response.is_streamed:
+    response.response = compress_stream( response.response, encoding, level )
+    response.headers.pop( 'Content-Length', None )
+  else:
+    if response.content_length is not None and response.content_length < config['COMPRESS_MIN_SIZE']:
+      return response
+    response.set_data( compress( response.get_data(), encoding, level ) )
+  response.headers['Content-Encoding'] = encoding
+  return response
+
+
+# compress the responses of the app
+def init_compression( app ):
+  app.after_request( lambda response: compress_response( response, app.config ) )
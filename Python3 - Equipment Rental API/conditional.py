@@ -0,0 +1,160 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Per-table version counters, and the ETag/Last-Modified conditional GETs built on them
+
+Every commit that wrote to a tracked table bumps that table's row in the version table (in the
+same transaction, as its last statement), whichever route, bulk import or booking did the
+write.  The GET routes derive their ETag and Last-Modified from the versions of the tables they
+read, so a client polling an unchanged resource gets a 304 Not Modified before the rows are
+queried or serialized.  The versions are cached per process for VERSIONS_MAX_AGE seconds (the
+local commits refresh them right away), which bounds how late writes made by other processes
+are seen.  The per-process copies the GET routes answer from (the entity cache, the availability
+and search indexes) are stamped with the version they were read at and reloaded once it moves
+on, so a body is never older than the ETag sent with it.
+'''
+
+
+import datetime
+import functools
+import threading
+import time
+from flask import make_response, request
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+
+# current time in UTC, without a timezone (as the DATETIME columns store it)
+def _utcnow():
+  return datetime.datetime.now( datetime.timezone.utc ).replace( tzinfo = None )
+
+
+'''
+table versions
+'''
+
+
+class TableVersions:
+  def __init__( self, model, tables, loader, max_age = 1.0 ) -> None:
+    # model of the version table ( name, version, modified ), and the names of the tables to track
+    self.model   = model
+    self.tables  = frozenset( tables )
+    # loader() returns the ( name, version, modified ) of every table
+    self.loader  = loader
+    self.max_age = max_age
+    self.lock    = threading.Lock()
+    self.loaded  = None
+    self.current = {}
+    # number of local commits that changed versions, to detect the ones racing with a load
+    self.generation = 0
+
+  # add the missing rows of the version table
+  def ensure( self, session ):
+    present = set( session.scalars( select( self.model.name ) ) )
+    session.add_all( [self.model( name = name, version = 0, modified = _utcnow() ) for name in sorted( self.tables - present )] )
+    session.commit()
+
+  # watch the writes of every session (sync, async and bulk) to bump the versions of the tables they changed
+  def install( self, session_class = Session ):
+    event.listen( session_class, 'before_flush', self._before_flush )
+    event.listen( session_class, 'do_orm_execute', self._do_orm_execute )
+    event.listen( session_class, 'before_commit', self._before_commit )
+    event.listen( session_class, 'after_commit', self._after_commit )
+    event.listen( session_class, 'after_rollback', self._after_rollback )
+
+  # ( version, modified ) of each of the tables
+  def read( self, tables ):
+    with self.lock:
+      fresh      = self.loaded is not None and time.monotonic() - self.loaded < self.max_age
+      current    = self.current
+      generation = self.generation
+    if not fresh:
+      current = {name: ( version, modified ) for name, version, modified in self.loader()}
+      with self.lock:
+        # keep what was read only if no local commit changed the versions meanwhile
+        if self.generation == generation:
+          self.current, self.loaded = current, time.monotonic()
+    return [current.get( name, ( 0, None ) ) for name in tables]
+
+  def _changed( self, session, names ):
+    names = self.tables.intersection( names )
+    if names:
+      session.info.setdefault( 'changed_tables', set() ).update( names )
+
+  def _before_flush( self, session, flush_context, instances ):
+    objects = list( session.new ) + list( session.deleted ) + [item for item in session.dirty if session.is_modified( item )]
+    self._changed( session, [item.__table__.name for item in objects] )
+
+  def _do_orm_execute( self, state ):
+    if state.is_insert or state.is_update or state.is_delete:
+      self._changed( state.session, [state.statement.table.name] )
+
+  def _before_commit( self, session ):
+    # write the pending changes first, so the tables they touch are known
+    session.flush()
+    changed = session.info.pop( 'changed_tables', None )
+    if changed:
+      model = self.model
+      session.execute( update( model ).where( model.name.in_( sorted( changed ) ) ).values( version = model.version + 1, modified = _utcnow() ) )
+      session.info['bumped_tables'] = changed
+
+  def _after_commit( self, session ):
+    if session.info.pop( 'bumped_tables', None ):
+      with self.lock:
+        self.generation += 1
+        self.loaded = None
+
+  def _after_rollback( self, session ):
+    session.info.pop( 'changed_tables', None )
+    session.info.pop( 'bumped_tables', None )
+
+
+'''
+conditional GET responses
+'''
+
+
+# ETag and Last-Modified of the state of the tables
+def validators( versions, tables ):
+  state    = versions.read( tables )
+  tag      = '-'.join( f"{name}.{version}" for name, ( version, _ ) in zip( tables, state ) )
+  modified = [value for _, value in state if value is not None]
+  # in whole seconds, the precision of the HTTP dates
+  last_modified = max( modified ).replace( tzinfo = datetime.timezone.utc, microsecond = 0 ) if modified else None
+  if last_modified is not None:
+    # tell apart the same counters of a recreated database
+    tag = f"{tag}-{int( last_modified.timestamp() ):x}"
+  return tag, last_modified
+
+
+# True when the client's copy (If-None-Match, or If-Modified-Since without it) is still current
+def not_modified( current, tag, last_modified ):
+  if current.if_none_match:
+    return current.if_none_match.contains_weak( tag )
+  if current.if_modified_since and last_modified is not None:
+    return last_modified <= current.if_modified_since
+  return False
+
+
+# answer the GET with 304 Not Modified when none of the tables changed since the client's copy
+# ('expand' maps the values of the 'expand' query argument to the extra tables they read)
+def conditional( versions, *tables, expand = None ):
+  def decorator( view ):
+    @functools.wraps( view )
+    def wrapper( *args, **kwargs ):
+      names = list( tables )
+      if expand:
+        names += sorted( {expand[value] for value in request.args.get( 'expand', '' ).split( ',' ) if value in expand} )
+      tag, last_modified = validators( versions, names )
+      if not_modified( request, tag, last_modified ):
+        response = make_response( '', 304 )
+      else:
+        response = make_response( view( *args, **kwargs ) )
+        if response.status_code != 200:
+          return response
+      # weak, so it stays valid for the compressed bodies and the other formats ( Vary tells them apart )
+      response.set_etag( tag, weak = True )
+      response.last_modified = last_modified
+      response.vary.add( 'Accept' )
+      return response
+    return wrapper
+  return decorator
@@ -0,0 +1,114 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Engine and connection pool setup, and the pool statistics
+'''
+
+
+import threading
+import time
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.pool import QueuePool
+
+
+'''
+connection pool that measures how long requests wait for a connection
+'''
+
+
+class TimedQueuePool( QueuePool ):
+  def __init__( self, *args, **kwargs ) -> None:
+    super().__init__( *args, **kwargs )
+    self.stats_lock = threading.Lock()
+    self.checkouts  = 0
+    self.timeouts   = 0
+    self.wait_total = 0.0
+    self.wait_max   = 0.0
+
+  def _do_get( self ):
+    started = time.perf_counter()
+    try:
+      return super()._do_get()
+    except Exception:
+      with self.stats_lock:
+        self.timeouts += 1
+      raise
+    finally:
+      waited = time.perf_counter() - started
+      with self.stats_lock:
+        self.checkouts  += 1
+        self.wait_total += waited
+        self.wait_max    = max( self.wait_max, waited )
+
+
+# current state of an engine's pool
+def pool_stats( engine ):
+  pool  = engine.pool
+  stats = {"class": type( pool ).__name__, "status": pool.status()}
+  if isinstance( pool, QueuePool ):
+    stats.update( {"size": pool.size(), "checked_in": pool.checkedin(), "checked_out": pool.checkedout(), "overflow": pool.overflow()} )
+  if isinstance( pool, TimedQueuePool ):
+    with pool.stats_lock:
+      stats.update( {
+        "checkouts": pool.checkouts,
+        "timeouts": pool.timeouts,
+        "wait_total_ms": round( pool.wait_total * 1000, 3 ),
+        "wait_avg_ms": round( pool.wait_total * 1000 / pool.checkouts, 3 ) if pool.checkouts else 0.0,
+        "wait_max_ms": round( pool.wait_max * 1000, 3 ),
+      } )
+  return stats
+
+
+# add the nullable columns of the models that are missing from existing tables
+def create_columns( engine, metadata ):
+  existing = inspect( engine )
+  with engine.begin() as connection:
+    for table in metadata.sorted_tables:
+      if not existing.has_table( table.name ):
+        continue
+      present = {column['name'] for column in existing.get_columns( table.name )}
+      for column in table.columns:
+        if column.name not in present and column.nullable:
+          connection.execute( text( f"ALTER TABLE {engine.dialect.identifier_preparer.format_table( table )} ADD COLUMN {CreateColumn( column ).compile( dialect = engine.dialect )}" ) )
+
+
+# create the indexes of the models that are missing from existing tables
+def create_indexes( engine, metadata ):
+  for table in metadata.sorted_tables:
+    for index in table.indexes:
+      index.create( engine, checkfirst = True )
+
+
+'''
+engine options
+'''
+
+
+# SQLAlchemy engine options for the DB_* settings ('timed' selects TimedQueuePool, not usable by async engines)
+def engine_options( config, uri = None, timed = True ):
+  url     = make_url( uri or config['SQLALCHEMY_DATABASE_URI'] )
+  backend = url.get_backend_name()
+  options = {}
+  if config.get( 'DB_ISOLATION_LEVEL' ):
+    options['isolation_level'] = config['DB_ISOLATION_LEVEL']
+  # SQLite connections are local files, there's nothing to pool or time out
+  if backend == 'sqlite':
+    return options
+  options.update( {
+    "pool_size": config['DB_POOL_SIZE'],
+    "max_overflow": config['DB_MAX_OVERFLOW'],
+    "pool_timeout": config['DB_POOL_TIMEOUT'],
+    "pool_pre_ping": config['DB_POOL_PRE_PING'],
+    "pool_recycle": config['DB_POOL_RECYCLE'],
+  } )
+  if timed:
+    options['poolclass'] = TimedQueuePool
+  timeout = config.get( 'DB_STATEMENT_TIMEOUT_MS' )
+  if timeout:
+    if backend == 'mysql':
+      # only applies to SELECT statements in MySQL
+      options['connect_args'] = {"init_command": f"SET SESSION max_execution_time={int( timeout )}"}
+    elif backend == 'postgresql':
+      options['connect_args'] = {"options": f"-c statement_timeout={int( timeout )}"}
+  return options
@@ -0,0 +1,180 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Columnar bulk export of whole tables as CSV, Arrow IPC or Parquet, streamed in record batches
+
+GET /Export/{entity} (and 'flask --app main export') reads the table with a server-side cursor
+(stream_results), in batches of EXPORT_BATCH_SIZE rows, and writes each batch out as soon as it's
+read: CSV lines, an Arrow IPC record batch or a Parquet row group.  Only one batch is in memory at
+a time whatever the size of the table, and the rows go from the cursor's tuples to the output
+without ORM objects or JSON.  The rows are exported in key order, so 'since_id' (the last key of
+the previous export) fetches only the newer rows; 'from' and 'to' limit the tables with a date
+(the rentals, by their start).
+
+Arrow and Parquet need pyarrow (pip install pyarrow); CSV needs nothing more.
+'''
+
+
+import csv
+import datetime
+import importlib.util
+import io
+from sqlalchemy import select, type_coerce
+from sqlalchemy.types import NullType
+
+
+# format -> ( content type, file extension )
+FORMATS = {
+  "csv": ( 'text/csv', 'csv' ),
+  "arrow": ( 'application/vnd.apache.arrow.stream', 'arrow' ),
+  "parquet": ( 'application/vnd.apache.parquet', 'parquet' ),
+}
+
+
+# the formats this installation can write (Arrow and Parquet need pyarrow)
+def available_formats():
+  if importlib.util.find_spec( 'pyarrow' ) is None:
+    return ( 'csv', )
+  return tuple( FORMATS )
+
+
+# a table that can be exported: its key (for the order and 'since_id') and its date column (for 'from' and 'to')
+class Export:
+  def __init__( self, table, key, date = None ) -> None:
+    self.table   = table
+    self.columns = tuple( table.columns )
+    self.key     = table.columns[key]
+    self.date    = table.columns[date] if date is not None else None
+
+  # the rows after 'since_id' (a key), with a date from 'start' to 'end' (both included), in key order;
+  # the values come as the driver returns them (e.g. SQLite's dates as ISO strings), without the
+  # conversion of each value to a Python object, which costs more than writing it
+  def query( self, since_id = None, start = None, end = None ):
+    query = select( *[type_coerce( column, NullType() ).label( column.name ) for column in self.columns] ).order_by( self.key )
+    if since_id is not None:
+      query = query.where( self.key > since_id )
+    if start is not None:
+      query = query.where( self.date >= start )
+    if end is not None:
+      query = query.where( self.date <= end )
+    return query
+
+
+# the 'since_id', 'from' and 'to' filters of the query string (raises ValueError with the message)
+def export_filters( args, export ):
+  filters = {}
+  if args.get( 'since_id' ):
+    try:
+      filters['since_id'] = int( args['since_id'] )
+    except ValueError:
+      raise ValueError( "Query parameter 'since_id' must be an integer" )
+  for name, argument in ( ( 'start', 'from' ), ( 'end', 'to' ) ):
+    if args.get( argument ):
+      if export.date is None:
+        raise ValueError( f"This table has no date to filter with '{argument}'" )
+      try:
+        filters[name] = datetime.date.fromisoformat( args[argument] )
+      except ValueError:
+        raise ValueError( f"Query parameter '{argument}' must be a date formatted as YYYY-MM-DD" )
+  return filters
+
+
+# the rows of the query in lists of up to 'batch_size', read with a server-side cursor
+def batches( engine, query, batch_size ):
+  with engine.connect() as connection:
+    result = connection.execution_options( stream_results = True, yield_per = batch_size ).execute( query )
+    for rows in result.partitions( batch_size ):
+      yield rows
+
+
+# the output of the export in the format, chunk by chunk (one chunk per batch)
+def export_chunks( engine, export, format, batch_size, **filters ):
+  rows = batches( engine, export.query( **filters ), batch_size )
+  names = [column.name for column in export.columns]
+  if format == 'csv':
+    return csv_chunks( names, rows )
+  return arrow_chunks( export.columns, rows, format )
+
+
+'''
+writers
+'''
+
+
+def csv_chunks( names, batches ):
+  buffer = io.StringIO()
+  writer = csv.writer( buffer, lineterminator = '\n' )
+  writer.writerow( names )
+  for rows in batches:
+    writer.writerows( rows )
+    yield buffer.getvalue().encode()
+    buffer.seek( 0 )
+    buffer.truncate()
+  if buffer.tell():
+    yield buffer.getvalue().encode()
+
+
+# file object handing what's written to it over to the generator (the writers only append)
+class Chunks:
+  def __init__( self ) -> None:
+    self.parts    = []
+    self.position = 0
+    self.closed   = False
+
+  def write( self, data ):
+    self.parts.append( bytes( data ) )
+    self.position += len( data )
+    return len( data )
+
+  def tell( self ):
+    return self.position
+
+  def flush( self ):
+    pass
+
+  def close( self ):
+    self.closed = True
+
+  # what was written since the last call
+  def take( self ):
+    data, self.parts = b''.join( self.parts ), []
+    return data
+
+
+# the Arrow type of a column
+def arrow_type( pyarrow, column ):
+  try:
+    python_type = column.type.python_type
+  except NotImplementedError:
+    python_type = str
+  return {
+    int: pyarrow.int64(),
+    float: pyarrow.float64(),
+    bool: pyarrow.bool_(),
+    datetime.date: pyarrow.date32(),
+    datetime.datetime: pyarrow.timestamp( 'us' ),
+  }.get( python_type, pyarrow.string() )
+
+
+def arrow_chunks( columns, batches, format ):
+  # only needed for these formats
+  import pyarrow
+  import pyarrow.ipc
+  import pyarrow.parquet
+  schema = pyarrow.schema( [( column.name, arrow_type( pyarrow, column ), column.nullable ) for column in columns] )
+  sink = Chunks()
+  writer = pyarrow.ipc.new_stream( sink, schema ) if format == 'arrow' else pyarrow.parquet.ParquetWriter( sink, schema )
+  try:
+    for rows in batches:
+      # the tuples as columns, converted to the column types (e.g. SQLite's date strings)
+      arrays = [pyarrow.array( values ) for values in zip( *rows )]
+      batch = pyarrow.RecordBatch.from_arrays( [array if array.type == field.type else array.cast( field.type ) for array, field in zip( arrays, schema )], schema = schema )
+      if format == 'arrow':
+        writer.write_batch( batch )
+      else:
+        # one row group per batch
+        writer.write_table( pyarrow.Table.from_batches( [batch] ) )
+      yield sink.take()
+  finally:
+    writer.close()
+  # the end of the stream, or the Parquet footer
+  yield sink.take()
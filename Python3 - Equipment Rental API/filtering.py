@@ -0,0 +1,51 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Filter and sort query arguments of the list routes
+
+Each list declares its filters as { argument: function( value ) -> SQL condition } and its
+sortable columns as { name: column }, e.g. '?category=Tools&price_max=50&sort=-price'.  The
+columns they use are indexed, so the database reads only the matching rows, in order.
+'''
+
+
+from flask import jsonify
+
+
+# read the filters and the sort of a list (raises ValueError with the name of a bad argument)
+def list_filters( args, filters, sorts ):
+  conditions = []
+  for name, condition in filters.items():
+    value = args.get( name )
+    if value is None or value == '':
+      continue
+    try:
+      conditions.append( condition( value ) )
+    except ( ValueError, TypeError ):
+      raise ValueError( name )
+  return conditions, sort_argument( args, sorts )
+
+
+# read 'sort=column' (ascending) or 'sort=-column' (descending) as ( column, descending ), or None
+def sort_argument( args, sorts ):
+  value = args.get( 'sort' )
+  if value is None or value == '':
+    return None
+  descending = value.startswith( '-' )
+  column = sorts.get( value.lstrip( '-' ) )
+  if column is None:
+    raise ValueError( 'sort' )
+  return column, descending
+
+
+# message for a bad filter or sort argument
+def filter_message( name, sorts ):
+  if name == 'sort':
+    return f"Query parameter 'sort' must be one of {', '.join( sorts )} (prefixed with '-' for descending order)"
+  return f"Query parameter '{name}' has an invalid value"
+
+
+# build the 400 response for a bad filter or sort argument
+def bad_filter( name, sorts ):
+  response = jsonify( {"message": filter_message( name, sorts )} )
+  response.status_code = 400
+  return response
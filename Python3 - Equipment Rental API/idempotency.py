@@ -0,0 +1,315 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Idempotency keys for the POST routes: a retried request is answered with the stored response
+
+A client that sends an 'Idempotency-Key' header with a POST can retry it safely: the first request
+claims the key (a row of the idempotency table, committed before the handler runs), runs and
+stores its response in the row; a retry with the same key (on the same route) is answered with
+the stored response, marked 'Idempotent-Replayed: true', without running the handler, so nothing
+is written twice.  The completed responses are also kept in a small in-process cache, so most
+retries don't query the database at all.
+
+Duplicates arriving while the first request is still running wait for it: in the same process
+behind a lock per key, in other processes by polling the row for up to IDEMPOTENCY_WAIT seconds
+(then 409 with a Retry-After).  Reusing a key with a different body is a 422.  A request that
+fails (an exception or a 5xx) frees its key, so it can be retried; the 2xx and 4xx answers are
+stored.  The keys expire after IDEMPOTENCY_TTL seconds.
+
+A claim is a lease: a claim still without a response after IDEMPOTENCY_CLAIM_TIMEOUT seconds (its
+process died, or timed out) is taken over by the next retry, which runs the request again.  So
+that the retry can't write twice, the route's commit also marks the claim 'written' (status 0) in
+the same transaction: a written claim is never taken over, and a request whose claim was taken
+over can't commit (its mark finds the claim of another).  A retry of a written claim whose
+response was lost is answered 409 until the key expires.
+'''
+
+
+import contextvars
+import datetime
+import functools
+import hashlib
+import secrets
+import threading
+import time
+from flask import current_app, jsonify, make_response, request
+from sqlalchemy import delete, event, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from cache import LRUCache, MISSING
+
+
+# longest key accepted from a client
+MAX_KEY_LENGTH = 255
+# seconds between two deletions of the expired keys (per process), and between two reads of a key another process holds
+PURGE_INTERVAL = 60
+POLL_INTERVAL  = 0.05
+# status of a claim whose request committed its write, but has no response stored yet
+WRITTEN = 0
+# the claim of the request running in this context, ( key, claim token ), None outside one
+_claimed = contextvars.ContextVar( 'claimed', default = None )
+# answer of _await() for a written claim whose request stopped before storing its response
+LOST = object()
+
+
+# raised by the commit of a request whose claim was taken over by a retry (the commit is abandoned)
+class ClaimLost( Exception ):
+  pass
+
+
+# current time in UTC, without a timezone (as the DATETIME columns store it)
+def _utcnow():
+  return datetime.datetime.now( datetime.timezone.utc ).replace( tzinfo = None )
+
+
+# 128 bits of the SHA-256 of the text, in hexadecimal (the compact keys and fingerprints of the table)
+def _digest( text ):
+  return hashlib.sha256( text ).hexdigest()[:32]
+
+
+# answer with a status and a message
+def _error( status, message, retry_after = None ):
+  response = jsonify( {"message": message} )
+  response.status_code = status
+  if retry_after is not None:
+    response.headers['Retry-After'] = str( retry_after )
+  return response
+
+
+class Idempotency:
+  def __init__( self, model, session, ttl = 86400, wait = 10.0, max_entries = 10000, claim_timeout = 60.0 ) -> None:
+    # model of the key table ( key, fingerprint, claim, status, content_type, body, created )
+    self.model   = model
+    # the (scoped) session of the requests
+    self.session = session
+    self.ttl     = ttl
+    self.wait    = wait
+    self.claim_timeout = claim_timeout
+    # the completed responses: key -> ( fingerprint, status, content_type, body, created )
+    self.recent  = LRUCache( max_entries, ttl )
+    self.mutex   = threading.Lock()
+    # one lock per key being answered, with the number of requests waiting on it
+    self.running = {}
+    self.purged  = time.monotonic()
+    self.stored    = 0
+    self.replayed  = 0
+    self.collapsed = 0
+    self.conflicts = 0
+    self.taken_over = 0
+    self.lost       = 0
+    # the commits of the requests holding a claim mark it written
+    event.listen( session, 'before_commit', self._mark )
+
+  # the settings of the app (IDEMPOTENCY_*)
+  def init_app( self, app ):
+    self.ttl    = app.config['IDEMPOTENCY_TTL']
+    self.wait   = app.config['IDEMPOTENCY_WAIT']
+    self.recent = LRUCache( app.config['IDEMPOTENCY_MAX_ENTRIES'], self.ttl )
+    self.claim_timeout = app.config['IDEMPOTENCY_CLAIM_TIMEOUT']
+
+  # decorator of a POST route honouring the Idempotency-Key header (without it, the route runs as usual)
+  def idempotent( self, view ):
+    @functools.wraps( view )
+    def wrapper( *args, **kwargs ):
+      header = request.headers.get( 'Idempotency-Key' )
+      if header is None:
+        return view( *args, **kwargs )
+      if not header or len( header ) > MAX_KEY_LENGTH:
+        return _error( 400, f"The Idempotency-Key must have 1 to {MAX_KEY_LENGTH} characters" )
+      # the same key on two routes are two keys
+      key = _digest( f"{request.method} {request.path} {header}".encode() )
+      fingerprint = _digest( request.get_data() )
+      lock = self._acquire( key )
+      try:
+        # duplicates in this process wait here, then find the stored response
+        if not lock.acquire( blocking = False ):
+          with self.mutex:
+            self.collapsed += 1
+          lock.acquire()
+        try:
+          return self._answer( key, fingerprint, view, args, kwargs )
+        finally:
+          lock.release()
+      finally:
+        self._release( key )
+    return wrapper
+
+  def stats( self ):
+    with self.mutex:
+      return {"stored": self.stored, "replayed": self.replayed, "collapsed": self.collapsed, "conflicts": self.conflicts, "taken_over": self.taken_over, "lost": self.lost, "running": len( self.running ), **self.recent.stats()}
+
+  # a write for the group commit writer, marking the claim of the current request in the writer's
+  # transaction (the writer's commits don't run in the request's context)
+  def marked( self, apply ):
+    claim = _claimed.get()
+    if claim is None:
+      return apply
+    def write( session ):
+      result = apply( session )
+      self._mark_claim( session, claim )
+      return result
+    return write
+
+  def _answer( self, key, fingerprint, view, args, kwargs ):
+    stored = self._stored( key )
+    claim  = None
+    while stored is None:
+      claim = self._claim( key, fingerprint )
+      if claim is not None:
+        break
+      # another process is answering it
+      stored = self._await( key )
+      if stored is MISSING or stored is LOST:
+        with self.mutex:
+          self.conflicts += 1
+        if stored is LOST:
+          return _error( 409, "A request with this Idempotency-Key was processed, but its response was lost" )
+        return _error( 409, "A request with this Idempotency-Key is still in progress, try again later", 1 )
+    if stored is not None:
+      return self._replay( stored, fingerprint )
+    token = _claimed.set( ( key, claim ) )
+    try:
+      response = make_response( view( *args, **kwargs ) )
+    except ClaimLost:
+      self.session.rollback()
+      return _error( 409, "A retry with this Idempotency-Key took the request over, it wasn't processed here", 1 )
+    except Exception:
+      self._forget( key, claim )
+      raise
+    finally:
+      _claimed.reset( token )
+    if response.status_code >= 500:
+      self._forget( key, claim )
+      return response
+    self._complete( key, claim, fingerprint, response )
+    return response
+
+  # the completed response of the key (from the cache or the table), None when there is none (yet)
+  def _stored( self, key ):
+    stored = self.recent.get( key )
+    if stored is MISSING:
+      stored = self._load( key )
+      if stored is None or stored[1] in ( None, WRITTEN ):
+        return None
+      self.recent.set( key, stored )
+    # (the cache may keep a response a little longer than its key)
+    if ( _utcnow() - stored[4] ).total_seconds() > self.ttl:
+      return None
+    return stored
+
+  # the row of the key, None when there is none or it expired
+  def _load( self, key ):
+    model = self.model
+    row = self.session.execute( select( model.fingerprint, model.status, model.content_type, model.body, model.created ).where( model.key == key ) ).first()
+    if row is None or ( _utcnow() - row.created ).total_seconds() > self.ttl:
+      return None
+    return tuple( row )
+
+  # insert the row of the key (no response yet), or take over an expired key or a claim past its
+  # lease; returns the token of the claim, None when another request holds it
+  def _claim( self, key, fingerprint ):
+    model = self.model
+    self._purge()
+    claim = secrets.token_hex( 16 )
+    now   = _utcnow()
+    try:
+      self.session.execute( insert( model ).values( key = key, fingerprint = fingerprint, claim = claim, created = now ) )
+      self.session.commit()
+      return claim
+    except IntegrityError:
+      self.session.rollback()
+    expired   = model.created < now - datetime.timedelta( seconds = self.ttl )
+    abandoned = model.status.is_( None ) & ( model.created < now - datetime.timedelta( seconds = self.claim_timeout ) )
+    taken = self.session.execute( update( model ).where( model.key == key, or_( expired, abandoned ) ).values( fingerprint = fingerprint, claim = claim, status = None, content_type = None, body = None, created = now ) ).rowcount
+    self.session.commit()
+    if not taken:
+      return None
+    with self.mutex:
+      self.taken_over += 1
+    return claim
+
+  # wait for the response of a key claimed by another process: None when that request failed and
+  # freed the key (or its claim's lease ran out), MISSING when it's still running after
+  # IDEMPOTENCY_WAIT seconds, LOST when it wrote but stopped before storing its response
+  def _await( self, key ):
+    deadline = time.monotonic() + self.wait
+    while time.monotonic() < deadline:
+      # don't hold a connection while waiting
+      self.session.close()
+      time.sleep( POLL_INTERVAL )
+      stored = self._load( key )
+      if stored is None:
+        return None
+      if stored[1] not in ( None, WRITTEN ):
+        self.recent.set( key, stored )
+        return stored
+      if ( _utcnow() - stored[4] ).total_seconds() > self.claim_timeout:
+        if stored[1] is None:
+          return None
+        with self.mutex:
+          self.lost += 1
+        return LOST
+    return MISSING
+
+  # mark the claim of the request written, in the transaction being committed (see marked() for the group commit)
+  def _mark( self, session ):
+    claim = _claimed.get()
+    if claim is not None:
+      self._mark_claim( session, claim )
+
+  def _mark_claim( self, session, claim ):
+    model = self.model
+    key, token = claim
+    marked = session.execute( update( model ).where( model.key == key, model.claim == token, or_( model.status.is_( None ), model.status == WRITTEN ) ).values( status = WRITTEN ) ).rowcount
+    if not marked:
+      raise ClaimLost( "the Idempotency-Key was taken over by a retry" )
+
+  def _complete( self, key, claim, fingerprint, response ):
+    model = self.model
+    body = response.get_data( as_text = True )
+    stored = self.session.execute( update( model ).where( model.key == key, model.claim == claim ).values( status = response.status_code, content_type = response.content_type, body = body ) ).rowcount
+    self.session.commit()
+    # (a request that wrote nothing may have been taken over by a retry meanwhile)
+    if not stored:
+      return
+    self.recent.set( key, ( fingerprint, response.status_code, response.content_type, body, _utcnow() ) )
+    with self.mutex:
+      self.stored += 1
+
+  # free the key of a request that failed (unless it wrote, or a retry took it over)
+  def _forget( self, key, claim ):
+    model = self.model
+    self.session.rollback()
+    self.session.execute( delete( model ).where( model.key == key, model.claim == claim, model.status.is_( None ) ) )
+    self.session.commit()
+
+  def _replay( self, stored, fingerprint ):
+    if stored[0] != fingerprint:
+      return _error( 422, "The Idempotency-Key was already used with a different request" )
+    with self.mutex:
+      self.replayed += 1
+    _, status, content_type, body, _ = stored
+    response = current_app.response_class( body, status = status, content_type = content_type )
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+  # delete the expired keys, at most once per PURGE_INTERVAL
+  def _purge( self ):
+    now = time.monotonic()
+    with self.mutex:
+      if now - self.purged < PURGE_INTERVAL:
+        return
+      self.purged = now
+    self.session.execute( delete( self.model ).where( self.model.created < _utcnow() - datetime.timedelta( seconds = self.ttl ) ) )
+    self.session.commit()
+
+  def _acquire( self, key ):
+    with self.mutex:
+      entry = self.running.setdefault( key, [threading.Lock(), 0] )
+      entry[1] += 1
+      return entry[0]
+
+  def _release( self, key ):
+    with self.mutex:
+      entry = self.running[key]
+      entry[1] -= 1
+      if entry[1] == 0:
+        del self.running[key]
@@ -0,0 +1,298 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Per-route request metrics in the Prometheus text format, and the opt-in request profiler
+
+Every request records, per route, its latency, the number and total time of its SQL statements
+(from the engine's cursor events), the time spent encoding JSON and the size of the JSON it
+produced (from a wrapper around the app's JSON provider).  GET /metrics renders them as
+Prometheus histograms, with the pool and cache counters as gauges.
+
+With PROFILE_ENABLED, a request carrying '?__profile=1' or an 'X-Profile: 1' header (the value
+must be PROFILE_TOKEN when one is set) is run under cProfile, or pyinstrument's sampling
+profiler with PROFILER=pyinstrument, and answered with the report instead of its response.
+'''
+
+
+import contextvars
+import hmac
+import importlib.util
+import threading
+import time
+from sqlalchemy import event
+
+
+# latency buckets in seconds, counts and sizes in bytes
+SECONDS = ( 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10 )
+COUNTS  = ( 0, 1, 2, 3, 5, 10, 20, 50, 100, 500 )
+BYTES   = ( 128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216 )
+
+# the histograms kept per route: name -> ( help, buckets )
+HISTOGRAMS = {
+  "http_request_duration_seconds": ( "Time to answer the request, streamed bodies included", SECONDS ),
+  "http_request_sql_queries": ( "SQL statements executed by the request", COUNTS ),
+  "http_request_sql_seconds": ( "Time spent executing the request's SQL statements", SECONDS ),
+  "http_request_serialization_seconds": ( "Time spent encoding the request's JSON", SECONDS ),
+  "http_response_json_bytes": ( "Size of the JSON produced by the request", BYTES ),
+}
+
+# the request being measured in this thread (or task)
+_current = contextvars.ContextVar( 'request_stats', default = None )
+
+
+# what one request spent its time on
+class RequestStats:
+  def __init__( self ) -> None:
+    self.started       = time.perf_counter()
+    self.queries       = 0
+    self.sql_seconds   = 0.0
+    self.json_seconds  = 0.0
+    self.json_bytes    = 0
+    self.route         = None
+    self.method        = None
+    self.status        = None
+    self.profiler      = None
+    # the body is streamed, so the request is recorded when the stream ends
+    self.streamed      = False
+
+
+'''
+metrics registry
+'''
+
+
+class Metrics:
+  def __init__( self ) -> None:
+    self.lock       = threading.Lock()
+    # ( name, labels ) -> [ bucket counts..., sum, count ]
+    self.histograms = {}
+    # ( name, labels ) -> value
+    self.counters   = {}
+
+  # add a value to a histogram (labels is a tuple of ( label, value ) pairs)
+  def observe( self, name, labels, value ):
+    buckets = HISTOGRAMS[name][1]
+    with self.lock:
+      series = self.histograms.get( ( name, labels ) )
+      if series is None:
+        series = self.histograms[( name, labels )] = [0] * ( len( buckets ) + 2 )
+      for index, bound in enumerate( buckets ):
+        if value <= bound:
+          series[index] += 1
+      series[-2] += value
+      series[-1] += 1
+
+  def increment( self, name, labels, amount = 1 ):
+    with self.lock:
+      self.counters[( name, labels )] = self.counters.get( ( name, labels ), 0 ) + amount
+
+  # record a finished request
+  def record( self, stats ):
+    labels = ( ( 'method', stats.method ), ( 'route', stats.route ) )
+    self.increment( 'http_requests_total', labels + ( ( 'status', str( stats.status ) ), ) )
+    self.observe( 'http_request_duration_seconds', labels, time.perf_counter() - stats.started )
+    self.observe( 'http_request_sql_queries', labels, stats.queries )
+    self.observe( 'http_request_sql_seconds', labels, stats.sql_seconds )
+    self.observe( 'http_request_serialization_seconds', labels, stats.json_seconds )
+    self.observe( 'http_response_json_bytes', labels, stats.json_bytes )
+
+  # the metrics in the Prometheus text format, with the numeric values of the 'gauges' ( { prefix: { name: value } } )
+  def render( self, gauges = None ):
+    with self.lock:
+      histograms = {key: list( series ) for key, series in self.histograms.items()}
+      counters   = dict( self.counters )
+    lines = ["# HELP http_requests_total Requests answered", "# TYPE http_requests_total counter"]
+    for ( name, labels ), value in sorted( counters.items() ):
+      lines.append( f"{name}{_labels( labels )} {value}" )
+    for name, ( help, buckets ) in HISTOGRAMS.items():
+      lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+      for ( series_name, labels ), series in sorted( histograms.items() ):
+        if series_name != name:
+          continue
+        for bound, count in zip( buckets, series ):
+          lines.append( f"{name}_bucket{_labels( labels + ( ( 'le', _number( bound ) ), ) )} {count}" )
+        lines.append( f"{name}_bucket{_labels( labels + ( ( 'le', '+Inf' ), ) )} {series[-1]}" )
+        lines.append( f"{name}_sum{_labels( labels )} {_number( series[-2] )}" )
+        lines.append( f"{name}_count{_labels( labels )} {series[-1]}" )
+    for prefix, values in ( gauges or {} ).items():
+      for key, value in sorted( values.items() ):
+        if isinstance( value, ( int, float ) ) and not isinstance( value, bool ):
+          lines += [f"# TYPE {prefix}_{key} gauge", f"{prefix}_{key} {_number( value )}"]
+    return '\n'.join( lines ) + '\n'
+
+
+def _labels( labels ):
+  escaped = ( ( name, str( value ).replace( '\\', '\\\\' ).replace( '"', '\\"' ).replace( '\n', '\\n' ) ) for name, value in labels )
+  return '{' + ','.join( f'{name}="{value}"' for name, value in escaped ) + '}'
+
+
+def _number( value ):
+  return repr( float( value ) ) if isinstance( value, float ) else str( value )
+
+
+'''
+instrumentation
+'''
+
+
+# the app's JSON provider, timing the encoding and counting the bytes produced for the current request
+class MeasuredJSON:
+  def __init__( self, provider ) -> None:
+    self.provider = provider
+
+  def dumps( self, obj, **kwargs ):
+    started = time.perf_counter()
+    data    = self.provider.dumps( obj, **kwargs )
+    self._count( started, len( data ) )
+    return data
+
+  def response( self, *args, **kwargs ):
+    started  = time.perf_counter()
+    response = self.provider.response( *args, **kwargs )
+    self._count( started, response.content_length or 0 )
+    return response
+
+  def _count( self, started, size ):
+    stats = _current.get()
+    if stats is not None:
+      stats.json_seconds += time.perf_counter() - started
+      stats.json_bytes   += size
+
+  # everything else (loads, sort_keys, ...) is the provider's
+  def __getattr__( self, name ):
+    return getattr( self.provider, name )
+
+
+# count and time the SQL statements of the engine, per request
+def instrument_engine( engine ):
+  def before( conn, cursor, statement, parameters, context, executemany ):
+    conn.info.setdefault( 'statement_started', [] ).append( time.perf_counter() )
+
+  def after( conn, cursor, statement, parameters, context, executemany ):
+    started = conn.info['statement_started'].pop()
+    stats   = _current.get()
+    if stats is not None:
+      stats.queries     += 1
+      stats.sql_seconds += time.perf_counter() - started
+
+  def failed( context ):
+    started = context.connection.info.get( 'statement_started' )
+    if started:
+      started.pop()
+
+  event.listen( engine, 'before_cursor_execute', before )
+  event.listen( engine, 'after_cursor_execute', after )
+  event.listen( engine, 'handle_error', failed )
+
+
+# True when the request asks for a profile and the settings allow it
+def wants_profile( request, config ):
+  if not config['PROFILE_ENABLED']:
+    return False
+  value = request.args.get( '__profile' ) or request.headers.get( 'X-Profile' )
+  if not value:
+    return False
+  token = config['PROFILE_TOKEN']
+  return hmac.compare_digest( value, token ) if token else value not in ( '0', 'false' )
+
+
+# start the profiler for the current request (the profilers are imported on the first profile, not at startup)
+def start_profiler( config ):
+  if config['PROFILER'] == 'pyinstrument':
+    import pyinstrument
+    profiler = pyinstrument.Profiler()
+    profiler.start()
+  else:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+  return profiler
+
+
+# stop the profiler and return its report
+def profile_report( profiler, config ):
+  if config['PROFILER'] != 'pyinstrument':
+    import io
+    import pstats
+    profiler.disable()
+    output = io.StringIO()
+    pstats.Stats( profiler, stream = output ).sort_stats( 'cumulative' ).print_stats( config['PROFILE_LIMIT'] )
+    return output.getvalue()
+  profiler.stop()
+  return profiler.output_text( unicode = True )
+
+
+# measure every request of the app ('request' is the framework's request proxy; the
+# profiler is only available to the sync app, where a request runs in its own thread)
+def init_metrics( app, engine, request, asynchronous = False ):
+  if app.config['PROFILER'] == 'pyinstrument' and importlib.util.find_spec( 'pyinstrument' ) is None:
+    raise RuntimeError( "PROFILER is 'pyinstrument' but pyinstrument is not installed (pip install pyinstrument)" )
+  metrics = app.extensions['metrics'] = Metrics()
+  app.json = MeasuredJSON( app.json )
+  instrument_engine( engine )
+
+  def start():
+    stats = RequestStats()
+    stats.method = request.method
+    stats.route  = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    _current.set( stats )
+    if not asynchronous and wants_profile( request, app.config ):
+      stats.profiler = start_profiler( app.config )
+
+  def finish( response ):
+    stats = _current.get()
+    if stats is None:
+      return response
+    stats.status = response.status_code
+    if stats.profiler is not None:
+      # run the streamed bodies too, so they're part of the profile
+      response.get_data()
+      report = profile_report( stats.profiler, app.config )
+      stats.profiler = None
+      response = app.response_class( report, mimetype = 'text/plain' )
+    elif not asynchronous and response.is_streamed:
+      # the teardown runs before the body is sent, the stream's statements and JSON count too
+      stats.streamed = True
+      response.response = recorded( response.response, stats )
+    return response
+
+  def recorded( chunks, stats ):
+    try:
+      yield from chunks
+    finally:
+      if hasattr( chunks, 'close' ):
+        chunks.close()
+      done( stats )
+
+  def end( exception = None ):
+    stats = _current.get()
+    if stats is not None and not stats.streamed:
+      done( stats )
+
+  def done( stats ):
+    # (a stream may be closed late, e.g. by the garbage collector, while another request is current)
+    if _current.get() is stats:
+      _current.set( None )
+    if stats.profiler is not None:
+      profile_report( stats.profiler, app.config )
+    if stats.status is None:
+      stats.status = 500
+    metrics.record( stats )
+
+  if asynchronous:
+    async def start_async():
+      start()
+
+    async def finish_async( response ):
+      return finish( response )
+
+    async def end_async( exception = None ):
+      end( exception )
+
+    app.before_request( start_async )
+    app.after_request( finish_async )
+    app.teardown_request( end_async )
+  else:
+    app.before_request( start )
+    app.after_request( finish )
+    app.teardown_request( end )
+  return metrics
@@ -0,0 +1,50 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Multi-get of the entities by a list of ids, in one query instead of a request per entity
+
+'GET /Customer?ids=3,1,2' and 'POST /Customer/batch-get' (a body like {"ids": [3, 1, 2]}) return
+the entities in the order of the ids and list the ids that don't exist.  The entities found in the
+cache of the single entity routes are served from it; the others are read with one
+'WHERE id IN (...)' query per MULTI_GET_CHUNK_SIZE ids (the databases bound the parameters of a
+statement), as column tuples serialized like the lists, and cached for the next request.
+'''
+
+
+from sqlalchemy import select
+
+
+# read the ids of a multi-get: a comma separated string, a JSON array of integers or a batch-get body
+# like {"ids": [...]}, without the duplicates, in their order (raises ValueError with the message)
+def parse_ids( value, max_ids ):
+  if isinstance( value, dict ):
+    value = value.get( 'ids' )
+  if isinstance( value, str ):
+    value = [part.strip() for part in value.split( ',' ) if part.strip()]
+  if not isinstance( value, list ) or not all( _is_id( id ) for id in value ):
+    raise ValueError( "The ids must be a comma separated list or a JSON array of integers" )
+  ids = list( dict.fromkeys( int( id ) for id in value ) )
+  if not ids or len( ids ) > max_ids:
+    raise ValueError( f"Between 1 and {max_ids} ids can be requested at once" )
+  return ids
+
+
+# an integer, or the digits of one ( true and 1.5 aren't ids )
+def _is_id( value ):
+  if isinstance( value, str ):
+    return value.isdigit()
+  return isinstance( value, int ) and not isinstance( value, bool )
+
+
+# the serialized rows with the ids, read 'chunk_size' ids per query: {id: row}
+def load_many( session, rows, key_column, ids, chunk_size ):
+  position = rows.fields.index( key_column.key )
+  found = {}
+  for start in range( 0, len( ids ), chunk_size ):
+    for row in session.execute( select( *rows.columns ).where( key_column.in_( ids[start:start + chunk_size] ) ) ):
+      found[row[position]] = rows.dump( row )
+  return found
+
+
+# the found rows in the order of the ids, and the ids that weren't found
+def in_order( ids, found ):
+  return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
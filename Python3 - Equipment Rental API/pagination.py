@@ -0,0 +1,161 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Keyset pagination and NDJSON streaming for the list routes
+'''
+
+
+import base64
+import json
+from flask import Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy import and_, or_
+
+
+# number of rows returned in a page when 'limit' is not given
+DEFAULT_PAGE_SIZE = 100
+# largest page a client can ask for
+MAX_PAGE_SIZE     = 1000
+# number of rows fetched from the database per round trip while streaming
+STREAM_CHUNK_SIZE = 1000
+
+
+'''
+request parsing
+'''
+
+
+# read an optional non-negative integer from the query string arguments (raises ValueError with its name)
+def _int_argument( args, name, default = None ):
+  value = args.get( name )
+  if value is None or value == '':
+    return default
+  try:
+    number = int( value )
+  except ValueError:
+    raise ValueError( name )
+  if number < 0:
+    raise ValueError( name )
+  return number
+
+
+# read the ( sort value, key ) of a sorted list's cursor (raises ValueError( 'cursor' ))
+def _cursor_argument( args ):
+  value = args.get( 'after' )
+  if value is None or value == '':
+    return None
+  try:
+    sort_value, key = json.loads( base64.urlsafe_b64decode( value + '=' * ( -len( value ) % 4 ) ) )
+  except ( ValueError, TypeError ):
+    raise ValueError( 'cursor' )
+  return sort_value, key
+
+
+# read the 'limit' (bounded to MAX_PAGE_SIZE) and 'after' arguments of a page request ('after' is a cursor for a sorted list)
+def page_arguments( args, order = None ):
+  limit = _int_argument( args, 'limit', DEFAULT_PAGE_SIZE )
+  after = _int_argument( args, 'after' ) if order is None else _cursor_argument( args )
+  return min( max( limit, 1 ), MAX_PAGE_SIZE ), after
+
+
+# message for a bad query string argument
+def argument_message( name ):
+  if name == 'cursor':
+    return "Query parameter 'after' must be the next_cursor of a previous page with the same sort"
+  return f"Query parameter '{name}' must be a non-negative integer"
+
+
+# build the standard 400 response for a bad query string argument
+def _bad_argument( name ):
+  response = jsonify( {"message": argument_message( name )} )
+  response.status_code = 400
+  return response
+
+
+# True when the client asked for a newline delimited JSON stream
+def wants_stream( current = request ):
+  return current.args.get( 'format' ) == 'ndjson' or current.accept_mimetypes.best == 'application/x-ndjson'
+
+
+# True when the client asked for a page instead of the full list
+def wants_page( current = request ):
+  return 'limit' in current.args or 'after' in current.args
+
+
+'''
+ordering (by the key column, or by a sort column and then the key column)
+'''
+
+
+# ORDER BY clauses of a list, 'order' is the ( column, descending ) to sort on first, or None
+def ordering( key_column, order = None ):
+  if order is None:
+    return ( key_column, )
+  column, descending = order
+  # the key in the same direction, so an index on the sort column (which ends with the primary key) serves both
+  if descending:
+    return ( column.desc(), key_column.desc() )
+  return ( column, key_column )
+
+
+# condition selecting the rows that come after the cursor in that order
+def seek( key_column, order, after ):
+  if order is None:
+    return key_column > after
+  column, descending = order
+  value, key = after
+  if descending:
+    return or_( column < value, and_( column == value, key_column < key ) )
+  return or_( column > value, and_( column == value, key_column > key ) )
+
+
+# the cursor of the page that follows the row
+def cursor_of( row, key_column, order = None ):
+  key = getattr( row, key_column.key )
+  if order is None:
+    return key
+  return base64.urlsafe_b64encode( json.dumps( [getattr( row, order[0].key ), key] ).encode() ).decode().rstrip( '=' )
+
+
+'''
+responses
+'''
+
+
+# stream every row of the query as one JSON document per line, reading the rows in chunks
+def stream_rows( query, key_column, schema, order = None ):
+  def generate():
+    dumps = current_app.json.dumps
+    try:
+      for row in query.order_by( *ordering( key_column, order ) ).yield_per( STREAM_CHUNK_SIZE ):
+        yield dumps( schema.dump( row, many = False ) ) + '\n'
+    finally:
+      # the request's teardown may already have removed the session the query was built with
+      # (Flask 3.1 pops the contexts before the body is sent), so give its connection back here
+      query.session.close()
+  # keep the app context alive while the generator runs so the session can keep reading
+  return Response( stream_with_context( generate() ), mimetype = 'application/x-ndjson' )
+
+
+# return one page of the query, ordered by its key column (or 'order'), starting after the 'after' cursor
+def page_rows( query, key_column, schema, message, order = None ):
+  try:
+    limit, after = page_arguments( request.args, order )
+  except ValueError as error:
+    return _bad_argument( str( error ) )
+  # seek past the cursor instead of using OFFSET so every page costs the same
+  if after is not None:
+    query = query.filter( seek( key_column, order, after ) )
+  # fetch one extra row to know if there is another page
+  rows = query.order_by( *ordering( key_column, order ) ).limit( limit + 1 ).all()
+  has_more = len( rows ) > limit
+  rows = rows[:limit]
+  next_cursor = cursor_of( rows[-1], key_column, order ) if has_more else None
+  return jsonify( {"message": message, "data": schema.dump( rows, many = True ), "next_cursor": next_cursor} )
+
+
+# pick the list response the client asked for: a stream, a page or (by default) the whole table
+def list_response( query, key_column, schema, message, order = None ):
+  if wants_stream():
+    return stream_rows( query, key_column, schema, order )
+  if wants_page():
+    return page_rows( query, key_column, schema, message, order )
+  return jsonify( {"message": message, "data": schema.dump( query.order_by( *ordering( key_column, order ) ).all(), many = True )} )
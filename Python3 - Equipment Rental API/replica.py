@@ -0,0 +1,216 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  In-process replica of the small, read-mostly tables (equipment and inventory), refreshed from the change log
+
+With REPLICA_ENABLED, the plain lists, the single entity GETs and the multi-gets of the equipment
+and the inventory are answered from a snapshot of both tables held in the process, without a
+query.  A snapshot keeps each row as a tuple of its serialized values, in key order, with a
+key -> offset index, and it's never modified: a refresh builds the next snapshot and swaps it in
+with one assignment, so a request reads one consistent state of both tables.
+
+The snapshot is loaded on first use, then refreshed incrementally from the change log (the
+entries after the last one applied, with the current state of their rows), so it follows every
+write: the routes', the bulk imports', the bookings' and the other processes'.  A request
+refreshes it first when a local commit logged changes since (so a client reads its own writes),
+or when it's older than REPLICA_REFRESH_INTERVAL seconds.  A snapshot that wasn't refreshed for
+REPLICA_MAX_STALENESS seconds (another request is still refreshing it) isn't used: the request
+reads the database.
+'''
+
+
+import contextlib
+import datetime
+import threading
+import time
+from sqlalchemy import select
+
+
+# entries of the change log read per query while catching up
+CATCH_UP_BATCH = 1000
+
+
+# current time in UTC, without a timezone (as the DATETIME columns store it)
+def _utcnow():
+  return datetime.datetime.now( datetime.timezone.utc ).replace( tzinfo = None )
+
+
+'''
+snapshots
+'''
+
+
+# the rows of one table: tuples of the serialized values in key order, and the offset of each key
+class TableSnapshot:
+  __slots__ = ( 'fields', 'position', 'records', 'index' )
+
+  def __init__( self, fields, position, records, index = None ) -> None:
+    self.fields   = fields
+    # position of the key in the records
+    self.position = position
+    self.records  = tuple( records )
+    self.index    = index if index is not None else {record[position]: offset for offset, record in enumerate( self.records )}
+
+  def __len__( self ):
+    return len( self.records )
+
+  # the row of a key (an int or its digits) as a dict, None when there's none
+  def get( self, key ):
+    try:
+      offset = self.index.get( int( key ) )
+    except ( TypeError, ValueError ):
+      return None
+    return None if offset is None else dict( zip( self.fields, self.records[offset] ) )
+
+  # the rows of the keys found, {key: row}, like the loaders of the multi-gets
+  def find( self, keys ):
+    fields, records = self.fields, self.records
+    return {key: dict( zip( fields, records[self.index[key]] ) ) for key in keys if key in self.index}
+
+  # every row as a dict, in key order
+  def rows( self ):
+    fields = self.fields
+    return [dict( zip( fields, record ) ) for record in self.records]
+
+  # the next snapshot of the table, with the changes ({key: serialized row, or None once deleted})
+  def apply( self, changes ):
+    fields = self.fields
+    if all( row is not None and key in self.index for key, row in changes.items() ):
+      # only updates: the rows keep their offsets
+      records = list( self.records )
+      for key, row in changes.items():
+        records[self.index[key]] = tuple( row[field] for field in fields )
+      return TableSnapshot( fields, self.position, records, self.index )
+    rows = {record[self.position]: record for record in self.records}
+    for key, row in changes.items():
+      if row is None:
+        rows.pop( key, None )
+      else:
+        rows[key] = tuple( row[field] for field in fields )
+    return TableSnapshot( fields, self.position, [rows[key] for key in sorted( rows )] )
+
+
+# the state of the replicated tables, up to an entry of the change log
+class Snapshot:
+  __slots__ = ( 'tables', 'seq', 'generation', 'refreshed' )
+
+  def __init__( self, tables, seq, generation, refreshed ) -> None:
+    # table name -> TableSnapshot
+    self.tables     = tables
+    # the last entry of the change log applied
+    self.seq        = seq
+    # the local commits (the change feed's generation) seen, and when it was refreshed (monotonic)
+    self.generation = generation
+    self.refreshed  = refreshed
+
+
+'''
+the replica used by the routes
+'''
+
+
+class Replica:
+  def __init__( self, changes, tables, session, pinned = contextlib.nullcontext ) -> None:
+    # the change feed the snapshots are refreshed from (it serializes the changed rows)
+    self.changes = changes
+    # names of the replicated tables, among the feed's sources
+    self.tables  = tuple( tables )
+    # the (scoped) session the tables and the log are read with
+    self.session = session
+    # context the tables and the log are read in (e.g. on the primary, to see the local writes)
+    self.pinned  = pinned
+    self.enabled          = False
+    self.refresh_interval = 1.0
+    self.max_staleness    = 5.0
+    self.lock    = threading.Lock()
+    self.current = None
+    self.loads     = 0
+    self.refreshes = 0
+    self.applied   = 0
+    self.served    = 0
+    self.fallbacks = 0
+
+  # the settings of the app (REPLICA_*); the snapshot is loaded again on first use
+  def init_app( self, app ):
+    self.enabled          = app.config['REPLICA_ENABLED']
+    self.refresh_interval = app.config['REPLICA_REFRESH_INTERVAL']
+    self.max_staleness    = app.config['REPLICA_MAX_STALENESS']
+    self.current          = None
+
+  # the snapshot of a table for this request, None when the request must read the database
+  # (the replica is off, the table isn't replicated, or the snapshot is too stale)
+  def table( self, name ):
+    if not self.enabled or name not in self.tables:
+      return None
+    snapshot = self.snapshot()
+    if snapshot is None:
+      return None
+    return snapshot.tables[name]
+
+  # the current snapshot, refreshed first when it's due, None when it's too stale to use
+  def snapshot( self ):
+    current = self.current
+    written = current is None or current.generation != self.changes.generation
+    if written or time.monotonic() - current.refreshed >= self.refresh_interval:
+      # after a local write the request waits for the refresh, otherwise one request refreshes
+      # it while the others use the current snapshot
+      if self.lock.acquire( blocking = written ):
+        try:
+          with self.pinned():
+            current = self._refresh()
+        finally:
+          self.lock.release()
+    if current is None or time.monotonic() - current.refreshed > self.max_staleness:
+      self.fallbacks += 1
+      return None
+    self.served += 1
+    return current
+
+  def stats( self ):
+    current = self.current
+    stats = {"enabled": self.enabled, "loads": self.loads, "refreshes": self.refreshes, "applied": self.applied, "served": self.served, "fallbacks": self.fallbacks}
+    if current is not None:
+      stats.update( seq = current.seq, age = round( time.monotonic() - current.refreshed, 3 ), **{f"{name}_rows": len( table ) for name, table in current.tables.items()} )
+    return stats
+
+  def _refresh( self ):
+    current    = self.current
+    generation = self.changes.generation
+    started    = time.monotonic()
+    # another request refreshed it while this one waited
+    if current is not None and current.generation == generation and started - current.refreshed < self.refresh_interval:
+      return current
+    if current is None:
+      current = self._load( generation, started )
+    self.current = self._catch_up( current, generation, started )
+    return self.current
+
+  # read the tables; the entries of the last CHANGES_GAP_WAIT seconds are applied again after it,
+  # as a transaction still committing may log entries before the newest one
+  def _load( self, generation, started ):
+    model  = self.changes.model
+    cutoff = _utcnow() - datetime.timedelta( seconds = self.changes.gap_wait )
+    seq    = self.session.execute( select( model.seq ).where( model.changed < cutoff ).order_by( model.seq.desc() ).limit( 1 ) ).scalar() or 0
+    tables = {}
+    for name in self.tables:
+      key, serializer = self.changes.sources[name]
+      position = serializer.fields.index( key )
+      rows = self.session.execute( select( *serializer.columns ).order_by( serializer.columns[position] ) )
+      tables[name] = TableSnapshot( serializer.fields, position, [tuple( serializer.dump_row( row ).values() ) for row in rows] )
+    self.loads += 1
+    return Snapshot( tables, seq, generation, started )
+
+  # the next snapshot, with the entries of the change log after the current one
+  def _catch_up( self, current, generation, started ):
+    changes = {name: {} for name in self.tables}
+    seq = current.seq
+    while True:
+      entries, last = self.changes.read( seq, CATCH_UP_BATCH, self.tables )
+      for entry in entries:
+        changes[entry['table']][entry['id']] = entry['data']
+      self.applied += len( entries )
+      if last == seq:
+        break
+      seq = last
+    self.refreshes += 1
+    tables = {name: table.apply( changes[name] ) if changes[name] else table for name, table in current.tables.items()}
+    return Snapshot( tables, seq, generation, started )
@@ -0,0 +1,161 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Rental returns: a background scheduler giving the units of the rentals past their end back to the inventory
+
+A rental holds its units in Inventory.rented from its booking until it's returned.  With
+RETURNS_ENABLED, each process checks every RETURNS_INTERVAL seconds for the rentals due back
+(not returned yet and ending today or before, in UTC) and returns them RETURNS_BATCH_SIZE at a
+time, each batch in one transaction:
+
+- the due rentals are read from the index on ( returned, end ), so a run costs the rentals due,
+  not a scan of every rental ever booked;
+- they're marked returned with one conditional UPDATE (only the ones still not returned);
+- their units are given back with one UPDATE statement run for the inventory rows of their
+  equipment (executemany), each by the sum of its returned quantities.
+
+A batch is committed whole or not at all, so a run stopped halfway (or a crashed process) leaves
+the rest due for the next one, and a rental is never returned twice: when another process (or a
+route updating or deleting the rental) got to some of the batch first, the batch is rolled back
+and read again.  'flask --app main return-rentals' runs the returns once, e.g. from cron.
+'''
+
+
+import datetime
+import threading
+import time
+from sqlalchemy import bindparam, case, func, select, update
+from booking import today
+from changefeed import changed
+
+
+# current time in UTC, without a timezone (as the DATETIME columns store it)
+def _utcnow():
+  return datetime.datetime.now( datetime.timezone.utc ).replace( tzinfo = None )
+
+
+class ReturnScheduler:
+  def __init__( self, db, rental, inventory, on_returned = None, interval = 60.0, batch_size = 500 ) -> None:
+    # the app the scheduler runs in, set by init_app()
+    self.app        = None
+    self.db         = db
+    # models of the rentals ( id, equipment_id, quantity, end, returned ) and of the inventory ( equipment_id, rented )
+    self.rental     = rental
+    self.inventory  = inventory
+    # on_returned( rental ids, equipment ids ) runs after each committed batch (to drop the cached copies)
+    self.on_returned = on_returned
+    self.enabled    = False
+    self.interval   = interval
+    self.batch_size = batch_size
+    self.lock       = threading.Lock()
+    self.thread     = None
+    # run statistics
+    self.runs       = 0
+    self.batches    = 0
+    self.returned   = 0
+    self.units      = 0
+    self.conflicts  = 0
+    self.errors     = 0
+    self.last_run   = None
+    self.last_error = None
+
+  # run the scheduler in the app, with its RETURNS_* settings (from the first request)
+  def init_app( self, app ):
+    self.app        = app
+    self.enabled    = app.config['RETURNS_ENABLED']
+    self.interval   = app.config['RETURNS_INTERVAL']
+    self.batch_size = app.config['RETURNS_BATCH_SIZE']
+    if self.enabled:
+      app.before_request( self._start )
+
+  # in a forked process: the scheduler thread stayed in the parent
+  def after_fork( self ):
+    self.lock   = threading.Lock()
+    self.thread = None
+
+  # return the rentals due back on 'day' (today by default), a batch at a time; returns the number returned
+  def run( self, day = None ):
+    day = day or today()
+    returned = 0
+    with self.app.app_context():
+      session = self.db.session
+      while True:
+        count = self._return_batch( session, day )
+        if count is None:
+          # another process returned (or a route changed) some of the batch: read it again
+          with self.lock:
+            self.conflicts += 1
+          continue
+        returned += count
+        if count < self.batch_size:
+          break
+    with self.lock:
+      self.runs    += 1
+      self.last_run = _utcnow()
+    return returned
+
+  def stats( self ):
+    with self.lock:
+      return {
+        "enabled": self.enabled,
+        "interval": self.interval,
+        "batch_size": self.batch_size,
+        "runs": self.runs,
+        "batches": self.batches,
+        "returned": self.returned,
+        "units_released": self.units,
+        "conflicts": self.conflicts,
+        "errors": self.errors,
+        "last_run": None if self.last_run is None else self.last_run.isoformat(),
+        "last_error": self.last_error,
+      }
+
+  # return one batch in one transaction: the number of rentals returned, None when the batch must be read again
+  def _return_batch( self, session, day ):
+    rental, inventory = self.rental, self.inventory
+    due = rental.returned.is_( None ), rental.end <= day
+    ids = list( session.scalars( select( rental.id ).where( *due ).order_by( rental.end, rental.id ).limit( self.batch_size ) ) )
+    if not ids:
+      session.rollback()
+      return 0
+    marked = session.execute( update( rental ).where( rental.id.in_( ids ), *due ).values( returned = _utcnow() ).execution_options( synchronize_session = False ) ).rowcount
+    if marked != len( ids ):
+      session.rollback()
+      return None
+    # the units of each equipment, read after the UPDATE locked the rentals, given back with one
+    # UPDATE statement run for all the equipment at once (executemany, never going below zero)
+    totals = dict( session.execute( select( rental.equipment_id, func.sum( rental.quantity ) ).where( rental.id.in_( ids ) ).group_by( rental.equipment_id ) ).all() )
+    table = inventory.__table__
+    released = bindparam( 'released' )
+    session.execute(
+      update( table ).where( table.c.equipment_id == bindparam( 'equipment' ) ).values( rented = case( ( table.c.rented > released, table.c.rented - released ), else_ = 0 ) ),
+      [{"equipment": equipment_id, "released": quantity} for equipment_id, quantity in totals.items()]
+    )
+    changed( session, rental.__table__.name, 'update', *ids )
+    changed( session, inventory.__table__.name, 'update', *totals )
+    session.commit()
+    with self.lock:
+      self.batches  += 1
+      self.returned += len( ids )
+      self.units    += sum( totals.values() )
+    if self.on_returned is not None:
+      self.on_returned( ids, list( totals ) )
+    return len( ids )
+
+  # start the scheduler with the first request (so a forked worker starts its own)
+  def _start( self ):
+    if self.thread is not None:
+      return
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread( target = self._run, name = 'rental-returns', daemon = True )
+        self.thread.start()
+
+  def _run( self ):
+    while True:
+      try:
+        self.run()
+      except Exception as error:
+        with self.lock:
+          self.errors    += 1
+          self.last_error = str( error )
+      time.sleep( self.interval )
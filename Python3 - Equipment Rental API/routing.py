@@ -0,0 +1,235 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Read/write splitting: the GET requests read from replicas of the database, the writes go to the primary
+
+With DB_REPLICA_URIS set (comma separated), the SELECTs of the GET requests (and the exports)
+are sent to one of the replicas, and everything else to the primary: the writes, and the reads
+of the other requests, which write what they read.  A replica is picked per request, among the
+healthy ones close enough to the primary:
+
+- health and lag: every DB_REPLICA_CHECK_INTERVAL seconds (checked by a request, one at a time)
+  the last change log entry of a replica is looked up in the primary's log.  The replica has
+  every write committed before the first entry it misses, and its lag is the age of that entry.
+  A replica that fails its check or loses a connection, or lags by more than DB_REPLICA_MAX_LAG
+  seconds, isn't used until a later check finds it back.
+- read your writes: a client that wrote (a successful request other than GET, HEAD or OPTIONS)
+  reads from the primary until a replica has caught up with its write.  The time of its last
+  write is kept in the process (per client, told apart like by the admission control) and sent
+  back in a cookie, so the other processes know it too.
+
+When no replica qualifies, the request reads from the primary.  What a request read from a
+replica is kept for the next ones only when the replica had every write to its tables (as of the
+table versions): the entity cache isn't filled from the other reads, and their responses don't
+carry the ETag and Last-Modified of the primary's state.  The indexes kept by the process for
+every request (table versions, availability, search, in-process replica) load within on_primary().
+Only the sync app is routed.
+'''
+
+
+import contextlib
+import contextvars
+import datetime
+import itertools
+import threading
+import time
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+from admission import client_of
+from cache import LRUCache, MISSING
+
+
+# the replica the reads of the current request go to, ( engine, time it had caught up to ), None for the primary
+_read_from = contextvars.ContextVar( 'read_from', default = None )
+
+# the cookie holding the time of the client's last write
+WRITE_COOKIE = 'last_write'
+
+
+# current time in UTC, without a timezone (as the DATETIME columns store it)
+def _utcnow():
+  return datetime.datetime.now( datetime.timezone.utc ).replace( tzinfo = None )
+
+
+# the replica engine of the current request, None when it reads from the primary
+def read_engine():
+  current = _read_from.get()
+  return None if current is None else current[0]
+
+
+# True when the reads of the current request see every write committed before 'modified' (UTC)
+def reads_current( modified ):
+  current = _read_from.get()
+  return current is None or modified is None or current[1] > modified
+
+
+# run the reads of a block on the primary (e.g. a refresh that must see the local writes)
+@contextlib.contextmanager
+def on_primary():
+  token = _read_from.set( None )
+  try:
+    yield
+  finally:
+    _read_from.reset( token )
+
+
+# session sending the plain SELECTs to the request's replica, when it has one and nothing is pending
+class RoutingSession( Session ):
+  def get_bind( self, mapper = None, clause = None, bind = None, **kwargs ):
+    engine = read_engine()
+    if engine is not None and bind is None and isinstance( clause, Select ) and clause._for_update_arg is None and not ( self.new or self.dirty or self.deleted ):
+      return engine
+    return super().get_bind( mapper, clause = clause, bind = bind, **kwargs )
+
+
+'''
+replicas
+'''
+
+
+class ReplicaEngine:
+  def __init__( self, name, engine ) -> None:
+    self.name      = name
+    self.engine    = engine
+    self.lock      = threading.Lock()
+    self.healthy   = False
+    # the replica has every write committed before this time (UTC), as of the last check
+    self.caught_up = None
+    self.lag       = None
+    self.checked   = None
+    self.checks    = 0
+    self.failures  = 0
+    self.reads     = 0
+
+  def stats( self ):
+    prefix = self.name
+    return {f"{prefix}_healthy": self.healthy, f"{prefix}_lag": None if self.lag is None else round( self.lag, 3 ), f"{prefix}_caught_up": None if self.caught_up is None else self.caught_up.isoformat(), f"{prefix}_checks": self.checks, f"{prefix}_failures": self.failures, f"{prefix}_reads": self.reads}
+
+
+class ReadRouter:
+  def __init__( self, log_model, primary, replicas, max_lag = 5.0, check_interval = 2.0 ) -> None:
+    # model of the change log ( seq, changed, ... ) the replicas' positions are read from
+    self.model    = log_model
+    self.primary  = primary
+    # name -> engine of the replicas
+    self.replicas = [ReplicaEngine( name, engine ) for name, engine in replicas.items()]
+    self.max_lag  = max_lag
+    self.check_interval = check_interval
+    # client -> time of its last write; a write older than this is in every replica that's used
+    self.writes   = LRUCache( 100000, max_lag + check_interval )
+    self.turn     = itertools.count()
+    self.primary_reads = 0
+    for replica in self.replicas:
+      event.listen( replica.engine, 'handle_error', self._connection_error( replica ) )
+
+  # the replica for the reads of a client whose last write was at 'written' (UTC, or None), as
+  # ( engine, time it had caught up to ), None for the primary
+  def choose( self, written = None ):
+    candidates = []
+    for replica in self.replicas:
+      self._refresh( replica )
+      if replica.healthy and replica.lag <= self.max_lag and ( written is None or replica.caught_up > written ):
+        candidates.append( replica )
+    if not candidates:
+      self.primary_reads += 1
+      return None
+    # in turn among the ones that qualify
+    replica = candidates[next( self.turn ) % len( candidates )]
+    replica.reads += 1
+    return replica.engine, replica.caught_up
+
+  # remember a client's write, and the time of it to send back in the cookie
+  def wrote( self, client ):
+    now = _utcnow()
+    self.writes.set( client, now )
+    return now
+
+  # the time of a client's last write, from this process or from the cookie (None when it's too old to matter)
+  def written( self, client, cookie = None ):
+    times = []
+    known = self.writes.get( client )
+    if known is not MISSING:
+      times.append( known )
+    if cookie:
+      try:
+        times.append( datetime.datetime.fromisoformat( cookie ) )
+      except ValueError:
+        pass
+    return max( times ) if times else None
+
+  def stats( self ):
+    stats = {"replicas": len( self.replicas ), "primary_reads": self.primary_reads, "max_lag": self.max_lag}
+    for replica in self.replicas:
+      stats.update( replica.stats() )
+    return stats
+
+  # check the replica when it's due (the first check is waited for, the later ones run in one request)
+  def _refresh( self, replica ):
+    checked = replica.checked
+    if checked is not None and time.monotonic() - checked < self.check_interval:
+      return
+    if not replica.lock.acquire( blocking = checked is None ):
+      return
+    try:
+      if replica.checked == checked:
+        self._check( replica )
+    finally:
+      replica.lock.release()
+
+  def _check( self, replica ):
+    model = self.model
+    started = _utcnow()
+    replica.checks += 1
+    try:
+      with replica.engine.connect() as connection:
+        seq = connection.execute( select( func.max( model.seq ) ) ).scalar() or 0
+      with self.primary.connect() as connection:
+        missing = connection.execute( select( model.changed ).where( model.seq > seq ).order_by( model.seq ).limit( 1 ) ).scalar()
+    except SQLAlchemyError:
+      replica.healthy = False
+      replica.failures += 1
+    else:
+      replica.caught_up = missing if missing is not None else started
+      replica.lag = max( 0.0, ( started - replica.caught_up ).total_seconds() )
+      replica.healthy = True
+    replica.checked = time.monotonic()
+
+  # a lost connection takes the replica out until its next check
+  def _connection_error( self, replica ):
+    def handle( context ):
+      if context.is_disconnect:
+        replica.healthy = False
+        replica.failures += 1
+    return handle
+
+
+# route the reads of the (sync) app's GET requests to the replicas (name -> engine) with the DB_REPLICA_* settings
+def init_routing( app, request, primary, replicas, log_model ):
+  client = lambda current: client_of( current, app.config['ADMISSION_CLIENT_HEADER'] )
+  router = app.extensions['routing'] = ReadRouter( log_model, primary, replicas, app.config['DB_REPLICA_MAX_LAG'], app.config['DB_REPLICA_CHECK_INTERVAL'] )
+  if not replicas:
+    return router
+
+  def start():
+    if request.method in ( 'GET', 'HEAD' ):
+      _read_from.set( router.choose( router.written( client( request ), request.cookies.get( WRITE_COOKIE ) ) ) )
+
+  def finish( response ):
+    # the validators of the primary's state don't describe a body read from a replica behind it
+    # (Last-Modified is in whole seconds)
+    if response.last_modified is not None and not reads_current( response.last_modified.replace( tzinfo = None ) + datetime.timedelta( seconds = 1 ) ):
+      del response.headers['ETag']
+      del response.headers['Last-Modified']
+    if request.method not in ( 'GET', 'HEAD', 'OPTIONS' ) and response.status_code < 400:
+      written = router.wrote( client( request ) )
+      response.set_cookie( WRITE_COOKIE, written.isoformat(), max_age = int( router.max_lag + router.check_interval ) + 1, httponly = True, samesite = 'Lax' )
+    return response
+
+  def end( exception = None ):
+    _read_from.set( None )
+
+  app.before_request( start )
+  app.after_request( finish )
+  app.teardown_request( end )
+  return router
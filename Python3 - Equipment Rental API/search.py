@@ -0,0 +1,127 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  In-process inverted index for the prefix search of the equipment catalogue
+
+The index maps every lowercase word of the indexed texts to the ids containing it, and keeps
+the words sorted so all the words starting with a prefix are found with a binary search.  A
+search returns the ids containing a word starting with each of the query's words.  The write
+routes keep the index in step (add/remove), and it's rebuilt from the database after a bulk
+write (forget), after max_age seconds, or once the table's version moves past the one it was
+built at, to pick up the writes made by other processes.
+'''
+
+
+import bisect
+import re
+import threading
+import time
+
+
+# words of a text (letters and digits), lowercase
+def words( text ):
+  return re.findall( r'\w+', ( text or '' ).lower() )
+
+
+class SearchIndex:
+  def __init__( self, loader, max_age = 60 ) -> None:
+    # loader() returns the ( id, text, ... ) of every document
+    self.loader   = loader
+    self.max_age  = max_age
+    # table_version() returns the version of the indexed table: an index loaded at an older version
+    # is rebuilt, as another process may have written since
+    self.table_version = lambda: 0
+    self.lock     = threading.Lock()
+    self.postings = {}
+    self.terms    = []
+    self.documents = {}
+    self.loaded   = None
+    self.loaded_version = 0
+    # number of writes seen, to detect the ones racing with a load
+    self.version  = 0
+
+  # ids of the documents with a word starting with each word of the query, in ascending order
+  def search( self, query, loader = None ):
+    self._refresh( loader or self.loader )
+    prefixes = set( words( query ) )
+    if not prefixes:
+      return []
+    with self.lock:
+      matches = None
+      # the rarest prefixes first, so the intersection shrinks quickly
+      for ids in sorted( ( self._matching( prefix ) for prefix in prefixes ), key = len ):
+        matches = ids if matches is None else matches & ids
+        if not matches:
+          return []
+    return sorted( matches )
+
+  # index (or reindex) a committed document
+  def add( self, id, *texts ):
+    with self.lock:
+      self.version += 1
+      self._remove( id )
+      self._add( id, texts )
+
+  # drop a committed deletion from the index
+  def remove( self, id ):
+    with self.lock:
+      self.version += 1
+      self._remove( id )
+
+  # rebuild the index on the next search, after writes that weren't recorded one by one
+  def forget( self ):
+    with self.lock:
+      self.version += 1
+      self.loaded = None
+
+  # words and number of documents indexed
+  def stats( self ):
+    with self.lock:
+      return {"documents": len( self.documents ), "words": len( self.terms )}
+
+  def _matching( self, prefix ):
+    ids      = set()
+    position = bisect.bisect_left( self.terms, prefix )
+    while position < len( self.terms ) and self.terms[position].startswith( prefix ):
+      ids |= self.postings[self.terms[position]]
+      position += 1
+    return ids
+
+  # index a document ('ordered' keeps the words sorted, a rebuild sorts them once at the end instead)
+  def _add( self, id, texts, ordered = True ):
+    terms = set()
+    for text in texts:
+      terms.update( words( text ) )
+    self.documents[id] = terms
+    for term in terms:
+      ids = self.postings.get( term )
+      if ids is None:
+        ids = self.postings[term] = set()
+        if ordered:
+          bisect.insort( self.terms, term )
+        else:
+          self.terms.append( term )
+      ids.add( id )
+
+  def _remove( self, id ):
+    for term in self.documents.pop( id, () ):
+      ids = self.postings[term]
+      ids.discard( id )
+      if not ids:
+        del self.postings[term]
+        del self.terms[bisect.bisect_left( self.terms, term )]
+
+  def _refresh( self, loader ):
+    table_version = self.table_version()
+    with self.lock:
+      if self.loaded is not None and time.monotonic() - self.loaded < self.max_age and self.loaded_version >= table_version:
+        return
+      version = self.version
+    rows = loader()
+    with self.lock:
+      self.postings, self.terms, self.documents = {}, [], {}
+      for id, *texts in rows:
+        self._add( id, texts, ordered = False )
+      self.terms.sort()
+      # a write that happened while loading may be missing, so load again on the next search
+      self.loaded = time.monotonic() if self.version == version else None
+      self.loaded_version = table_version
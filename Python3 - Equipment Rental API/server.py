@@ -0,0 +1,66 @@
+'''
+Project: Sample Equipment Rental Application API
+Module:  Production server: the app in pre-forked worker processes, each answering with a pool of threads
+
+'flask --app main serve' runs the app object under gunicorn's process manager: the app is built
+once, then SERVER_WORKERS processes (one per core by default) are forked from it, each answering
+with SERVER_THREADS threads, so one node uses all of its cores.  Idle keep-alive connections are
+kept SERVER_KEEPALIVE seconds, and a worker is replaced after SERVER_MAX_REQUESTS requests (plus a
+random jitter) to bound the growth of a long-running process.  On SIGTERM the workers stop
+accepting, finish the requests in progress within SERVER_GRACEFUL_TIMEOUT seconds and close their
+database connections; SIGHUP replaces the workers the same way, SIGINT stops at once.
+
+A forked worker must not use the database connections it inherited: the app forgets them after a
+fork (see create_app), which also covers gunicorn started on its own ('gunicorn main:app').
+gunicorn doesn't run on Windows, where 'python main.py' stays the way to run the app.
+'''
+
+
+import os
+from gunicorn.app.base import BaseApplication
+
+
+# the gunicorn settings from the app's SERVER_* settings, overridden by the ones given (not None)
+def server_options( config, **overrides ):
+  options = {
+    "bind": config['SERVER_BIND'],
+    "workers": config['SERVER_WORKERS'],
+    "threads": config['SERVER_THREADS'],
+    "keepalive": config['SERVER_KEEPALIVE'],
+    "max_requests": config['SERVER_MAX_REQUESTS'],
+    "max_requests_jitter": config['SERVER_MAX_REQUESTS_JITTER'],
+    "timeout": config['SERVER_TIMEOUT'],
+    "graceful_timeout": config['SERVER_GRACEFUL_TIMEOUT'],
+  }
+  options.update( {name: value for name, value in overrides.items() if value is not None} )
+  # one worker per core by default
+  options['workers'] = options['workers'] or os.cpu_count() or 1
+  # threads need the threaded worker (its main loop also keeps the idle connections alive)
+  options['worker_class'] = 'gthread'
+  if isinstance( options['bind'], str ):
+    options['bind'] = [address.strip() for address in options['bind'].split( ',' )]
+  return options
+
+
+class Server( BaseApplication ):
+  def __init__( self, application, options, on_worker_exit = None ) -> None:
+    # the WSGI app every worker serves (built before the fork, so the workers share its memory)
+    self.application    = application
+    self.options        = options
+    # called in a worker once it stopped serving (to close its database connections)
+    self.on_worker_exit = on_worker_exit
+    super().__init__()
+
+  def load_config( self ):
+    for name, value in self.options.items():
+      self.cfg.set( name, value )
+    if self.on_worker_exit is not None:
+      self.cfg.set( 'worker_exit', lambda server, worker: self.on_worker_exit() )
+
+  def load( self ):
+    return self.application
+
+
+# serve the app until the server is stopped
+def serve( application, options, on_worker_exit = None ):
+  Server( application, options, on_worker_exit ).run()